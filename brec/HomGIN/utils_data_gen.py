@@ -1,3 +1,4 @@
+import numpy as np
 import torch
 import torch_geometric as torch_geo
 from torch_geometric.utils import sort_edge_index, remove_self_loops
@@ -73,14 +74,12 @@ def generate_dataset(data_path, dataset_name, extract_ids_fn, regression):
         
     ### single-threaded computation of subgraph isomoprhisms & creation of data structure
     # else:
-    homcount_file = os.path.join(data_path, f'{dataset_name}_v5_counts.json')
-    with open(homcount_file, 'r') as f:
-        homcount_data = json.load(f)
+    homcount_of = load_homcounts(data_path, dataset_name)
     
     graphs_ptg = list()
     for i, data in tqdm(enumerate(graphs)):
     # for data in tqdm(graphs):
-        homcount_dict = homcount_data[str(i)]['homcounts']
+        homcount_dict = homcount_of(i)
         new_data = _prepare(data, homcount_dict, regression, dataset_name, extract_ids_fn)
         graphs_ptg.append(new_data)
 
@@ -89,6 +88,28 @@ def generate_dataset(data_path, dataset_name, extract_ids_fn, regression):
 
 # ------------------------------------------------------------------------
 
+def load_homcounts(data_path, dataset_name):
+    '''
+        Returns a function i -> homcounts of graph i. Uses the memory-mapped pact
+        count store `<dataset_name>_v5_counts/` if present (rows as a numpy array),
+        otherwise the {vertex: counts} dicts of `<dataset_name>_v5_counts.json`.
+    '''
+    store_path = os.path.join(data_path, f'{dataset_name}_v5_counts')
+    if os.path.isdir(store_path):
+        counts = np.load(os.path.join(store_path, 'counts.npy'), mmap_mode='r')
+        offsets = np.load(os.path.join(store_path, 'offsets.npy'))
+        graph_ids = np.load(os.path.join(store_path, 'graph_ids.npy'))
+        # the i-th graph of the store has to be graph i of the dataset
+        assert np.array_equal(graph_ids, np.arange(len(graph_ids))), f'{store_path} must cover graphs 0..n-1'
+        return lambda i: counts[offsets[i]:offsets[i + 1]]
+
+    homcount_file = os.path.join(data_path, f'{dataset_name}_v5_counts.json')
+    with open(homcount_file, 'r') as f:
+        homcount_data = json.load(f)
+    return lambda i: homcount_data[str(i)]['homcounts']
+
+# ------------------------------------------------------------------------
+
 def _prepare(data, homcount_dict, regression, dataset_name, ex_fn):
 
     new_data = Data()
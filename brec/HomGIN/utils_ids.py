@@ -37,8 +37,16 @@ def homcount_counts2ids(data, homcount_dict):
     else:
         edge_index = remove_self_loops(data.edge_index)[0]
         
-    # parse homcount dict
     num_nodes = data.x.shape[0]
+    if isinstance(homcount_dict, np.ndarray):
+        # rows of a count store, vertices beyond the last counted one are disconnected
+        homcounts = np.zeros((num_nodes, homcount_dict.shape[1]), dtype=np.int64)
+        homcounts[:len(homcount_dict)] = homcount_dict
+        setattr(data, 'edge_index', edge_index)
+        setattr(data, 'identifiers', torch.from_numpy(homcounts))
+        return data
+
+    # parse homcount dict
     homcounts = []
     for i in range(num_nodes):
         try:
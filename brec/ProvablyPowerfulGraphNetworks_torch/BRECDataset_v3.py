@@ -58,9 +58,19 @@ class BRECDataset(InMemoryDataset):
 
     def process(self):
 
-        homcount_file = os.path.join(self.root, f'raw/{DATA_SPLIT_NAME}_v5_counts.json')
-        with open(homcount_file, 'r') as f:
-            homcount_data = json.load(f)
+        # prefer the memory-mapped pact count store over the json counts
+        homcount_store = os.path.join(self.root, f'raw/{DATA_SPLIT_NAME}_v5_counts')
+        if os.path.isdir(homcount_store):
+            store_counts = np.load(os.path.join(homcount_store, 'counts.npy'), mmap_mode='r')
+            store_offsets = np.load(os.path.join(homcount_store, 'offsets.npy'))
+            # the i-th graph of the store has to be graph i of the dataset
+            store_ids = np.load(os.path.join(homcount_store, 'graph_ids.npy'))
+            assert np.array_equal(store_ids, np.arange(len(store_ids))), f'{homcount_store} must cover graphs 0..n-1'
+        else:
+            homcount_file = os.path.join(self.root, f'raw/{DATA_SPLIT_NAME}_v5_counts.json')
+            with open(homcount_file, 'r') as f:
+                homcount_data = json.load(f)
+            store_counts = None
 
         data_list = np.load(self.raw_paths[0], allow_pickle=True)
         data = []
@@ -71,17 +81,21 @@ class BRECDataset(InMemoryDataset):
             node = np.eye(g_networkx.number_of_nodes())
             
             num_nodes = g_networkx.number_of_nodes()
-            homcounts = []
-            for v_idx in range(num_nodes):
-                try:
-                    v_count = homcount_data[str(g_idx)]['homcounts'][str(v_idx)]
-                except:
-                    v_count = [0] * 30
-                    
-                homcounts.append(v_count)
-            
-            
-            homcount_np = np.array(homcounts)            
+            if store_counts is not None:
+                rows = store_counts[store_offsets[g_idx]:store_offsets[g_idx + 1]]
+                homcount_np = np.zeros((num_nodes, 30))
+                homcount_np[:len(rows)] = rows
+            else:
+                homcounts = []
+                for v_idx in range(num_nodes):
+                    try:
+                        v_count = homcount_data[str(g_idx)]['homcounts'][str(v_idx)]
+                    except:
+                        v_count = [0] * 30
+                        
+                    homcounts.append(v_count)
+                
+                homcount_np = np.array(homcounts)            
             graph = np.empty((num_nodes, num_nodes, 31))
             
             for i in range(1, 31):
@@ -0,0 +1,137 @@
+"""
+Pre-collated batches for small graph datasets (ZINC).
+
+The PyG DataLoader builds every batch from individual Data objects, which dominates the time of an
+epoch for small molecules. `PackedGraphs` keeps all graphs of a split in one contiguous store (the
+collated storage of an InMemoryDataset is used as is) and `PackedLoader` cuts batches from it with a
+few gathers: fixed order batches are built once and reused every epoch (unless the counts are
+memory-mapped), shuffled batches gather the rows of their graphs from the store directly.
+"""
+import numpy as np
+
+import torch
+from torch_geometric.data import Batch, InMemoryDataset
+
+
+def _ranges(offsets, graphs):
+    """
+    Returns the rows of `graphs` in a store with row offsets `offsets` (graph i owns rows
+    offsets[i]:offsets[i + 1]) as one index, together with the row offsets of the gathered graphs.
+    """
+    starts = offsets[graphs]
+    sizes = offsets[graphs + 1] - starts
+    new_offsets = torch.zeros(len(graphs) + 1, dtype=torch.long)
+    torch.cumsum(sizes, dim=0, out=new_offsets[1:])
+    rows = torch.repeat_interleave(starts - new_offsets[:-1], sizes) + torch.arange(int(new_offsets[-1]))
+    return rows, new_offsets
+
+
+class PackedGraphs:
+    """
+    All graphs of a dataset with attributes x, edge_index, edge_attr, y and counts in one store.
+    Edge indices are kept local to their graph. The counts may also be the memory-mapped matrix of
+    a ZincMmapCountDataset (one row per vertex), they are then gathered from there.
+    """
+
+    def __init__(self, dataset):
+        if hasattr(dataset, 'zinc_split'):
+            # counts live in a separate shard, the graphs themselves in the ZINC split
+            self._pack(dataset.zinc_split)
+            # the shard has one row per vertex, in the order of the split
+            self.counts = dataset.counts
+            self.count_start = int(dataset.offsets[dataset.graph_offset])
+        else:
+            self._pack(dataset)
+            self.count_start = 0
+
+    def _pack(self, dataset):
+        if isinstance(dataset, InMemoryDataset) and dataset._indices is None and dataset.transform is None:
+            data, slices = dataset._data, dataset.slices
+        else:
+            data, slices = InMemoryDataset.collate([dataset[i] for i in range(len(dataset))])
+
+        self.x = data.x
+        self.edge_index = data.edge_index
+        self.edge_attr = data.edge_attr
+        self.y = data.y
+        self.counts = getattr(data, 'counts', None)
+        self.node_offsets = slices['x']
+        self.edge_offsets = slices['edge_index']
+        self.y_offsets = slices['y']
+
+    def __len__(self):
+        return len(self.node_offsets) - 1
+
+    @property
+    def in_memory(self):
+        """False if the counts are gathered from a memory-mapped shard."""
+        return self.counts is None or isinstance(self.counts, torch.Tensor)
+
+    def _gather_counts(self, node_rows):
+        if isinstance(self.counts, torch.Tensor):
+            return self.counts[node_rows]
+        return torch.from_numpy(np.ascontiguousarray(self.counts[(node_rows + self.count_start).numpy()]))
+
+    def batch(self, graphs):
+        """Collates the graphs with the given indices (in this order) into one Batch."""
+        graphs = torch.as_tensor(graphs, dtype=torch.long)
+        node_rows, node_offsets = _ranges(self.node_offsets, graphs)
+        edge_rows, edge_offsets = _ranges(self.edge_offsets, graphs)
+        y_rows, _ = _ranges(self.y_offsets, graphs)
+
+        num_nodes = node_offsets[1:] - node_offsets[:-1]
+        num_edges = edge_offsets[1:] - edge_offsets[:-1]
+        edge_index = self.edge_index[:, edge_rows] + torch.repeat_interleave(node_offsets[:-1], num_edges)
+
+        attrs = dict(
+            x=self.x[node_rows],
+            edge_index=edge_index,
+            edge_attr=self.edge_attr[edge_rows] if self.edge_attr is not None else None,
+            y=self.y[y_rows],
+            batch=torch.repeat_interleave(torch.arange(len(graphs)), num_nodes),
+            ptr=node_offsets,
+        )
+        if self.counts is not None:
+            attrs['counts'] = self._gather_counts(node_rows)
+        return Batch(**{key: value for key, value in attrs.items() if value is not None})
+
+
+class PackedLoader:
+    """
+    Drop-in replacement for the PyG DataLoader over a `PackedGraphs` store. Without shuffling, the
+    batches are collated on the first pass (and moved to `device` if given) and, if `cache`, reused
+    afterwards. By default only in-memory stores are cached, the cached batches of a memory-mapped
+    store would hold all of its counts. With shuffling, every epoch draws a new permutation from the
+    global torch RNG and gathers the batches from the store.
+    """
+
+    def __init__(self, packed, batch_size, shuffle=False, device=None, cache=None):
+        self.packed = packed
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.device = device
+        self.cache = packed.in_memory if cache is None else cache
+        self._cached = None
+
+    def __len__(self):
+        return (len(self.packed) + self.batch_size - 1) // self.batch_size
+
+    def __iter__(self):
+        if self.shuffle:
+            order = torch.randperm(len(self.packed))
+            for start in range(0, len(order), self.batch_size):
+                yield self.packed.batch(order[start:start + self.batch_size])
+            return
+
+        if not self.cache:
+            yield from self._fixed_batches()
+            return
+
+        if self._cached is None:
+            self._cached = list(self._fixed_batches())
+        yield from self._cached
+
+    def _fixed_batches(self):
+        for start in range(0, len(self.packed), self.batch_size):
+            batch = self.packed.batch(torch.arange(start, min(start + self.batch_size, len(self.packed))))
+            yield batch.to(self.device) if self.device is not None else batch
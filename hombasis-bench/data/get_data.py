@@ -1,160 +1,321 @@
 import os
 import json
+import hashlib
 import numpy as np
 
 import torch
-from torch_geometric.data import Data
+from torch_geometric.data import Data, Dataset, InMemoryDataset
 from torch_geometric.datasets import ZINC
 
 from ogb.linkproppred import PygLinkPropPredDataset
 
 
-def load_zinc_subcount_dataset(name, sub_file, idx_list, root):    
-    if name == "ZINC":
-        train_data, val_data, test_data = load_zinc_dataset(name, root)
-        
-    original_data = train_data + val_data + test_data
+def load_count_store(path):
+    """
+    Memory-maps a columnar count store written by pact (`python -m pact.count` or
+    `python -m pact.countstore`). Returns the (num_vertices, dim) count matrix and
+    the row offsets, the counts of graph i are counts[offsets[i]:offsets[i + 1]].
+    """
+    counts = np.load(os.path.join(path, 'counts.npy'), mmap_mode='r')
+    offsets = np.load(os.path.join(path, 'offsets.npy'))
+    graph_ids = np.load(os.path.join(path, 'graph_ids.npy'))
+    assert np.array_equal(graph_ids, np.arange(len(graph_ids))), 'count store must cover graphs 0..n-1'
+    return counts, offsets
 
-    sub_data = json.load(open(os.path.join(root, sub_file)))
-        
-    subcount_dataset = []
-    for graph_idx in range(len(original_data)):
 
-        graph_counts = []
-        for v_idx in range(len(original_data[graph_idx].x)):
+def count_reader(path, field=None):
+    """
+    Returns a function (graph_idx, num_nodes) -> (num_nodes, dim) array of vertex counts from a json
+    file of the form {graph_idx: {field: {v_idx: counts}}} ({graph_idx: {v_idx: counts}} if field
+    is None). Vertices missing from the file get zero counts.
+    """
+    data = json.load(open(path))
+    if field is not None:
+        data = {graph_idx: graph[field] for graph_idx, graph in data.items()}
+    dim = next((len(counts) for graph in data.values() for counts in graph.values()), 0)
 
-            vertex_counts = sub_data[str(graph_idx)]['subcounts'][str(v_idx)]
-            if len(idx_list) > 0:
-                vertex_counts = np.array(vertex_counts)[idx_list].tolist()
-                
-            graph_counts.append(vertex_counts)
-            
-        subcount_dataset.append(
-            Data(
-                x = original_data[graph_idx].x, 
-                edge_index = original_data[graph_idx].edge_index, 
-                edge_attr = original_data[graph_idx].edge_attr, 
-                y = original_data[graph_idx].y,
-                counts = torch.Tensor(graph_counts),
-            )
-        )
+    def read(graph_idx, num_nodes):
+        graph = data[str(graph_idx)]
+        rows = [graph.get(str(v_idx), [0] * dim) for v_idx in range(num_nodes)]
+        return np.array(rows).reshape(num_nodes, dim)
+    return read
 
-    assert len(subcount_dataset) == len(original_data)
 
-    new_train_data = subcount_dataset[:len(train_data)]
-    val_split = len(train_data) + len(val_data)
-    new_val_data = subcount_dataset[len(train_data):val_split]
-    new_test_data = subcount_dataset[val_split:]
-    
-    subcount_dim = subcount_dataset[0].counts.size()[1]
-    
-    return new_train_data, new_val_data, new_test_data, subcount_dim
+def graph_count_matrix(path, sizes, field=None, start=0):
+    """
+    Reads the vertex counts of graphs start..start+len(sizes)-1 into one (sum(sizes), dim) matrix,
+    graph start+i owns sizes[i] consecutive rows. Graphs with fewer rows in the count file are
+    padded with zeros (isolated vertices never show up in the json counts).
+    """
+    sizes = np.asarray(sizes, dtype=np.int64)
+    if not os.path.isdir(path):
+        read = count_reader(path, field)
+        return np.concatenate([read(start + i, num_nodes) for i, num_nodes in enumerate(sizes)])
+
+    counts, offsets = load_count_store(path)
+    assert len(offsets) > start + len(sizes), f'{path} has counts for fewer graphs than the dataset'
+    offsets = offsets[start:start + len(sizes) + 1]
+    store_sizes = np.diff(offsets)
+    if np.array_equal(store_sizes, sizes):
+        return counts[offsets[0]:offsets[-1]]
+
+    # copy the rows of all graphs at once, row j of graph i goes from offsets[i] + j to dst[i] + j
+    take = np.minimum(store_sizes, sizes)
+    dst_offsets = np.zeros(len(sizes) + 1, dtype=np.int64)
+    np.cumsum(sizes, out=dst_offsets[1:])
+    within = np.arange(take.sum()) - np.repeat(np.cumsum(take) - take, take)
+    graph_counts = np.zeros((dst_offsets[-1], counts.shape[1]), dtype=counts.dtype)
+    graph_counts[np.repeat(dst_offsets[:-1], take) + within] = counts[np.repeat(offsets[:-1], take) + within]
+    return graph_counts
+
+
+def _file_signature(path):
+    """Identifies a count file (or store) by path, size and modification time without reading it."""
+    if os.path.isdir(path):
+        path = os.path.join(path, 'counts.npy')
+    stat = os.stat(path)
+    return [os.path.abspath(path), stat.st_size, stat.st_mtime_ns]
 
 
-def load_zinc_homcount_dataset(name, hom_files, idx_list, root):    
-    if name == "ZINC":
-        train_data, val_data, test_data = load_zinc_dataset(name, root)
+def _count_cache_dir(root, count_files, idx_list, field, sub_file, subset):
+    """<root>/ZINC/counts/<key>, the key covers the count files, `idx_list` and all other arguments."""
+    files = list(count_files) + ([sub_file] if sub_file is not None else [])
+    key = json.dumps({
+        'files': [_file_signature(os.path.join(root, f)) for f in files],
+        'idx_list': list(idx_list),
+        'field': field,
+        'sub_file': sub_file,
+        'subset': subset,
+    }, sort_keys=True)
+    return os.path.join(root, 'ZINC', 'counts', hashlib.sha1(key.encode()).hexdigest()[:16])
+
+
+class ZincCountDataset(InMemoryDataset):
+    """
+    A split of ZINC with the vertex counts of `count_files` attached to every graph as `counts`.
+    
+    The counts of all graphs are read once into a single matrix, reduced to the columns in
+    `idx_list` with one gather, and the collated splits are cached under
+    <root>/ZINC/counts/<key>, where the key covers the count files, `idx_list` and all other
+    arguments. Later runs (and other seeds) load the cached split directly.
+    
+    `field` is the per graph field of the json count files. The counts of `sub_file` are appended
+    after the selected columns; for anchored subgraph counts the last two columns are dropped.
+    """
+    
+    def __init__(self, root, count_files, idx_list, field='homcounts', sub_file=None, split='train', subset=True):
+        assert split in ['train', 'val', 'test']
+        self.zinc_root = root
+        self.count_files = list(count_files)
+        self.idx_list = list(idx_list)
+        self.field = field
+        self.sub_file = sub_file
+        self.subset = subset
+        
+        super().__init__(_count_cache_dir(root, count_files, idx_list, field, sub_file, subset))
+        self.load(self.processed_paths[['train', 'val', 'test'].index(split)])
+    
+    @property
+    def raw_file_names(self):
+        return []
+    
+    @property
+    def processed_file_names(self):
+        return ['train.pt', 'val.pt', 'test.pt']
+    
+    def download(self):
+        pass
+    
+    def count_matrix(self, sizes):
+        counts = np.concatenate(
+            [graph_count_matrix(os.path.join(self.zinc_root, f), sizes, field=self.field) for f in self.count_files],
+            axis=1)
+        if len(self.idx_list) > 0:
+            counts = counts[:, self.idx_list]
+        
+        if self.sub_file is not None:
+            anchored = "anchor" in self.sub_file
+            sub_counts = graph_count_matrix(os.path.join(self.zinc_root, self.sub_file), sizes,
+                                            field='subcounts' if anchored else None)
+            if anchored:
+                sub_counts = sub_counts[:, :-2]
+            counts = np.concatenate([counts, sub_counts], axis=1)
         
-    original_data = train_data + val_data + test_data
+        return torch.from_numpy(np.ascontiguousarray(counts, dtype=np.float32))
     
-    all_hom_data = []
-    for hom_file in hom_files:
-        hom_path = os.path.join(root, hom_file)
-        hom_data = json.load(open(hom_path))
-        all_hom_data.append(hom_data)
+    def process(self):
+        splits = load_zinc_dataset('ZINC', self.zinc_root, subset=self.subset)
+        sizes = np.concatenate([np.diff(split.slices['x'].numpy()) for split in splits])
         
-    homcount_dataset = []
-    for graph_idx in range(len(original_data)):
+        counts = self.count_matrix(sizes)
+        offsets = np.zeros(len(sizes) + 1, dtype=np.int64)
+        np.cumsum(sizes, out=offsets[1:])
         
-        graph_counts = []
-        for v_idx in range(len(original_data[graph_idx].x)):
-            
-            vertex_counts = []
-            for hom_list in all_hom_data:
-                homcounts = hom_list[str(graph_idx)]['homcounts'][str(v_idx)]
-                vertex_counts += homcounts
-            
-            if len(idx_list) > 0:
-                vertex_counts = np.array(vertex_counts)[idx_list].tolist()
+        graph_idx = 0
+        for split, path in zip(splits, self.processed_paths):
+            data_list = []
+            for data in split:
+                data_list.append(
+                    Data(
+                        x = data.x,
+                        edge_index = data.edge_index,
+                        edge_attr = data.edge_attr,
+                        y = data.y,
+                        counts = counts[offsets[graph_idx]:offsets[graph_idx + 1]],
+                    )
+                )
+                graph_idx += 1
+            self.save(data_list, path)
 
-            graph_counts.append(vertex_counts)
-                        
-        homcount_dataset.append(
-            Data(
-                x = original_data[graph_idx].x, 
-                edge_index = original_data[graph_idx].edge_index, 
-                edge_attr = original_data[graph_idx].edge_attr, 
-                y = original_data[graph_idx].y,
-                counts = torch.Tensor(graph_counts),
-            )
-        )
 
-    assert len(homcount_dataset) == len(original_data)
+"""
+Streaming ingestion for the full ZINC dataset (250k graphs), where the counts don't fit into memory as
+Python objects. The counts are written block by block into a memory-mapped matrix on disk and the
+training data reads the rows of a graph from there when it is loaded.
+"""
 
-    new_train_data = homcount_dataset[:len(train_data)]
-    val_split = len(train_data) + len(val_data)
-    new_val_data = homcount_dataset[len(train_data):val_split]
-    new_test_data = homcount_dataset[val_split:]
+
+def _json_graph_items(f):
+    """Iterates over the top level (graph_idx, values) of a json count file, incrementally if ijson is installed."""
+    try:
+        import ijson
+    except ImportError:
+        print('ijson is not installed, reading the whole count file into memory')
+        return iter(json.load(f).items())
+    return ijson.kvitems(f, '', use_float=True)
+
+
+def iter_graph_counts(path, sizes, field=None, block_size=4096):
+    """
+    Yields (first_graph, counts) blocks of the vertex counts of graphs 0..len(sizes)-1, where counts
+    holds the rows of consecutive graphs starting at first_graph. Count stores are read in blocks of
+    `block_size` graphs, json files one graph at a time without loading the whole file.
+    """
+    if os.path.isdir(path):
+        for start in range(0, len(sizes), block_size):
+            yield start, graph_count_matrix(path, sizes[start:start + block_size], start=start)
+        return
     
-    homcount_dim = homcount_dataset[0].counts.size()[1]
+    with open(path, 'rb') as f:
+        for graph_idx, vertex_counts in _json_graph_items(f):
+            graph_idx = int(graph_idx)
+            if graph_idx >= len(sizes):
+                continue
+            if field is not None:
+                vertex_counts = vertex_counts[field]
+            if len(vertex_counts) == 0:
+                continue
+            rows = np.array(list(vertex_counts.values()), dtype=np.float64)
+            graph_counts = np.zeros((sizes[graph_idx], rows.shape[1]), dtype=np.float64)
+            graph_counts[[int(v_idx) for v_idx in vertex_counts.keys()]] = rows
+            yield graph_idx, graph_counts
+
+
+def _count_dim(path, sizes, field):
+    block = next(iter_graph_counts(path, sizes, field, block_size=1), None)
+    return block[1].shape[1] if block is not None else 0
+
+
+def write_count_shard(path, root, sizes, count_files, idx_list, field='homcounts', sub_file=None):
+    """
+    Writes the counts of all graphs as one (sum(sizes), dim) float32 matrix `counts.npy` with row
+    offsets `offsets.npy` to the directory `path`, selecting and ordering the columns as
+    ZincCountDataset does. Only one block of every count file is in memory at a time.
+    """
+    sizes = np.asarray(sizes, dtype=np.int64)
+    offsets = np.zeros(len(sizes) + 1, dtype=np.int64)
+    np.cumsum(sizes, out=offsets[1:])
+    
+    # (file, field, columns of the file, their columns in the output)
+    sources = []
+    dims = [_count_dim(os.path.join(root, f), sizes, field) for f in count_files]
+    selected = list(idx_list) if len(idx_list) > 0 else list(range(sum(dims)))
+    first_col = 0
+    for count_file, dim in zip(count_files, dims):
+        out_cols = [j for j, c in enumerate(selected) if first_col <= c < first_col + dim]
+        if len(out_cols) > 0:
+            sources.append((count_file, field, [selected[j] - first_col for j in out_cols], out_cols))
+        first_col += dim
+    width = len(selected)
     
-    return new_train_data, new_val_data, new_test_data, homcount_dim
+    if sub_file is not None:
+        anchored = "anchor" in sub_file
+        sub_field = 'subcounts' if anchored else None
+        sub_dim = _count_dim(os.path.join(root, sub_file), sizes, sub_field) - (2 if anchored else 0)
+        sources.append((sub_file, sub_field, list(range(sub_dim)), list(range(width, width + sub_dim))))
+        width += sub_dim
+    
+    os.makedirs(path, exist_ok=True)
+    tmp_path = os.path.join(path, 'counts.tmp.npy')
+    counts = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=np.float32, shape=(offsets[-1], width))
+    for count_file, file_field, file_cols, out_cols in sources:
+        for first, block in iter_graph_counts(os.path.join(root, count_file), sizes, file_field):
+            counts[offsets[first]:offsets[first] + len(block), out_cols] = block[:, file_cols]
+    counts.flush()
+    del counts
+    
+    np.save(os.path.join(path, 'offsets.npy'), offsets)
+    os.replace(tmp_path, os.path.join(path, 'counts.npy'))
 
 
-def load_zinc_subhom_dataset(name, hom_files, idx_list, sub_file, root):    
-    if name == "ZINC":
-        train_data, val_data, test_data = load_zinc_dataset(name, root)
-        
-    original_data = train_data + val_data + test_data
+class ZincMmapCountDataset(Dataset):
+    """
+    A split of ZINC whose vertex counts are read from a memory-mapped count shard (see
+    `write_count_shard`) whenever a graph is loaded. Graph i of the split is graph
+    graph_offset + i of the shard.
+    """
     
-    all_hom_data = []
-    for hom_file in hom_files:
-        hom_path = os.path.join(root, hom_file)
-        hom_data = json.load(open(hom_path))
-        all_hom_data.append(hom_data)
-        
-    sub_data = json.load(open(os.path.join(root, sub_file)))
-    homcount_dataset = []
-    for graph_idx in range(len(original_data)):
-        
-        graph_counts = []
-        for v_idx in range(len(original_data[graph_idx].x)):
-            
-            vertex_counts = []
-            for hom_list in all_hom_data:
-                homcounts = hom_list[str(graph_idx)]['homcounts'][str(v_idx)]
-                vertex_counts += homcounts
-                
-            if len(idx_list) > 0:
-                vertex_counts = np.array(vertex_counts)[idx_list].tolist()
-
-            if "anchor" in sub_file:
-                sub_counts = sub_data[str(graph_idx)]['subcounts'][str(v_idx)][:-2] # for anchored spasm
-            else:
-                sub_counts = sub_data[str(graph_idx)][str(v_idx)] # for spasm
-            vertex_counts += sub_counts
-            graph_counts.append(vertex_counts)
-                        
-        homcount_dataset.append(
-            Data(
-                x = original_data[graph_idx].x, 
-                edge_index = original_data[graph_idx].edge_index, 
-                edge_attr = original_data[graph_idx].edge_attr, 
-                y = original_data[graph_idx].y,
-                counts = torch.Tensor(graph_counts),
-            )
-        )
-
-    assert len(homcount_dataset) == len(original_data)
-
-    new_train_data = homcount_dataset[:len(train_data)]
-    val_split = len(train_data) + len(val_data)
-    new_val_data = homcount_dataset[len(train_data):val_split]
-    new_test_data = homcount_dataset[val_split:]
-    
-    homcount_dim = homcount_dataset[0].counts.size()[1]
-    
-    return new_train_data, new_val_data, new_test_data, homcount_dim
+    def __init__(self, zinc_split, shard_dir, graph_offset):
+        super().__init__()
+        self.zinc_split = zinc_split
+        self.counts = np.load(os.path.join(shard_dir, 'counts.npy'), mmap_mode='r')
+        self.offsets = np.load(os.path.join(shard_dir, 'offsets.npy'))
+        self.graph_offset = graph_offset
+    
+    def len(self):
+        return len(self.zinc_split)
+    
+    def get(self, idx):
+        data = self.zinc_split[idx]
+        graph_idx = self.graph_offset + idx
+        data.counts = torch.from_numpy(np.array(self.counts[self.offsets[graph_idx]:self.offsets[graph_idx + 1]]))
+        return data
+
+
+def load_zinc_count_shards(root, count_files, idx_list, field='homcounts', sub_file=None):
+    splits = load_zinc_dataset('ZINC', root, subset=False)
+    shard_dir = _count_cache_dir(root, count_files, idx_list, field, sub_file, subset=False)
+    if not os.path.exists(os.path.join(shard_dir, 'counts.npy')):
+        sizes = np.concatenate([np.diff(split.slices['x'].numpy()) for split in splits])
+        write_count_shard(shard_dir, root, sizes, count_files, idx_list, field=field, sub_file=sub_file)
+    
+    graph_offsets = np.cumsum([0] + [len(split) for split in splits])
+    datasets = [ZincMmapCountDataset(split, shard_dir, int(offset)) for split, offset in zip(splits, graph_offsets)]
+    return (*datasets, datasets[0].counts.shape[1])
+
+
+def load_zinc_count_splits(root, count_files, idx_list, field='homcounts', sub_file=None, subset=True):
+    if not subset:
+        return load_zinc_count_shards(root, count_files, idx_list, field=field, sub_file=sub_file)
+    splits = [ZincCountDataset(root, count_files, idx_list, field=field, sub_file=sub_file, split=split)
+              for split in ['train', 'val', 'test']]
+    count_dim = splits[0][0].counts.size()[1]
+    return (*splits, count_dim)
+
+
+def load_zinc_subcount_dataset(name, sub_file, idx_list, root, subset=True):    
+    assert name == "ZINC"
+    return load_zinc_count_splits(root, [sub_file], idx_list, field='subcounts', subset=subset)
+
+
+def load_zinc_homcount_dataset(name, hom_files, idx_list, root, subset=True):    
+    assert name == "ZINC"
+    return load_zinc_count_splits(root, hom_files, idx_list, field='homcounts', subset=subset)
+
+
+def load_zinc_subhom_dataset(name, hom_files, idx_list, sub_file, root, subset=True):    
+    assert name == "ZINC"
+    return load_zinc_count_splits(root, hom_files, idx_list, field='homcounts', sub_file=sub_file, subset=subset)
 
         
 def load_zinc_dataset(name, root, subset=True, pre_transform=None, transform=None):
@@ -178,36 +339,65 @@ def load_zinc_dataset(name, root, subset=True, pre_transform=None, transform=Non
     return train_data, val_data, test_data
 
 
+def load_collab_count_matrix(path, num_nodes):
+    """Reads the (num_nodes, dim) counts of the COLLAB graph from a count store or a {v_idx: counts} json file."""
+    if os.path.isdir(path):
+        counts, offsets = load_count_store(path)
+        graph_counts = np.zeros((num_nodes, counts.shape[1]), dtype=counts.dtype)
+        graph_counts[:offsets[1]] = counts[offsets[0]:offsets[1]]
+        return graph_counts
+    
+    hom_data = json.load(open(path))
+    return np.array([hom_data[str(v_idx)] for v_idx in range(num_nodes)])
+
+
+def load_collab_count_tensor(root, num_nodes, hom_files, idx_list, count_type=None):
+    """
+    The (num_nodes, dim) float32 count tensor of COLLAB: the counts of `hom_files`, reduced to the
+    columns in `idx_list` and, if `count_type` is given, followed by the subgraph count column
+    obtained as the weighted sum of the selected counts with the `path_coeffs.json` coefficients.
+    The tensor is cached in <root>/counts/, keyed by the count files and all other arguments.
+    """
+    idx_list = list(idx_list or [])
+    key = json.dumps({
+        'files': [_file_signature(os.path.join(root, f)) for f in hom_files],
+        'idx_list': idx_list,
+        'count_type': count_type,
+        'num_nodes': num_nodes,
+    }, sort_keys=True)
+    cache_path = os.path.join(root, 'counts', hashlib.sha1(key.encode()).hexdigest()[:16] + '.npy')
+    if os.path.exists(cache_path):
+        return torch.from_numpy(np.load(cache_path))
+    
+    counts = np.concatenate(
+        [load_collab_count_matrix(os.path.join(root, hom_file), num_nodes) for hom_file in hom_files],
+        axis=1).astype(np.float64)
+    if len(idx_list) > 0:
+        counts = counts[:, idx_list]
+    
+    if count_type is not None:
+        coeffs = json.load(open(os.path.join(root, 'path_coeffs.json')))[count_type]
+        sub_counts = counts @ np.asarray(coeffs, dtype=np.float64)
+        counts = np.concatenate([counts, sub_counts[:, None]], axis=1)
+    
+    counts = np.ascontiguousarray(counts, dtype=np.float32)
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    tmp_path = cache_path[:-len('.npy')] + '.tmp.npy'
+    np.save(tmp_path, counts)
+    os.replace(tmp_path, cache_path)
+    return torch.from_numpy(counts)
+
+
 def load_collab_counts(root, use_counts, hom_files=None, idx_list=None):
     dataset = PygLinkPropPredDataset(name = "ogbl-collab", root=root)
     data = dataset[0]
     data.use_counts = use_counts
     data.count_dim = 0
 
-    all_hom_data = []
-    for hom_file in hom_files:
-        hom_path = os.path.join(root, hom_file)
-        hom_data = json.load(open(hom_path))
-        all_hom_data.append(hom_data)
-    
-    graph_counts = []
-    for v_idx in range(dataset.num_nodes):
-        
-        vertex_counts = []
-        for hom_list in all_hom_data:
-            homcounts = hom_list[str(v_idx)]
-            vertex_counts += homcounts
-                    
-        if len(idx_list) > 0:
-            vertex_counts = np.array(vertex_counts)[idx_list].tolist()
-
-        graph_counts.append(vertex_counts)
-    
-    counts = torch.Tensor(graph_counts)
-    data.counts = counts
+    data.counts = load_collab_count_tensor(root, dataset.num_nodes, hom_files, idx_list)
     
     if use_counts:
-        data.count_dim = len(vertex_counts)
+        data.count_dim = data.counts.size(1)
             
     return dataset, data
 
@@ -218,33 +408,9 @@ def load_collab_multsum_counts(root, use_counts, count_type, hom_files=None, idx
     data.use_counts = use_counts
     data.count_dim = 0
 
-    all_hom_data = []
-    for hom_file in hom_files:
-        hom_path = os.path.join(root, hom_file)
-        hom_data = json.load(open(hom_path))
-        all_hom_data.append(hom_data)
-    
-    coeffs = json.load(open(os.path.join(root, 'path_coeffs.json')))[count_type]
-    
-    graph_counts = []
-    for v_idx in range(dataset.num_nodes):
-        
-        vertex_counts = []
-        for hom_list in all_hom_data:
-            homcounts = hom_list[str(v_idx)]
-            vertex_counts += homcounts
-                    
-        if len(idx_list) > 0:
-            vertex_counts = np.array(vertex_counts)[idx_list].tolist()
-
-        sub_count = np.sum(np.multiply(vertex_counts, coeffs))
-        vertex_counts.append(sub_count)
-        graph_counts.append(vertex_counts)
-    
-    counts = torch.Tensor(graph_counts)
-    data.counts = counts
+    data.counts = load_collab_count_tensor(root, dataset.num_nodes, hom_files, idx_list, count_type=count_type)
     
     if use_counts:
-        data.count_dim = len(vertex_counts)
+        data.count_dim = data.counts.size(1)
             
-    return dataset, data
\ No newline at end of file
+    return dataset, data
@@ -3,7 +3,7 @@ import torch.nn as nn
 from torch_geometric.nn.models import MLP
 from torch_geometric.nn.encoding import PositionalEncoding
 from torch_geometric.utils import scatter
-from models.layers import GCNLayer, GATLayer, GINLayer, MLPReadout, GINLayerSig
+from models.layers import GCNLayer, GATLayer, GINLayer, MLPReadout, GINLayerSig, FusedInput
 
 
 class GINGraphReg(nn.Module):
@@ -16,6 +16,7 @@ class GINGraphReg(nn.Module):
             batch_norm: bool,
             residual: bool,
             readout: str,
+            fused_input: bool = False,
         ):
         
         super(GINGraphReg, self).__init__()
@@ -39,9 +40,14 @@ class GINGraphReg(nn.Module):
         else:
             concat_feature_dim = hidden_dim
         
+        # project [atom_h, count_h] as a sum of two projections before the first layer instead of concatenating
+        self.fused_input = fused_input and count_dim > 0
+        if self.fused_input:
+            self.input_proj = FusedInput(hidden_dim, count_dim, hidden_dim, bias=False)
+        
         # GIN message passing layers
         self.convs = nn.ModuleList([GINLayer(hidden_dim, hidden_dim, batch_norm=batch_norm, residual=residual) for _ in range(self.num_layers-1)])
-        self.convs.insert(0, GINLayer(concat_feature_dim, hidden_dim, batch_norm=batch_norm, residual=residual))
+        self.convs.insert(0, GINLayer(concat_feature_dim, hidden_dim, batch_norm=batch_norm, residual=residual, pre_projected=self.fused_input))
 
         # decoder
         self.decoder = MLPReadout(hidden_dim, 1)
@@ -49,15 +55,18 @@ class GINGraphReg(nn.Module):
         
     def forward(self, x, edge_index, counts, use_counts, batch):        
         # encode features
-        atom_h = self.atom_encoder(x)
-        atom_h = torch.squeeze(atom_h)
-        
-        if use_counts:
+        if use_counts and self.fused_input:
+            h = self.input_proj(x, self.atom_encoder, self.count_encoder(counts))
+            
+        elif use_counts:
+            atom_h = self.atom_encoder(x)
+            atom_h = torch.squeeze(atom_h)
             count_h = self.count_encoder(counts)
             h = torch.cat((atom_h, count_h), dim=1)
             
         else:
-            h = atom_h
+            atom_h = self.atom_encoder(x)
+            h = torch.squeeze(atom_h)
             
         for layer in self.convs:
             h = layer(x=h, edge_index=edge_index)
@@ -78,6 +87,7 @@ class GCNGraphReg(torch.nn.Module):
             batch_norm: bool,
             residual: bool,
             readout: str,
+            fused_input: bool = False,
         ):
         
         super(GCNGraphReg, self).__init__()
@@ -99,23 +109,30 @@ class GCNGraphReg(torch.nn.Module):
         
         concat_feature_dim = hidden_dim + count_dim
         
+        # project [atom_h, count_h] as a sum of two projections before the first layer instead of concatenating
+        self.fused_input = fused_input and count_dim > 0
+        if self.fused_input:
+            self.input_proj = FusedInput(hidden_dim, count_dim, hidden_dim, bias=False, glorot=True)
+        
         # GCN message passing layers        
         self.convs = nn.ModuleList([GCNLayer(hidden_dim, hidden_dim, batch_norm=batch_norm, residual=residual) for _ in range(self.num_layers-1)])
-        self.convs.insert(0, GCNLayer(concat_feature_dim, hidden_dim, batch_norm=batch_norm, residual=residual))
+        self.convs.insert(0, GCNLayer(concat_feature_dim, hidden_dim, batch_norm=batch_norm, residual=residual, pre_projected=self.fused_input))
         
         # decoder
         self.decoder = MLPReadout(hidden_dim, 1)
         
     def forward(self, x, edge_index, counts, use_counts, batch):        
         # encode features
-        atom_h = self.atom_encoder(x)
-        atom_h = torch.squeeze(atom_h)
-        
-        if use_counts:
+        if use_counts and self.fused_input:
+            h = self.input_proj(x, self.atom_encoder, self.count_encoder(counts))
+        elif use_counts:
+            atom_h = self.atom_encoder(x)
+            atom_h = torch.squeeze(atom_h)
             count_h = self.count_encoder(counts)
             h = torch.cat((atom_h, count_h), dim=1)
         else:
-            h = atom_h
+            atom_h = self.atom_encoder(x)
+            h = torch.squeeze(atom_h)
 
         # model step
         for conv in self.convs:
@@ -139,6 +156,7 @@ class GATGraphReg(torch.nn.Module):
             batch_norm: bool,
             residual: bool,
             readout: str,
+            fused_input: bool = False,
         ):
         
         super(GATGraphReg, self).__init__()
@@ -161,7 +179,12 @@ class GATGraphReg(torch.nn.Module):
         
         concat_feature_dim = head_hidden_dim + count_dim
         
-        self.prepare_gat = nn.Linear(concat_feature_dim, head_hidden_dim)
+        # project [atom_h, count_h] as a sum of two projections instead of concatenating
+        self.fused_input = fused_input and count_dim > 0
+        if self.fused_input:
+            self.prepare_gat = FusedInput(head_hidden_dim, count_dim, head_hidden_dim)
+        else:
+            self.prepare_gat = nn.Linear(concat_feature_dim, head_hidden_dim)
         
         # GAT message passing layers        
         self.convs = nn.ModuleList([GATLayer(head_hidden_dim, hidden_dim, num_heads, batch_norm=batch_norm, residual=residual) for _ in range(self.num_layers-1)])
@@ -172,15 +195,17 @@ class GATGraphReg(torch.nn.Module):
         
     def forward(self, x, edge_index, counts, use_counts, batch):        
         # encode features
-        atom_h = self.atom_encoder(x)
-        atom_h = torch.squeeze(atom_h)
-        
-        if use_counts:
+        if use_counts and self.fused_input:
+            h = self.prepare_gat(x, self.atom_encoder, self.count_encoder(counts))
+        elif use_counts:
+            atom_h = self.atom_encoder(x)
+            atom_h = torch.squeeze(atom_h)
             count_h = self.count_encoder(counts)
             h = torch.cat((atom_h, count_h), dim=1)
             h = self.prepare_gat(h)
         else:
-            h = atom_h
+            atom_h = self.atom_encoder(x)
+            h = torch.squeeze(atom_h)
 
         # model step
         for conv in self.convs:
@@ -1,3 +1,5 @@
+import math
+import torch
 import torch.nn as nn
 import torch.nn.functional as F
 from torch_geometric.nn.models import MLP
@@ -10,20 +12,25 @@ from torch_geometric.nn.conv import GINConv, GCNConv, GATConv
     https://arxiv.org/pdf/1810.00826.pdf
 """
 class GINLayer(nn.Module):
-    def __init__(self, in_dim, out_dim, batch_norm, residual):
+    def __init__(self, in_dim, out_dim, batch_norm, residual, pre_projected=False):
         super().__init__()
         self.in_channels = in_dim
         self.out_channels = out_dim
         self.batch_norm = batch_norm
         self.residual = residual
 
-        if in_dim != out_dim:
+        if in_dim != out_dim or pre_projected:
             self.residual = False
             
         self.batchnorm_h = nn.BatchNorm1d(out_dim)
             
         # note: batchnorm included in default MLP
         self.conv = GINConv(MLP(in_channels=in_dim, hidden_channels=out_dim, out_channels=out_dim, num_layers=2), train_eps=True)
+        
+        if pre_projected:
+            # the input (of in_dim features) was projected to out_dim by a FusedInput already,
+            # which commutes with the aggregation, so only the bias of the first linear layer is left
+            self.conv.nn.lins[0] = ProjectedInput(out_dim, fan_in=in_dim)
 
     def forward(self, x, edge_index):
         h_in = x # for residual connection
@@ -79,19 +86,24 @@ class GINLayerSig(nn.Module):
     http://arxiv.org/abs/1609.02907
 """
 class GCNLayer(nn.Module):
-    def __init__(self, in_dim, out_dim, batch_norm, residual):
+    def __init__(self, in_dim, out_dim, batch_norm, residual, pre_projected=False):
         super().__init__()
         self.in_channels = in_dim
         self.out_channels = out_dim
         self.batch_norm = batch_norm
         self.residual = residual
         
-        if in_dim != out_dim:
+        if in_dim != out_dim or pre_projected:
             self.residual = False
         
         self.batchnorm_h = nn.BatchNorm1d(out_dim)
         self.conv = GCNConv(in_dim, out_dim, add_self_loops=False, normalize=True)
         
+        if pre_projected:
+            # the input (of in_dim features) was projected to out_dim by a FusedInput already,
+            # GCNConv adds its bias after the propagation
+            self.conv.lin = ProjectedInput(out_dim, bias=False)
+        
     def forward(self, x, edge_index):
         h_in = x   # to be used for residual connection
         
@@ -144,6 +156,66 @@ class GATLayer(nn.Module):
         return h
     
     
+"""
+    Fused input block: Linear([atom_h, count_h]) as the sum of two projections
+"""
+class FusedInput(nn.Module):
+    """
+        Computes Linear(cat(atom_encoder(x), count_h)) without materializing the concatenation. The
+        atom part is a projection of an embedding, so it is applied to the (num_atoms, atom_dim)
+        embedding table and looked up per vertex, and the count part is added in the same kernel.
+        The weights are initialised like the unfused Linear(atom_dim + count_dim, out_dim).
+    """
+    def __init__(self, atom_dim, count_dim, out_dim, bias=True, glorot=False):
+        super().__init__()
+        self.atom_dim = atom_dim
+        self.count_dim = count_dim
+        self.glorot = glorot
+        self.atom_weight = nn.Parameter(torch.empty(out_dim, atom_dim))
+        self.count_weight = nn.Parameter(torch.empty(out_dim, count_dim))
+        self.bias = nn.Parameter(torch.empty(out_dim)) if bias else None
+        self.reset_parameters()
+        
+    def reset_parameters(self):
+        fan_in = self.atom_dim + self.count_dim
+        weight = torch.empty(self.atom_weight.size(0), fan_in)
+        if self.glorot:
+            nn.init.xavier_uniform_(weight)
+        else:
+            nn.init.kaiming_uniform_(weight, a=math.sqrt(5))
+        with torch.no_grad():
+            self.atom_weight.copy_(weight[:, :self.atom_dim])
+            self.count_weight.copy_(weight[:, self.atom_dim:])
+            if self.bias is not None:
+                bound = 1 / math.sqrt(fan_in)
+                self.bias.uniform_(-bound, bound)
+        
+    def forward(self, x, atom_encoder, count_h):
+        table = F.linear(atom_encoder.weight, self.atom_weight, self.bias)
+        atom_h = F.embedding(x.view(-1), table)
+        return torch.addmm(atom_h, count_h, self.count_weight.t())
+
+
+class ProjectedInput(nn.Module):
+    """
+        Stands in for the input Linear of a conv whose input was already projected by a FusedInput,
+        only the bias of the Linear (initialised for `fan_in` inputs) is left to add.
+    """
+    def __init__(self, dim, bias=True, fan_in=None):
+        super().__init__()
+        self.fan_in = fan_in if fan_in is not None else dim
+        self.bias = nn.Parameter(torch.empty(dim)) if bias else None
+        self.reset_parameters()
+        
+    def reset_parameters(self):
+        if self.bias is not None:
+            bound = 1 / math.sqrt(self.fan_in)
+            nn.init.uniform_(self.bias, -bound, bound)
+        
+    def forward(self, x):
+        return x + self.bias if self.bias is not None else x
+
+
 """
     MLP Layer used after graph vector representation
 """
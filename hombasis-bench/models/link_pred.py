@@ -5,17 +5,43 @@ from torch_geometric.nn.encoding import PositionalEncoding
 from torch_geometric.nn import GCNConv, GATConv, SAGEConv
 
 
-class GAT(torch.nn.Module):
+def encode_counts(counts, pe_dim, normalize_hom=None):
+    """
+    The positional encoding of the homcounts used by the models, (num_nodes, count_dim*pe_dim).
+    The encoding has no parameters, so it can be computed once when the data is loaded and passed
+    to models created with precomputed_pe=True instead of the raw counts.
+    """
+    if normalize_hom is None:
+        normalize_hom = PositionalEncoding(pe_dim).to(counts.device)
+    count_h = normalize_hom(counts)
+    count_size = counts.size()
+    return count_h.view((count_size[0], count_size[1]*pe_dim))
+
+
+class CountFeatures:
+    """
+    The count input shared by the models below, which set pe_dim, precomputed_pe and (unless the
+    encoding is precomputed) normalize_hom.
+    """
+
+    def count_features(self, counts):
+        if self.precomputed_pe:
+            return counts.to(torch.float32)
+        return encode_counts(counts, self.pe_dim, self.normalize_hom)
+
+
+class GAT(CountFeatures, torch.nn.Module):
     def __init__(self, in_channels, num_heads, count_dim, pe_dim, hidden_channels, out_channels, num_layers,
-                 dropout):
+                 dropout, precomputed_pe=False):
         super(GAT, self).__init__()
         self.pe_dim = pe_dim
+        self.precomputed_pe = precomputed_pe
 
         head_hidden_dim = hidden_channels * num_heads
         self.encode_h = nn.Linear(in_channels, head_hidden_dim)
 
         # encode homcounts using positional enconding
-        if count_dim > 0:
+        if count_dim > 0 and not precomputed_pe:
             self.normalize_hom = PositionalEncoding(pe_dim)
         
         concat_feature_dim = in_channels + count_dim*pe_dim
@@ -35,10 +61,7 @@ class GAT(torch.nn.Module):
 
     def forward(self, x, adj_t, use_counts, counts):
         if use_counts:
-            count_h = torch.flatten(counts)
-            count_h = self.normalize_hom(counts)
-            count_size = counts.size()
-            count_h = count_h.view((count_size[0], count_size[1]*self.pe_dim))
+            count_h = self.count_features(counts)
 
             x = torch.cat([x, count_h], dim=1)
             x = self.prepare_gat(x)
@@ -54,14 +77,15 @@ class GAT(torch.nn.Module):
         return x
     
 
-class GCN(torch.nn.Module):
+class GCN(CountFeatures, torch.nn.Module):
     def __init__(self, in_channels, count_dim, pe_dim, hidden_channels, out_channels, num_layers,
-                 dropout):
+                 dropout, precomputed_pe=False):
         super(GCN, self).__init__()
         self.pe_dim = pe_dim
+        self.precomputed_pe = precomputed_pe
 
         # encode homcounts using positional encoding
-        if count_dim > 0:
+        if count_dim > 0 and not precomputed_pe:
             self.normalize_hom = PositionalEncoding(pe_dim)
         
         concat_feature_dim = in_channels + count_dim*pe_dim
@@ -81,10 +105,7 @@ class GCN(torch.nn.Module):
 
     def forward(self, x, adj_t, use_counts, counts):
         if use_counts:
-            count_h = torch.flatten(counts)
-            count_h = self.normalize_hom(counts)
-            count_size = counts.size()
-            count_h = count_h.view((count_size[0], count_size[1]*self.pe_dim))
+            count_h = self.count_features(counts)
             x = torch.cat([x, count_h], dim=1)
         
         for conv in self.convs[:-1]:
@@ -95,14 +116,15 @@ class GCN(torch.nn.Module):
         return x
 
 
-class SAGE(torch.nn.Module):
+class SAGE(CountFeatures, torch.nn.Module):
     def __init__(self, in_channels, count_dim, pe_dim, hidden_channels, out_channels, num_layers,
-                 dropout):
+                 dropout, precomputed_pe=False):
         super(SAGE, self).__init__()
         self.pe_dim = pe_dim
+        self.precomputed_pe = precomputed_pe
 
         # encode homcounts using positional encoding
-        if count_dim > 0:
+        if count_dim > 0 and not precomputed_pe:
             self.normalize_hom = PositionalEncoding(pe_dim)
         
         concat_feature_dim = in_channels + count_dim*pe_dim
@@ -121,10 +143,7 @@ class SAGE(torch.nn.Module):
 
     def forward(self, x, adj_t, use_counts, counts):
         if use_counts:
-            count_h = torch.flatten(counts)
-            count_h = self.normalize_hom(counts)
-            count_size = counts.size()
-            count_h = count_h.view((count_size[0], count_size[1]*self.pe_dim))
+            count_h = self.count_features(counts)
             x = torch.cat([x, count_h], dim=1)
 
         for conv in self.convs[:-1]:
@@ -2,7 +2,6 @@ import argparse
 import random
 import os
 import yaml
-import wandb
 
 import torch
 import torch.nn.functional as F
@@ -10,11 +9,13 @@ from torch.utils.data import DataLoader
 import numpy as np
 
 import torch_geometric.transforms as T
+from torch_geometric.data import Data
 import torch_geometric.seed
 from ogb.linkproppred import Evaluator
 
 from data.get_data import load_collab_counts, load_collab_multsum_counts
-from models.link_pred import GAT, GCN, SAGE
+from models.link_pred import GAT, GCN, SAGE, encode_counts
+from tracking import LOGGERS, open_tracker
 
 
 class LinkPredictor(torch.nn.Module):
@@ -83,70 +84,189 @@ def train(model, predictor, data, split_edge, optimizer, batch_size):
     return total_loss / total_examples
 
 
-@torch.no_grad()
-def test(model, predictor, data, split_edge, evaluator, batch_size):
-    model.eval()
-    predictor.eval()
+class KHopSampler:
+    """
+    Extracts the k-hop neighbourhood of a set of seed nodes for mini-batch training. Every hop
+    adds the edges into the current frontier, at most num_neighbors[hop] per node (all if the
+    list is None or the entry is negative). The CSR index of the graph is built once.
+    """
+
+    def __init__(self, edge_index, edge_weight, num_nodes, num_hops, num_neighbors=None):
+        # messages flow from edge_index[0] to edge_index[1], so index the edges by target
+        perm = torch.argsort(edge_index[1])
+        self.col = edge_index[0][perm]
+        self.weight = edge_weight[perm]
+        self.rowptr = torch.zeros(num_nodes + 1, dtype=torch.long)
+        torch.cumsum(torch.bincount(edge_index[1], minlength=num_nodes), dim=0, out=self.rowptr[1:])
+
+        self.num_nodes = num_nodes
+        self.num_hops = num_hops
+        self.num_neighbors = num_neighbors
+        self.assoc = torch.full((num_nodes,), -1, dtype=torch.long)
+
+    def edges_into(self, frontier, k):
+        start = self.rowptr[frontier]
+        deg = self.rowptr[frontier + 1] - start
+        if k is not None and k >= 0:
+            # sample k of the edges (with replacement) for nodes with more than k
+            take = torch.clamp(deg, max=k)
+            owner = torch.repeat_interleave(torch.arange(frontier.size(0)), take)
+            offset = torch.arange(owner.size(0)) - torch.repeat_interleave(torch.cumsum(take, 0) - take, take)
+            sampled = (torch.rand(owner.size(0)) * deg[owner]).long()
+            offset = torch.where(deg[owner] > k, sampled, offset)
+            return torch.unique(start[owner] + offset)
+        owner = torch.repeat_interleave(torch.arange(frontier.size(0)), deg)
+        offset = torch.arange(owner.size(0)) - torch.repeat_interleave(torch.cumsum(deg, 0) - deg, deg)
+        return start[owner] + offset
+
+    def sample(self, seeds):
+        """
+        Returns the global ids of the subgraph nodes, the sparse adjacency of the subgraph and
+        the local ids of the seeds.
+        """
+        nodes = torch.unique(seeds)
+        self.assoc[nodes] = torch.arange(nodes.size(0))
+        all_nodes, frontier = [nodes], nodes
+        src, dst, weight = [], [], []
+        num_sampled = nodes.size(0)
+        for hop in range(self.num_hops):
+            k = self.num_neighbors[hop] if self.num_neighbors is not None else None
+            e = self.edges_into(frontier, k)
+            targets = torch.searchsorted(self.rowptr, e, right=True) - 1
+            sources = self.col[e]
+
+            new = torch.unique(sources[self.assoc[sources] < 0])
+            self.assoc[new] = torch.arange(num_sampled, num_sampled + new.size(0))
+            num_sampled += new.size(0)
+            all_nodes.append(new)
+
+            src.append(sources)
+            dst.append(targets)
+            weight.append(self.weight[e])
+            frontier = new
+
+        node_ids = torch.cat(all_nodes)
+        edge_index = torch.stack([self.assoc[torch.cat(src)], self.assoc[torch.cat(dst)]])
+        seed_ids = self.assoc[seeds]
+        self.assoc[node_ids] = -1
+
+        sub = Data(edge_index=edge_index, edge_weight=torch.cat(weight), num_nodes=node_ids.size(0))
+        return node_ids, T.ToSparseTensor()(sub).adj_t, seed_ids
+
+
+def train_sampled(model, predictor, data, split_edge, optimizer, batch_size, sampler):
+    """Like train, but every batch only runs the model on the sampled neighbourhood of its edges."""
+    model.train()
+    predictor.train()
+
+    pos_train_edge = split_edge['train']['edge']
+    device = data.x.device
+
+    total_loss = total_examples = 0
+    for perm in DataLoader(range(pos_train_edge.size(0)), batch_size,
+                           shuffle=True):
+        optimizer.zero_grad()
 
-    h = model(data.x, data.adj_t, data.use_counts, data.counts)
+        pos_edge = pos_train_edge[perm].t()
+        # Just do some trivial random sampling.
+        neg_edge = torch.randint(0, data.num_nodes, pos_edge.size(), dtype=torch.long)
 
-    pos_train_edge = split_edge['train']['edge'].to(h.device)
-    pos_valid_edge = split_edge['valid']['edge'].to(h.device)
-    neg_valid_edge = split_edge['valid']['edge_neg'].to(h.device)
-    pos_test_edge = split_edge['test']['edge'].to(h.device)
-    neg_test_edge = split_edge['test']['edge_neg'].to(h.device)
+        node_ids, adj_t, seed_ids = sampler.sample(torch.cat([pos_edge, neg_edge], dim=1).view(-1))
+        node_ids = node_ids.to(device)
+        h = model(data.x[node_ids], adj_t.to(device), data.use_counts, data.counts[node_ids])
 
-    pos_train_preds = []
-    for perm in DataLoader(range(pos_train_edge.size(0)), batch_size):
-        edge = pos_train_edge[perm].t()
-        pos_train_preds += [predictor(h[edge[0]], h[edge[1]]).squeeze().cpu()]
-    pos_train_pred = torch.cat(pos_train_preds, dim=0)
-
-    pos_valid_preds = []
-    for perm in DataLoader(range(pos_valid_edge.size(0)), batch_size):
-        edge = pos_valid_edge[perm].t()
-        pos_valid_preds += [predictor(h[edge[0]], h[edge[1]]).squeeze().cpu()]
-    pos_valid_pred = torch.cat(pos_valid_preds, dim=0)
-
-    neg_valid_preds = []
-    for perm in DataLoader(range(neg_valid_edge.size(0)), batch_size):
-        edge = neg_valid_edge[perm].t()
-        neg_valid_preds += [predictor(h[edge[0]], h[edge[1]]).squeeze().cpu()]
-    neg_valid_pred = torch.cat(neg_valid_preds, dim=0)
-
-    h = model(data.x, data.full_adj_t, data.use_counts, data.counts)
-
-    pos_test_preds = []
-    for perm in DataLoader(range(pos_test_edge.size(0)), batch_size):
-        edge = pos_test_edge[perm].t()
-        pos_test_preds += [predictor(h[edge[0]], h[edge[1]]).squeeze().cpu()]
-    pos_test_pred = torch.cat(pos_test_preds, dim=0)
-
-    neg_test_preds = []
-    for perm in DataLoader(range(neg_test_edge.size(0)), batch_size):
-        edge = neg_test_edge[perm].t()
-        neg_test_preds += [predictor(h[edge[0]], h[edge[1]]).squeeze().cpu()]
-    neg_test_pred = torch.cat(neg_test_preds, dim=0)
-
-    results = {}
-    for K in [10, 50, 100]:
-        evaluator.K = K
-        train_hits = evaluator.eval({
-            'y_pred_pos': pos_train_pred,
-            'y_pred_neg': neg_valid_pred,
-        })[f'hits@{K}']
-        valid_hits = evaluator.eval({
-            'y_pred_pos': pos_valid_pred,
-            'y_pred_neg': neg_valid_pred,
-        })[f'hits@{K}']
-        test_hits = evaluator.eval({
-            'y_pred_pos': pos_test_pred,
-            'y_pred_neg': neg_test_pred,
-        })[f'hits@{K}']
-
-        results[f'Hits@{K}'] = (train_hits, valid_hits, test_hits)
-
-    return results
+        edge = seed_ids.view(2, -1).to(device)
+        num_pos = pos_edge.size(1)
+        pos_out = predictor(h[edge[0, :num_pos]], h[edge[1, :num_pos]])
+        pos_loss = -torch.log(pos_out + 1e-15).mean()
+
+        neg_out = predictor(h[edge[0, num_pos:]], h[edge[1, num_pos:]])
+        neg_loss = -torch.log(1 - neg_out + 1e-15).mean()
+
+        loss = pos_loss + neg_loss
+        loss.backward()
+
+        torch.nn.utils.clip_grad_norm_(model.parameters(), 1.0)
+        torch.nn.utils.clip_grad_norm_(predictor.parameters(), 1.0)
+
+        optimizer.step()
+
+        num_examples = pos_out.size(0)
+        total_loss += loss.item() * num_examples
+        total_examples += num_examples
+
+    return total_loss / total_examples
+
+
+class LinkEvaluator:
+    """
+    Evaluates all edge sets of the split at once. The node embeddings are computed once per
+    adjacency (only once if full_adj_t is adj_t) and all edges scored with the same embeddings
+    are gathered and scored in one batched pass into a preallocated buffer.
+    """
+
+    def __init__(self, data, split_edge, evaluator, batch_size):
+        self.evaluator = evaluator
+        self.batch_size = batch_size
+        self.same_adj = data.full_adj_t is data.adj_t
+
+        device = data.x.device
+        sets = {
+            'train': split_edge['train']['edge'],
+            'valid': split_edge['valid']['edge'],
+            'valid_neg': split_edge['valid']['edge_neg'],
+            'test': split_edge['test']['edge'],
+            'test_neg': split_edge['test']['edge_neg'],
+        }
+        # the test edges are scored with the embeddings of the full adjacency
+        groups = [['train', 'valid', 'valid_neg', 'test', 'test_neg']] if self.same_adj else \
+            [['train', 'valid', 'valid_neg'], ['test', 'test_neg']]
+
+        self.groups = []
+        for names in groups:
+            edges = torch.cat([sets[name] for name in names], dim=0).to(device)
+            sizes = [sets[name].size(0) for name in names]
+            out = torch.empty(edges.size(0), device=device)
+            self.groups.append((names, edges, sizes, out))
+
+    @torch.no_grad()
+    def score(self, predictor, h, edges, out):
+        for start in range(0, edges.size(0), self.batch_size):
+            edge = edges[start:start + self.batch_size]
+            out[start:start + edge.size(0)] = predictor(h[edge[:, 0]], h[edge[:, 1]]).view(-1)
+        return out
+
+    @torch.no_grad()
+    def __call__(self, model, predictor, data):
+        model.eval()
+        predictor.eval()
+
+        preds = {}
+        for i, (names, edges, sizes, out) in enumerate(self.groups):
+            adj_t = data.adj_t if i == 0 else data.full_adj_t
+            h = model(data.x, adj_t, data.use_counts, data.counts)
+            scores = self.score(predictor, h, edges, out).cpu()
+            preds.update(zip(names, torch.split(scores, sizes)))
+
+        results = {}
+        for K in [10, 50, 100]:
+            self.evaluator.K = K
+            train_hits = self.evaluator.eval({
+                'y_pred_pos': preds['train'],
+                'y_pred_neg': preds['valid_neg'],
+            })[f'hits@{K}']
+            valid_hits = self.evaluator.eval({
+                'y_pred_pos': preds['valid'],
+                'y_pred_neg': preds['valid_neg'],
+            })[f'hits@{K}']
+            test_hits = self.evaluator.eval({
+                'y_pred_pos': preds['test'],
+                'y_pred_neg': preds['test_neg'],
+            })[f'hits@{K}']
+
+            results[f'Hits@{K}'] = (train_hits, valid_hits, test_hits)
+
+        return results
 
 
 if __name__ == "__main__":
@@ -161,6 +281,15 @@ if __name__ == "__main__":
     parser.add_argument('--seed', type=int, default=41)
     parser.add_argument("-c", "--config", required=True)
     parser.add_argument("--num_heads", type=int, default=8)
+    parser.add_argument('--eval_steps', type=int, default=1,
+                        help='evaluate every eval_steps epochs (and after the last one)')
+    parser.add_argument('--sampled', action='store_true',
+                        help='train on sampled num_layers-hop neighbourhoods of the batch edges')
+    parser.add_argument('--num_neighbors', type=int, nargs='+', default=None,
+                        help='neighbours sampled per node and hop in sampled training (default: all)')
+    parser.add_argument('--logger', default=os.environ.get('HOMBASIS_LOGGER', 'auto'), choices=LOGGERS,
+                        help='metrics backend, auto uses wandb if it is configured and jsonl files otherwise')
+    parser.add_argument('--log_dir', default='runs', help='directory of the local metrics files')
     args = parser.parse_args()
     print(args)
 
@@ -184,14 +313,18 @@ if __name__ == "__main__":
     idx_list = conf['idx_list']
     model_name = conf['model_name']
     pe_dim = conf['pe_dim']
+    # the positional encoding of the counts is computed once at load time, optionally stored in float16
+    precompute_pe = conf.get('precompute_pe', True) and use_counts
+    pe_half = conf.get('pe_half', False)
     
-    wandb.init(
+    tracker = open_tracker(
+        args.logger,
         project=project,
         group=group,
-        name=name
+        name=name,
+        config=vars(args),
+        log_dir=args.log_dir
     )
-    
-    wandb.config.update(args)
     print(default_seed)
 
     device = f'cuda:{args.device}' if torch.cuda.is_available() else 'cpu'
@@ -211,35 +344,51 @@ if __name__ == "__main__":
         
     print(data.count_dim)
 
+    if precompute_pe:
+        data.counts = encode_counts(data.counts, pe_dim)
+        if pe_half:
+            data.counts = data.counts.half()
+
     edge_index = data.edge_index
     data.edge_weight = data.edge_weight.view(-1).to(torch.float)
+    if args.sampled:
+        sampler = KHopSampler(edge_index, data.edge_weight, data.num_nodes, args.num_layers, args.num_neighbors)
     data = T.ToSparseTensor()(data)
 
     split_edge = dataset.get_edge_split()
 
-    data.full_adj_t = data.adj_t
-
     data = data.to(device)
 
+    # set after moving: Data.to copies every attribute separately, and the evaluator only needs one
+    # pass if both adjacencies are the same object
+    data.full_adj_t = data.adj_t
+
     if model_name == 'GCN':
         model = GCN(data.num_features, data.count_dim, pe_dim, args.hidden_channels,
                     args.hidden_channels, args.num_layers,
-                    args.dropout).to(device)
+                    args.dropout, precomputed_pe=precompute_pe).to(device)
     elif model_name == 'GAT':
         model = GAT(data.num_features, args.num_heads, data.count_dim, pe_dim, 32,
                     args.hidden_channels, args.num_layers,
-                    args.dropout).to(device)
+                    args.dropout, precomputed_pe=precompute_pe).to(device)
     elif model_name == "SAGE":
         model = SAGE(data.num_features, data.count_dim, pe_dim, args.hidden_channels,
                     args.hidden_channels, args.num_layers,
-                    args.dropout).to(device)
+                    args.dropout, precomputed_pe=precompute_pe).to(device)
     else:
         print('model not supported')
 
+    if args.sampled:
+        # the normalisation of GCN must not be cached when every batch has its own subgraph
+        for conv in model.convs:
+            if hasattr(conv, 'cached'):
+                conv.cached = False
+
     predictor = LinkPredictor(args.hidden_channels, args.hidden_channels, 1,
                             args.num_layers, args.dropout).to(device)
 
     evaluator = Evaluator(name='ogbl-collab')
+    link_evaluator = LinkEvaluator(data, split_edge, evaluator, args.batch_size)
 
     optimizer = torch.optim.Adam(
         list(model.parameters()) + list(predictor.parameters()),
@@ -248,17 +397,26 @@ if __name__ == "__main__":
     valid_curve = []
     best_val_epoch = 0
     test_curve = []
+    eval_epochs = []
     for epoch in range(1, 1 + args.epochs):
-        loss = train(model, predictor, data, split_edge, optimizer,
-                        args.batch_size)
-
-        results = test(model, predictor, data, split_edge, evaluator,
+        if args.sampled:
+            loss = train_sampled(model, predictor, data, split_edge, optimizer,
+                                 args.batch_size, sampler)
+        else:
+            loss = train(model, predictor, data, split_edge, optimizer,
                             args.batch_size)
 
+        if epoch % args.eval_steps != 0 and epoch != args.epochs:
+            tracker.log({"loss": loss})
+            continue
+
+        results = link_evaluator(model, predictor, data)
+
         valid_curve.append(results['Hits@50'][1])
         test_curve.append(results['Hits@50'][2])
+        eval_epochs.append(epoch)
         
-        wandb.log({
+        tracker.log({
             "loss": loss,
             "train_hits_50": results['Hits@50'][0],
             "valid_hits_50": results['Hits@50'][1],
@@ -268,7 +426,7 @@ if __name__ == "__main__":
         
     best_val_epoch = np.argmax(np.array(valid_curve))
     print('best epoch')
-    print(best_val_epoch)
+    print(eval_epochs[best_val_epoch])
     print('best test')
     print(test_curve[best_val_epoch])
     
@@ -277,17 +435,17 @@ if __name__ == "__main__":
     )
     
    # save results
-    wandb.log({
-        'best': best_val_epoch,
+    tracker.log({
+        'best': eval_epochs[best_val_epoch],
         'best_val': valid_curve[best_val_epoch],
         'best_test': test_curve[best_val_epoch],
         'description': description,
         'final_epoch': epoch,
         'total_params': total_params,
-        'pe_dim': args.pe_dim,
+        'pe_dim': pe_dim,
         
     })
     
     
-    wandb.finish()
+    tracker.finish()
 
@@ -0,0 +1,121 @@
+"""
+Runs many (config, seed) ZINC experiments from one process. Every distinct count set (count files,
+idx_list, ...) is loaded once, the runs are then forked off into a process pool and share the loaded
+splits. One row per finished run is appended to a local results table, runs already in the table are
+skipped when the sweep is restarted.
+
+    python sweep-zinc.py -c config/zinc/100k config/zinc/8Cycle -seeds 0 1 2 3 -j 4 -o results/zinc.csv
+"""
+import argparse
+import csv
+import glob
+import json
+import os
+import time
+import multiprocessing as mp
+
+import torch
+import yaml
+
+from zinc_utils import count_set, load_zinc_count_data, run_zinc, seed_everything
+from data.batches import PackedGraphs
+from tracking import LOGGERS, open_tracker
+
+
+RESULT_FIELDS = ['config', 'seed', 'model', 'description', 'count_type', 'count_files', 'idx_list', 'count_dim',
+                 'best', 'best_train', 'best_val', 'best_test', 'last_train', 'last_val', 'last_test',
+                 'final_epoch', 'total_params', 'seconds']
+
+# loaded splits per count set, set up before the pool is forked so that the workers share them
+_DATA = dict()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='ZINC sweep')
+    parser.add_argument("-c", "--configs", nargs='+', required=True,
+                        help="yaml configuration files or directories of them")
+    parser.add_argument("-seeds", "--seeds", nargs='+', type=int, default=[0])
+    parser.add_argument("-j", "--jobs", type=int, default=1, help="number of runs in parallel")
+    parser.add_argument("-o", "--output", default='zinc-results.csv', help="results table (csv)")
+    parser.add_argument("-logger", "--logger", default='none', choices=LOGGERS,
+                        help="metrics backend of every run in addition to the results table")
+    parser.add_argument("-log_dir", "--log_dir", default='runs', help="directory of the local metrics files")
+    parser.add_argument("-project", "--project")
+    parser.add_argument("-group", "--group", help="group name of the runs")
+    return parser.parse_args()
+
+
+def config_files(paths):
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files += sorted(glob.glob(os.path.join(path, '*.yaml')))
+        else:
+            files.append(path)
+    return files
+
+
+def finished_runs(output):
+    if not os.path.exists(output):
+        return set()
+    with open(output, 'r', newline='') as f:
+        return {(row['config'], int(row['seed'])) for row in csv.DictReader(f)}
+
+
+def run_job(job):
+    config, seed, conf, args = job
+    conf = dict(conf, seed=seed, project=args.project, group=args.group)
+    device = torch.device("cuda:" + str(0)) if torch.cuda.is_available() else torch.device("cpu")
+    seed_everything(seed)
+
+    tracker = open_tracker(args.logger, args.project, args.group, conf['model'], conf, log_dir=args.log_dir)
+
+    start = time.time()
+    train_data, val_data, test_data, count_dim, packed = _DATA[count_set(conf)]
+    results = run_zinc(conf, train_data, val_data, test_data, count_dim, device, log=tracker.log, packed=packed)
+
+    tracker.finish()
+
+    row = {key: results.get(key) for key in RESULT_FIELDS}
+    row.update(config=config, seed=seed, model=conf['model'], idx_list=json.dumps(conf['idx_list']),
+               count_files=json.dumps(results['count_files']), seconds=round(time.time() - start, 1))
+    return row
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    root_dir = os.path.dirname(os.path.abspath(__file__))
+    data_dir = os.path.join(root_dir, 'data', 'zinc-data')
+
+    done = finished_runs(args.output)
+    jobs = []
+    for config in config_files(args.configs):
+        with open(config, "r") as f:
+            conf = yaml.safe_load(f)
+        jobs += [(config, seed, conf, args) for seed in args.seeds if (config, seed) not in done]
+    print(f'{len(jobs)} runs to go, {len(done)} already in {args.output}')
+
+    # load every count set once, before forking
+    for _, _, conf, _ in jobs:
+        key = count_set(conf)
+        if key not in _DATA:
+            print("Loading Data", key)
+            splits = load_zinc_count_data(conf, data_dir)
+            packed = [PackedGraphs(split) for split in splits[:3]]
+            _DATA[key] = (*splits, packed)
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    new_table = not os.path.exists(args.output)
+    # split the cores between the runs instead of letting every run use all of them
+    torch.set_num_threads(max(1, (os.cpu_count() or 1) // args.jobs))
+
+    with open(args.output, 'a', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=RESULT_FIELDS)
+        if new_table:
+            writer.writeheader()
+        # fork so that the workers inherit the loaded data, one run per worker process
+        with mp.get_context('fork').Pool(args.jobs, maxtasksperchild=1) as pool:
+            for row in pool.imap_unordered(run_job, jobs):
+                writer.writerow(row)
+                f.flush()
+                print(f"{row['config']} seed {row['seed']}: best val {row['best_val']}, test {row['best_test']}")
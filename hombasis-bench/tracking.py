@@ -0,0 +1,175 @@
+"""
+Metrics backends for the experiment runners.
+
+`open_tracker` returns an object with the `log(metrics)` and `finish()` methods of a wandb run. Besides
+wandb, metrics can be appended to local files that are written in batches:
+
+    jsonl   <log_dir>/<project>/<group>/<name>-<time>.jsonl, one line per log call
+    csv     <log_dir>/<project>/<group>/<name>-<time>.csv, one (step, key, value) row per metric
+    sqlite  <log_dir>/<project>.sqlite, tables `runs` and `metrics` (run, step, key, value)
+
+The config of a run is written next to the jsonl and csv files as <name>-<time>.json. With `auto`, wandb
+is used if it is installed and an API key is configured, and jsonl otherwise.
+"""
+import csv
+import json
+import numbers
+import os
+import sqlite3
+import time
+
+import numpy as np
+
+
+LOGGERS = ['auto', 'wandb', 'jsonl', 'csv', 'sqlite', 'none']
+
+
+def _plain(value):
+    """Turns numpy and torch scalars into Python numbers, other non-json values into strings."""
+    if hasattr(value, 'item') and getattr(value, 'ndim', 0) == 0:
+        return value.item()
+    if isinstance(value, (numbers.Number, str, bool)) or value is None:
+        return value
+    if isinstance(value, (list, tuple, np.ndarray)):
+        return [_plain(v) for v in value]
+    if isinstance(value, dict):
+        return {str(k): _plain(v) for k, v in value.items()}
+    return str(value)
+
+
+def wandb_configured():
+    try:
+        import wandb
+    except ImportError:
+        return False
+    if os.environ.get('WANDB_MODE') in ('offline', 'disabled', 'dryrun'):
+        return False
+    if os.environ.get('WANDB_API_KEY'):
+        return True
+    netrc = os.path.join(os.path.expanduser('~'), '.netrc')
+    return os.path.exists(netrc) and 'api.wandb.ai' in open(netrc).read()
+
+
+class NullTracker:
+    def log(self, metrics):
+        pass
+
+    def finish(self):
+        pass
+
+
+class WandbTracker:
+    def __init__(self, project, group, name, config):
+        import wandb
+        self.run = wandb.init(project=project, group=group, name=name, reinit=True)
+        self.run.config.update(config)
+
+    def log(self, metrics):
+        self.run.log(metrics)
+
+    def finish(self):
+        self.run.finish()
+
+
+class FileTracker:
+    """
+    Buffers the logged metrics and appends them to a local file every `flush_every` log calls and on
+    `finish`. The step of a log call counts the calls, as in wandb.
+    """
+
+    def __init__(self, flush_every=50):
+        self.flush_every = flush_every
+        self.step = 0
+        self.buffer = []
+
+    def log(self, metrics):
+        self.buffer.append((self.step, {key: _plain(value) for key, value in metrics.items()}))
+        self.step += 1
+        if len(self.buffer) >= self.flush_every:
+            self.flush()
+
+    def flush(self):
+        if len(self.buffer) > 0:
+            self.write(self.buffer)
+            self.buffer = []
+
+    def finish(self):
+        self.flush()
+
+
+def _run_path(log_dir, project, group, name):
+    run_dir = os.path.join(log_dir, str(project), str(group))
+    os.makedirs(run_dir, exist_ok=True)
+    return os.path.join(run_dir, f"{name}-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}")
+
+
+class JsonlTracker(FileTracker):
+    def __init__(self, log_dir, project, group, name, config, flush_every=50):
+        super().__init__(flush_every)
+        base = _run_path(log_dir, project, group, name)
+        with open(base + '.json', 'w') as f:
+            json.dump(_plain(config), f, indent=2)
+        self.path = base + '.jsonl'
+
+    def write(self, records):
+        with open(self.path, 'a') as f:
+            f.writelines(json.dumps(dict(metrics, _step=step)) + '\n' for step, metrics in records)
+
+
+class CsvTracker(FileTracker):
+    def __init__(self, log_dir, project, group, name, config, flush_every=50):
+        super().__init__(flush_every)
+        base = _run_path(log_dir, project, group, name)
+        with open(base + '.json', 'w') as f:
+            json.dump(_plain(config), f, indent=2)
+        self.path = base + '.csv'
+        with open(self.path, 'w', newline='') as f:
+            csv.writer(f).writerow(['step', 'key', 'value'])
+
+    def write(self, records):
+        with open(self.path, 'a', newline='') as f:
+            writer = csv.writer(f)
+            for step, metrics in records:
+                writer.writerows((step, key, value if isinstance(value, (numbers.Number, str)) else json.dumps(value))
+                                 for key, value in metrics.items())
+
+
+class SqliteTracker(FileTracker):
+    def __init__(self, log_dir, project, group, name, config, flush_every=50):
+        super().__init__(flush_every)
+        os.makedirs(log_dir, exist_ok=True)
+        self.path = os.path.join(log_dir, f'{project}.sqlite')
+        with self._connect() as db:
+            db.execute('CREATE TABLE IF NOT EXISTS runs (id INTEGER PRIMARY KEY, grp TEXT, name TEXT, '
+                       'config TEXT, started REAL)')
+            db.execute('CREATE TABLE IF NOT EXISTS metrics (run INTEGER, step INTEGER, key TEXT, value)')
+            cursor = db.execute('INSERT INTO runs (grp, name, config, started) VALUES (?, ?, ?, ?)',
+                                (str(group), str(name), json.dumps(_plain(config)), time.time()))
+            self.run_id = cursor.lastrowid
+
+    def _connect(self):
+        # several runs of a sweep may write to the same database
+        return sqlite3.connect(self.path, timeout=60)
+
+    def write(self, records):
+        rows = [(self.run_id, step, key, value if isinstance(value, (numbers.Number, str)) else json.dumps(value))
+                for step, metrics in records for key, value in metrics.items()]
+        with self._connect() as db:
+            db.executemany('INSERT INTO metrics VALUES (?, ?, ?, ?)', rows)
+
+
+def open_tracker(logger, project, group, name, config, log_dir='runs'):
+    """Starts a run with the given backend (one of LOGGERS) and returns its tracker."""
+    if logger == 'auto':
+        logger = 'wandb' if wandb_configured() else 'jsonl'
+    if logger == 'wandb':
+        return WandbTracker(project, group, name, config)
+    if logger == 'jsonl':
+        return JsonlTracker(log_dir, project, group, name, config)
+    if logger == 'csv':
+        return CsvTracker(log_dir, project, group, name, config)
+    if logger == 'sqlite':
+        return SqliteTracker(log_dir, project, group, name, config)
+    if logger == 'none':
+        return NullTracker()
+    raise ValueError(f'logger {logger} not supported, use one of {LOGGERS}')
@@ -1,10 +1,20 @@
+import os
+import random
 import torch
 import numpy as np
 import argparse
 import yaml
+import torch_geometric.seed
+from torch.optim import Adam
+from torch_geometric.loader import DataLoader
 from tqdm import tqdm
 from sklearn.metrics import mean_absolute_error
 
+from data.get_data import load_zinc_homcount_dataset, load_zinc_subcount_dataset, load_zinc_subhom_dataset
+from data.batches import PackedGraphs, PackedLoader
+from models.graph_reg import GINGraphReg, GCNGraphReg, GATGraphReg
+from tracking import LOGGERS
+
 
 
 def train(model_name, use_counts, model, device, loader, optimizer):
@@ -89,6 +99,9 @@ def parse_args():
     parser.add_argument("-project", "--project")
     parser.add_argument("-group","--group", help="group name on wandb", required=True)
     parser.add_argument("-seed", "--seed", help="seed", required=True)
+    parser.add_argument("-logger", "--logger", default=os.environ.get('HOMBASIS_LOGGER', 'auto'), choices=LOGGERS,
+                        help="metrics backend, auto uses wandb if it is configured and jsonl files otherwise")
+    parser.add_argument("-log_dir", "--log_dir", default='runs', help="directory of the local metrics files")
 
     args, unparsed = parser.parse_known_args()
     
@@ -98,5 +111,232 @@ def parse_args():
     conf['project'] = args.project
     conf['group'] = args.group
     conf['seed'] = args.seed
+    conf['logger'] = args.logger
+    conf['log_dir'] = args.log_dir
     
     return(conf)
+
+
+def seed_everything(seed):
+    torch.manual_seed(seed)
+    torch.cuda.manual_seed(seed)
+    torch.cuda.manual_seed_all(seed)
+    np.random.seed(seed)
+    random.seed(seed)
+    torch_geometric.seed.seed_everything(seed)
+
+
+def count_set(conf):
+    """The count features a config trains on, configs with the same count set share their dataset."""
+    return (conf['count_type'], tuple(conf['count_files']), tuple(conf['idx_list']), conf.get('subset', True))
+
+
+def load_zinc_count_data(conf, data_dir):
+    """
+        Loads the ZINC splits with the counts selected by a config, returns (train, val, test, count_dim).
+    """
+    count_files = conf['count_files']
+    count_type = conf['count_type']
+    idx_list = conf['idx_list']
+    # full ZINC (250k graphs) instead of the 12k subset, counts are then read from disk during training
+    subset = conf.get('subset', True)
+    
+    if count_type == "homcounts" or count_type == "none":
+        print('loading homcounts')
+        return load_zinc_homcount_dataset(name='ZINC', hom_files=count_files, idx_list=idx_list, root=data_dir, subset=subset)
+    elif count_type == "subcounts":
+        sub_file = count_files[0]
+        print('loading subcounts')
+        return load_zinc_subcount_dataset(name='ZINC', sub_file=sub_file, idx_list=idx_list, root=data_dir, subset=subset)
+    elif count_type == "both":
+        print('loading hom and subcounts')
+        if "anchor" in count_files[0]:
+            sub_file = 'zinc_3to10C_subgraph.json'
+        else:
+            sub_file = 'zinc_3to8C_multhom.json'
+        return load_zinc_subhom_dataset(name='ZINC', hom_files=count_files, idx_list=idx_list, sub_file=sub_file, root=data_dir, subset=subset)
+    raise ValueError(f'count type {count_type} not supported')
+
+
+def build_model(conf, count_dim):
+    model_name = conf['model']
+    if model_name == "GINGraphReg":
+        return GINGraphReg(
+            hidden_dim=conf['hidden_dim'],
+            count_dim=count_dim,
+            num_layers=conf['num_layers'],
+            batch_norm=conf['batch_norm'],
+            residual=['residual'],
+            readout=conf['readout'],
+            fused_input=conf.get('fused_input', False)
+        )
+    elif model_name == "GCNGraphReg":
+        return GCNGraphReg(
+            hidden_dim=conf['hidden_dim'],
+            count_dim=count_dim,
+            num_layers=conf['num_layers'],
+            batch_norm=conf['batch_norm'],
+            residual=conf['residual'],
+            readout=conf['readout'],
+            fused_input=conf.get('fused_input', False)
+        )
+    elif model_name == "GATGraphReg":
+        return GATGraphReg(
+            hidden_dim=conf['hidden_dim'],
+            hidden_out_dim=conf['hidden_out_dim'],
+            count_dim=count_dim,
+            num_layers=conf['num_layers'],
+            num_heads=conf['num_heads'],
+            batch_norm=conf['batch_norm'],
+            residual=conf['residual'],
+            readout=conf['readout'],
+            fused_input=conf.get('fused_input', False)
+        )
+    raise ValueError(f'model {model_name} not supported')
+
+
+def make_loaders(conf, train_data, val_data, test_data, device, packed=None):
+    """
+        Returns the train, train evaluation, validation and test loaders of a config. `packed` are the
+        already packed splits to cut the batches from, e.g., shared by several runs.
+    """
+    batch_size = conf['batch_size']
+    # cut batches from the packed splits instead of collating Data objects every epoch
+    if conf.get('packed_batches', True):
+        if packed is None:
+            packed = [PackedGraphs(split) for split in (train_data, val_data, test_data)]
+        packed_train, packed_val, packed_test = packed
+        train_loader = PackedLoader(packed_train, batch_size=batch_size, shuffle=True)
+        train_eval_loader = PackedLoader(packed_train, batch_size=batch_size, device=device)
+        valid_loader = PackedLoader(packed_val, batch_size=batch_size, device=device)
+        test_loader = PackedLoader(packed_test, batch_size=batch_size, device=device)
+    else:
+        train_loader = DataLoader(train_data, batch_size=batch_size, shuffle=True)
+        train_eval_loader = train_loader
+        valid_loader = DataLoader(val_data, batch_size=batch_size, shuffle=False)
+        test_loader = DataLoader(test_data, batch_size=batch_size, shuffle=False)
+    return train_loader, train_eval_loader, valid_loader, test_loader
+
+
+def run_zinc(conf, train_data, val_data, test_data, count_dim, device, log=None, packed=None):
+    """
+        Trains and evaluates the model of a config on the given ZINC splits. Every epoch and the final
+        results are passed to `log` (e.g. the log of a tracker), the final results are also returned.
+    """
+    log = log if log is not None else (lambda metrics: None)
+    model_name = conf['model']
+    use_counts = conf['use_counts']
+    count_files = conf['count_files']
+    
+    if not use_counts:
+        count_files = 'none'
+        count_dim = 0
+        
+    print(count_dim)
+    
+    train_loader, train_eval_loader, valid_loader, test_loader = make_loaders(
+        conf, train_data, val_data, test_data, device, packed=packed)
+
+    print("Done Loading Data")
+
+    print("Preparing Model")
+    model = build_model(conf, count_dim)
+    model.to(device)
+
+    # instantiate optimiser
+    optimizer = Adam(model.parameters(), lr=conf['init_lr'])
+    
+    # learning rate decay
+    scheduler = torch.optim.lr_scheduler.ReduceLROnPlateau(optimizer, mode='min', factor=conf['lr_factor'], patience=conf['lr_patience'], verbose=True)
+
+    # (!) start training/evaluation
+    best_val_epoch = 0
+    valid_curve = []
+    test_curve = []
+    train_curve = []
+    train_loss_curve = []
+
+    print("Starting Model Training")
+
+    # training
+    for epoch in range(conf['epochs']):
+        epoch_train_curve = train(model_name, use_counts, model, device, train_loader, optimizer)
+        train_loss_curve += epoch_train_curve
+        epoch_train_loss = float(np.mean(epoch_train_curve))
+
+        if epoch % 20 == 0:
+            print("=====Epoch {}".format(epoch))
+        
+        train_perf, _ = eval(model_name, use_counts, model, device, train_eval_loader)
+        train_curve.append(train_perf)
+        
+        valid_perf, epoch_val_loss = eval(model_name, use_counts, model, device, valid_loader)
+        valid_curve.append(valid_perf)
+
+        test_perf, epoch_test_loss = eval(model_name, use_counts, model, device, test_loader)
+        test_curve.append(test_perf)
+        
+        log(
+            {
+                "train_loss": epoch_train_loss,
+                "val_loss": epoch_val_loss,
+                "test_loss": epoch_test_loss,
+                "train_score": train_perf,
+                "val_score": valid_perf,
+                "test_score": test_perf,
+            }
+        )
+        
+        # decay learning rate
+        scheduler.step(valid_perf)
+        if optimizer.param_groups[0]['lr'] < conf['min_lr']:
+            print("\n!! The minimum learning rate has been reached.")
+            break
+
+    best_val_epoch = int(np.argmin(np.array(valid_curve)))
+    
+    total_params = sum(
+        param.numel() for param in model.parameters()
+    )
+    
+    print('Final Evaluation...')
+    final_train_perf, _ = eval(model_name, use_counts, model, device, train_eval_loader)
+    final_val_perf, _ = eval(model_name, use_counts, model, device, valid_loader)
+    final_test_perf, _ = eval(model_name, use_counts,  model, device, test_loader)
+    
+    results = {
+        'last_val': final_val_perf,
+        'last_test': final_test_perf,
+        'last_train': final_train_perf,
+        'best': best_val_epoch,
+        'best_train': train_curve[best_val_epoch],
+        'best_val': valid_curve[best_val_epoch],
+        'best_test': test_curve[best_val_epoch],
+        'hidden_dim': conf['hidden_dim'],
+        'use_counts': use_counts,
+        'count_type': conf['count_type'],
+        'count_files': count_files,
+        'count_dim': count_dim,
+        'description': conf['description'],
+        'final_epoch': epoch,
+        'total_params': total_params,
+    }
+    log(results)
+
+    msg = (
+       f'========== Result ============\n'
+       f'Dataset:        ZINC\n'
+       f'Countfile:        {count_files}\n'
+       f'------------ Best epoch -----------\n'
+       f'Train:          {train_curve[best_val_epoch]}\n'
+       f'Validation:     {valid_curve[best_val_epoch]}\n'
+       f'Test:           {test_curve[best_val_epoch]}\n'
+       f'Best epoch:     {best_val_epoch}\n'
+       '------------ Last epoch -----------\n'
+       f'Train:          {final_train_perf}\n'
+       f'Validation:     {final_val_perf}\n'
+       f'Test:           {final_test_perf}\n'
+       '-------------------------------\n\n')
+    print(msg)
+    
+    return results
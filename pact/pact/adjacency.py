@@ -0,0 +1,89 @@
+"""
+CSR adjacency indexes of a host graph.
+
+The naive executor joins renamed copies of the base edge relation via pandas
+hash joins, which builds a fresh index of the edge relation for every join.
+A `HostAdjacencyIndex` is built once per host instead. It keeps a forward
+(source -> targets) and a reverse (target -> sources) CSR index over the
+value-counted base relation, and the executor uses them to extend a relation
+by one edge without materializing the join partner.
+
+Build one index per host and pass it to the executor for all patterns. For
+directed patterns the executor builds one itself if none is given.
+`has_bidirected_edge` answers the only question pruned patterns ask of a host
+without building an index.
+"""
+import numpy as np
+import pandas as pd
+
+
+def has_bidirected_edge(host):
+    """Whether the edge DataFrame `host` contains an arc (u, v) together with (v, u)."""
+    arcs = host[['s', 't']].drop_duplicates()
+    reverse = arcs.rename(columns={'s': 't', 't': 's'})
+    return len(arcs.merge(reverse, on=['s', 't'])) > 0
+
+
+class CSR:
+    def __init__(self, src, dst, num_vertices):
+        order = np.argsort(src, kind='stable')
+        self.indices = dst[order]
+        self.indptr = np.zeros(num_vertices + 1, dtype=np.int64)
+        np.cumsum(np.bincount(src, minlength=num_vertices), out=self.indptr[1:])
+
+    def degrees(self, vertices):
+        return self.indptr[vertices + 1] - self.indptr[vertices]
+
+    def expand(self, vertices):
+        """
+        Returns (rows, neighbours) such that neighbours[i] is adjacent to
+        vertices[rows[i]], covering all neighbours of all given vertices.
+        """
+        starts = self.indptr[vertices]
+        degs = self.indptr[vertices + 1] - starts
+        rows = np.repeat(np.arange(len(vertices)), degs)
+        # position of every output entry in self.indices
+        pos = np.repeat(starts - (np.cumsum(degs) - degs), degs) + np.arange(degs.sum())
+        return rows, self.indices[pos]
+
+
+class HostAdjacencyIndex:
+    def __init__(self, host):
+        """`host` is the raw edge DataFrame with attributes 's' and 't'."""
+        self.base = host.value_counts(['s', 't']).rename('count').reset_index()
+
+        src = self.base['s'].to_numpy(dtype=np.int64)
+        dst = self.base['t'].to_numpy(dtype=np.int64)
+        # dense ids so that hosts with arbitrary integer vertex names work
+        self.vertex_ids, dense = np.unique(np.concatenate([src, dst]), return_inverse=True)
+        dense_src, dense_dst = dense[:len(src)], dense[len(src):]
+
+        n = len(self.vertex_ids)
+        self.forward = CSR(dense_src, dense_dst, n)
+        self.reverse = CSR(dense_dst, dense_src, n)
+
+        # an arc (u, v) together with (v, u)
+        arcs = dense_src * n + dense_dst
+        self.has_bidirected_edge = bool(np.isin(dense_dst * n + dense_src, arcs).any())
+
+    @staticmethod
+    def supports(host):
+        """The index needs integer vertex names."""
+        return all(pd.api.types.is_integer_dtype(host[att]) for att in ('s', 't'))
+
+    def extend(self, vertices, reverse=False):
+        """
+        All (row, neighbour) pairs for the out-neighbours (in-neighbours if
+        `reverse`) of the given host vertices, with neighbours as host vertex names.
+        """
+        vertices = np.asarray(vertices, dtype=np.int64)
+        if len(self.vertex_ids) == 0:
+            return np.zeros(0, dtype=np.int64), self.vertex_ids
+        dense = np.searchsorted(self.vertex_ids, vertices)
+        dense = np.minimum(dense, len(self.vertex_ids) - 1)
+        known = self.vertex_ids[dense] == vertices
+
+        rows, nbrs = (self.reverse if reverse else self.forward).expand(dense[known])
+        # map back to rows of the full input
+        rows = np.flatnonzero(known)[rows]
+        return rows, self.vertex_ids[nbrs]
@@ -0,0 +1,286 @@
+"""
+Batch computation of vertex-wise homomorphism counts for whole datasets.
+
+This is the command-line replacement for the counting loop of the
+`homcount_preprocessing` notebook:
+
+    python -m pact.count bases/cycles/cycle8_basis.json zinc/ZINC12k.json -o counts/zinc_c8
+
+The input file uses the format described in the README, i.e.,
+{<graph_idx>: {'edge_index': <graph_edge_index>}, ...}.
+Work is distributed over a process pool and finished graphs are streamed to
+numbered `.npz` chunks in the output directory. Every chunk stores the ids of
+its graphs, a row offset array and one count matrix with a row per vertex and
+a column per basis pattern. The chunks double as the checkpoint: rerunning the
+same command skips all graphs that are already stored in a chunk.
+Once all graphs are counted, the chunks are collated into a columnar count
+store in the same directory (see `pact.countstore`).
+"""
+import argparse
+import glob
+import json
+import os
+import sys
+import dill
+import numpy as np
+import pandas as pd
+import multiprocess as mp
+from pact import countstore, planlib
+from pact.adjacency import HostAdjacencyIndex
+from pact.naive_exec import naive_pandas_plan_exec, _undir_df_degree_thres
+from pact.ui import default_progressbar
+
+
+# The marked vertex of anchored patterns, needs to be the same as in the preprocessing
+_MARK_VTX = 0
+# Patterns below this width are skipped, the acyclic ones are handled by 1-WL anyway
+_MIN_GHW = 1
+_INT64_MAX = np.iinfo(np.int64).max
+
+META_FILE = countstore.META_FILE
+CHUNK_PREFIX = 'chunk_'
+CHUNK_SUFFIX = '.npz'
+
+
+def load_basis(basis_file, min_ghw=_MIN_GHW):
+    """
+    Loads a dill basis file ({'SpasmSpace': ..., 'basis': ...}) or, if
+    `basis_file` is the name of a basis in the plan library, the compiled basis.
+    Returns the spasm space (or compiled basis), the basis and the ordered ids
+    of all basis graphs with width at least `min_ghw`.
+    """
+    library = planlib.default_library()
+    if not os.path.exists(basis_file) and basis_file in library:
+        compiled = library[basis_file]
+        return compiled, compiled.coefficients, compiled.ids(min_ghw)
+
+    with open(basis_file, 'rb') as f:
+        basis_info = dill.loads(f.read())
+    spasm_space = basis_info['SpasmSpace']
+    basis = basis_info['basis']
+    basis_ids = [gid for gid in basis if spasm_space[gid].td.ghw >= min_ghw]
+    return spasm_space, basis, basis_ids
+
+
+def coo_to_df(edge_index):
+    """
+    Converts a COO edge index into the symmetric edge DataFrame expected by
+    the naive plan executer. Self-loops and duplicate edges are dropped.
+    """
+    src, dst = (np.asarray(x, dtype=np.int64) for x in edge_index)
+    edges = np.concatenate([np.stack([src, dst], axis=1),
+                            np.stack([dst, src], axis=1)])
+    edges = edges[edges[:, 0] != edges[:, 1]]
+    return pd.DataFrame(np.unique(edges, axis=0), columns=['s', 't'])
+
+
+def homcounts_per_vertex(F, host_df, host_index=None):
+    """Returns a dictionary v -> homs(F, host)[_MARK_VTX -> v], vertices without homs are missing."""
+    state, empty = naive_pandas_plan_exec(F.plan, host_df, sliced_eval={}, host_index=host_index)
+    if empty:
+        return {}
+    finalcount = state['node$0']
+    return finalcount.groupby(_MARK_VTX)['count'].sum().to_dict()
+
+
+def counts_per_vertex(host_df, num_nodes, spasm_space, basis_ids):
+    """
+    Computes the (num_nodes, len(basis_ids)) matrix of vertex-wise counts of
+    all basis graphs in the host. The matrix is int64 unless some count does
+    not fit, in which case it is degraded to float64.
+    """
+    counts = np.zeros((num_nodes, len(basis_ids)), dtype=np.int64)
+    # built once per host and shared by all basis graphs
+    host_index = HostAdjacencyIndex(host_df) if HostAdjacencyIndex.supports(host_df) else None
+    for col, fid in enumerate(basis_ids):
+        F = spasm_space[fid]
+        host, index = host_df, host_index
+        if (not F.is_directed and F.clique is not None and F.clique > 2):
+            # the index is for the full host
+            host, index = _undir_df_degree_thres(host_df, F.clique - 1), None
+
+        vcounts = homcounts_per_vertex(F, host, host_index=index)
+        if len(vcounts) == 0:
+            continue
+        vertices = np.fromiter(vcounts.keys(), dtype=np.int64, count=len(vcounts))
+        values = [int(c) for c in vcounts.values()]
+        if counts.dtype == np.int64 and max(values) > _INT64_MAX:
+            counts = counts.astype(np.float64)
+        counts[vertices, col] = values
+    return counts
+
+
+def load_hosts(input_file):
+    """Reads the dataset file and returns a list of (graph_id, edge_index, num_nodes)."""
+    with open(input_file, 'r') as f:
+        raw = json.load(f)
+
+    hosts = []
+    for gid, gvals in raw.items():
+        edge_index = gvals['edge_index']
+        num_nodes = gvals.get('num_nodes')
+        if num_nodes is None:
+            num_nodes = 1 + max(max(edge_index[0], default=-1),
+                                max(edge_index[1], default=-1))
+        hosts.append((int(gid), edge_index, num_nodes))
+    return hosts
+
+
+"""
+Chunked output
+"""
+
+
+def chunk_files(output_dir):
+    pattern = os.path.join(output_dir, f'{CHUNK_PREFIX}*{CHUNK_SUFFIX}')
+    return sorted(glob.glob(pattern))
+
+
+def write_chunk(output_dir, index, results):
+    """
+    Writes a list of (graph_id, counts) to chunk number `index`.
+    The file is moved into place only once it is complete, so a chunk either
+    exists in full or not at all.
+    """
+    results = sorted(results, key=lambda r: r[0])
+    graph_ids = np.array([gid for gid, _ in results], dtype=np.int64)
+    offsets = np.zeros(len(results) + 1, dtype=np.int64)
+    np.cumsum([len(c) for _, c in results], out=offsets[1:])
+    counts = np.concatenate([c for _, c in results])
+
+    path = os.path.join(output_dir, f'{CHUNK_PREFIX}{index:05d}{CHUNK_SUFFIX}')
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        np.savez(f, graph_ids=graph_ids, offsets=offsets, counts=counts)
+    os.replace(tmp_path, path)
+    return path
+
+
+def read_chunks(output_dir):
+    """Yields (graph_ids, offsets, counts) for every chunk in the output directory."""
+    for path in chunk_files(output_dir):
+        with np.load(path) as chunk:
+            yield chunk['graph_ids'], chunk['offsets'], chunk['counts']
+
+
+def finished_graphs(output_dir):
+    """Returns the set of graph ids already stored and the index of the next chunk."""
+    done = set()
+    next_index = 0
+    for path in chunk_files(output_dir):
+        name = os.path.basename(path)
+        index = int(name[len(CHUNK_PREFIX):-len(CHUNK_SUFFIX)])
+        next_index = max(next_index, index + 1)
+        with np.load(path) as chunk:
+            done.update(chunk['graph_ids'].tolist())
+    return done, next_index
+
+
+def _prepare_output(output_dir, meta):
+    os.makedirs(output_dir, exist_ok=True)
+    meta_path = os.path.join(output_dir, META_FILE)
+    if os.path.exists(meta_path):
+        with open(meta_path, 'r') as f:
+            old_meta = json.load(f)
+        if old_meta['basis'] != meta['basis']:
+            raise RuntimeError(f'{output_dir} contains counts for a different basis, refusing to resume')
+        return
+    with open(meta_path, 'w') as f:
+        json.dump(meta, f, indent=2)
+
+
+"""
+Parallel execution
+"""
+
+# per process state of the pool workers, set up once by _init_worker
+_WORKER = dict()
+
+
+def _init_worker(basis_file, min_ghw):
+    spasm_space, _, basis_ids = load_basis(basis_file, min_ghw)
+    _WORKER['spasm_space'] = spasm_space
+    _WORKER['basis_ids'] = basis_ids
+
+
+def _count_host(host):
+    gid, edge_index, num_nodes = host
+    host_df = coo_to_df(edge_index)
+    counts = counts_per_vertex(host_df, num_nodes,
+                               _WORKER['spasm_space'], _WORKER['basis_ids'])
+    return gid, counts
+
+
+def count_dataset(basis_file, input_file, output_dir,
+                  threads=None, chunk_size=1000, min_ghw=_MIN_GHW):
+    """Counts the basis in all graphs of `input_file`, resuming from existing chunks in `output_dir`."""
+    threads = threads or os.cpu_count()
+    _, basis, basis_ids = load_basis(basis_file, min_ghw)
+
+    meta = {
+        'basis_file': basis_file if basis_file in planlib.default_library()
+        else os.path.abspath(basis_file),
+        'input_file': os.path.abspath(input_file),
+        'min_ghw': min_ghw,
+        # graph ids are 128 bit uuids and do not survive as json numbers
+        'basis': [str(gid) for gid in basis_ids],
+        'coefficients': [float(basis[gid]) for gid in basis_ids],
+    }
+    _prepare_output(output_dir, meta)
+
+    hosts = load_hosts(input_file)
+    done, next_index = finished_graphs(output_dir)
+    todo = [h for h in hosts if h[0] not in done]
+    if len(done) > 0:
+        print(f'Resuming: {len(hosts) - len(todo)} of {len(hosts)} graphs already counted',
+              file=sys.stderr)
+
+    # many small hosts per task keep the IPC overhead in check
+    pool_chunksize = max(1, min(64, len(todo) // (8 * threads)))
+
+    buffer = []
+    with default_progressbar(throughput_unit='graphs') as progress:
+        task = progress.add_task(f'Counting {len(basis_ids)} patterns',
+                                 total=len(hosts), completed=len(hosts) - len(todo))
+        with mp.Pool(threads, initializer=_init_worker,
+                     initargs=(basis_file, min_ghw)) as pool:
+            for res in pool.imap_unordered(_count_host, todo, chunksize=pool_chunksize):
+                buffer.append(res)
+                progress.advance(task)
+                if len(buffer) >= chunk_size:
+                    write_chunk(output_dir, next_index, buffer)
+                    next_index += 1
+                    buffer = []
+        if len(buffer) > 0:
+            write_chunk(output_dir, next_index, buffer)
+
+    with open(os.path.join(output_dir, META_FILE), 'r') as f:
+        meta = json.load(f)
+    countstore.write_store(output_dir, lambda: read_chunks(output_dir), meta)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m pact.count',
+        description='Compute vertex-wise homomorphism counts of a basis for a dataset of graphs.')
+    parser.add_argument('basis_file', help='dill basis file, e.g., bases/cycles/cycle8_basis.json, '
+                        'or the name of a basis in the plan library, e.g., cycle8')
+    parser.add_argument('input_file', help='json dataset file with an edge_index per graph')
+    parser.add_argument('-o', '--output', required=True,
+                        help='output directory for the count chunks, reused to resume')
+    parser.add_argument('-t', '--threads', type=int, default=None,
+                        help='number of worker processes (default: all cores)')
+    parser.add_argument('--chunk-size', type=int, default=1000,
+                        help='number of graphs per output chunk')
+    parser.add_argument('--min-ghw', type=int, default=_MIN_GHW,
+                        help='skip basis graphs with smaller generalized hypertree width')
+    args = parser.parse_args(argv)
+
+    count_dataset(args.basis_file, args.input_file, args.output,
+                  threads=args.threads,
+                  chunk_size=args.chunk_size,
+                  min_ghw=args.min_ghw)
+
+
+if __name__ == '__main__':
+    main()
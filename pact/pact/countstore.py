@@ -0,0 +1,250 @@
+"""
+Columnar storage of vertex-wise homomorphism counts.
+
+A count store is a directory with
+    meta.json       header with the basis graph ids, their coefficients,
+                    the dtype and the number of graphs and vertices
+    counts.npy      (num_vertices, basis_size) int64 or float64 matrix with
+                    one row per vertex of all graphs, concatenated
+    offsets.npy     (num_graphs + 1,) int64, the rows of the i-th graph are
+                    counts[offsets[i]:offsets[i + 1]]
+    graph_ids.npy   (num_graphs,) int64 ids of the graphs, sorted ascending
+
+The matrix is memory-mapped on load, so opening a store takes milliseconds
+regardless of its size and no Python objects are created per vertex.
+Stores are created by `python -m pact.count` or converted from the legacy
+nested json format with
+
+    python -m pact.countstore counts/zinc_with_c8_homs.json counts/zinc_c8
+"""
+import argparse
+import json
+import os
+import numpy as np
+
+
+FORMAT_NAME = 'pact-homcounts'
+FORMAT_VERSION = 1
+
+META_FILE = 'meta.json'
+COUNTS_FILE = 'counts.npy'
+OFFSETS_FILE = 'offsets.npy'
+GRAPH_IDS_FILE = 'graph_ids.npy'
+
+
+def is_store(path):
+    return os.path.isfile(os.path.join(path, COUNTS_FILE))
+
+
+def write_store(path, parts, meta=None):
+    """
+    Writes a count store to `path`.
+    `parts` is a callable that returns an iterator over
+    (graph_ids, offsets, counts) triples in the layout of the store itself.
+    It is iterated twice, once to plan the layout and once to fill the
+    matrix, so only one part needs to be in memory at a time.
+    """
+    meta = dict(meta or {})
+
+    # first pass: collect graph sizes, the width and the common dtype
+    all_ids, all_sizes = [], []
+    width, dtype = None, np.dtype(np.int64)
+    for graph_ids, offsets, counts in parts():
+        all_ids.append(np.asarray(graph_ids, dtype=np.int64))
+        all_sizes.append(np.diff(offsets))
+        if width is not None and counts.shape[1] != width:
+            raise ValueError(f'Inconsistent basis size {counts.shape[1]} != {width}')
+        width = counts.shape[1]
+        dtype = np.promote_types(dtype, counts.dtype)
+
+    graph_ids = np.concatenate(all_ids) if all_ids else np.zeros(0, dtype=np.int64)
+    sizes = np.concatenate(all_sizes) if all_sizes else np.zeros(0, dtype=np.int64)
+    if len(np.unique(graph_ids)) != len(graph_ids):
+        raise ValueError('Duplicate graph ids in count parts')
+
+    # the store is sorted by graph id, dst_start[i] is where the i-th input graph goes
+    order = np.argsort(graph_ids, kind='stable')
+    offsets = np.zeros(len(graph_ids) + 1, dtype=np.int64)
+    np.cumsum(sizes[order], out=offsets[1:])
+    dst_start = np.empty(len(graph_ids), dtype=np.int64)
+    dst_start[order] = offsets[:-1]
+
+    os.makedirs(path, exist_ok=True)
+    counts_path = os.path.join(path, COUNTS_FILE)
+    tmp_path = counts_path + '.tmp'
+    matrix = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=dtype,
+                                       shape=(int(offsets[-1]), width or 0))
+
+    # second pass: scatter every part into its place
+    pos = 0
+    for _, part_offsets, counts in parts():
+        n = len(part_offsets) - 1
+        starts = dst_start[pos:pos + n]
+        lens = np.diff(part_offsets)
+        # row index in the store for every row of the part
+        rows = np.repeat(starts - part_offsets[:-1], lens) + np.arange(part_offsets[-1])
+        matrix[rows] = counts
+        pos += n
+    matrix.flush()
+    del matrix
+    os.replace(tmp_path, counts_path)
+
+    np.save(os.path.join(path, OFFSETS_FILE), offsets)
+    np.save(os.path.join(path, GRAPH_IDS_FILE), graph_ids[order])
+
+    meta.update({
+        'format': FORMAT_NAME,
+        'version': FORMAT_VERSION,
+        'num_graphs': len(graph_ids),
+        'num_vertices': int(offsets[-1]),
+        'basis_size': width or 0,
+        'dtype': dtype.name,
+    })
+    with open(os.path.join(path, META_FILE), 'w') as f:
+        json.dump(meta, f, indent=2)
+    return path
+
+
+class CountStore:
+    """Read access to a count store, the count matrix is memory-mapped."""
+
+    def __init__(self, path, mmap_mode='r'):
+        self.path = path
+        with open(os.path.join(path, META_FILE), 'r') as f:
+            self.meta = json.load(f)
+        self.counts = np.load(os.path.join(path, COUNTS_FILE), mmap_mode=mmap_mode)
+        self.offsets = np.load(os.path.join(path, OFFSETS_FILE))
+        self.graph_ids = np.load(os.path.join(path, GRAPH_IDS_FILE))
+
+        # the common case of graphs 0..n-1 needs no lookup at all
+        self._dense_ids = bool(np.array_equal(self.graph_ids, np.arange(len(self.graph_ids))))
+
+    @property
+    def basis(self):
+        return self.meta.get('basis')
+
+    @property
+    def coefficients(self):
+        return self.meta.get('coefficients')
+
+    @property
+    def basis_size(self):
+        return self.counts.shape[1]
+
+    def __len__(self):
+        return len(self.graph_ids)
+
+    def __contains__(self, graph_id):
+        return self.position(graph_id) is not None
+
+    def position(self, graph_id):
+        if self._dense_ids:
+            return graph_id if 0 <= graph_id < len(self.graph_ids) else None
+        pos = np.searchsorted(self.graph_ids, graph_id)
+        if pos < len(self.graph_ids) and self.graph_ids[pos] == graph_id:
+            return int(pos)
+        return None
+
+    def __getitem__(self, graph_id):
+        """The (num_vertices, basis_size) counts of a graph, as a view into the store."""
+        pos = self.position(graph_id)
+        if pos is None:
+            raise KeyError(graph_id)
+        return self.counts[self.offsets[pos]:self.offsets[pos + 1]]
+
+    def graph_counts(self, graph_id, num_nodes=None):
+        """
+        Like indexing, but pads with zero rows up to `num_nodes`. Isolated
+        vertices at the end of a graph never show up in the legacy json
+        counts, so this is needed for stores converted from them.
+        """
+        rows = self[graph_id]
+        if num_nodes is None or num_nodes <= len(rows):
+            return rows
+        pad = np.zeros((num_nodes - len(rows), rows.shape[1]), dtype=rows.dtype)
+        return np.concatenate([rows, pad])
+
+
+"""
+Conversion of the legacy json formats
+"""
+
+
+def _vertex_rows(vertex_counts):
+    """Turns {vertex_idx: [counts...]} or [[counts...], ...] into a 2d array."""
+    if len(vertex_counts) == 0:
+        return None
+    if isinstance(vertex_counts, list):
+        return np.array(vertex_counts).reshape(len(vertex_counts), -1)
+    vertices = np.fromiter(map(int, vertex_counts.keys()), dtype=np.int64)
+    values = np.array(list(vertex_counts.values()))
+    rows = np.zeros((vertices.max() + 1, values.shape[1]), dtype=values.dtype)
+    rows[vertices] = values
+    return rows
+
+
+def _json_graph_counts(raw, field):
+    """Yields (graph_id, vertex_counts) for all known legacy layouts."""
+    # graphs without vertex counts say nothing about the layout
+    first = next((v for v in raw.values() if len(v) > 0), [])
+    if isinstance(first, list) and (len(first) == 0 or not isinstance(first[0], list)):
+        # a single graph mapping vertices to counts (COLLAB)
+        yield 0, raw
+        return
+    for gid, gvals in raw.items():
+        if isinstance(gvals, dict) and field in gvals:
+            gvals = gvals[field]
+        yield int(gid), gvals
+
+
+def convert_json(json_file, path, field='homcounts'):
+    """
+    Converts a legacy json count file into a count store. Supported are the
+    nested {graph: {field: {vertex: counts}}} files, plain {graph: {vertex: counts}}
+    and {graph: [counts per vertex]} files, and single graph {vertex: counts} files.
+    """
+    with open(json_file, 'r') as f:
+        raw = json.load(f)
+
+    # single pattern bases also stored their coefficients with every graph
+    first = next(iter(raw.values()))
+    coefficients = first.get('coefficients') if isinstance(first, dict) else None
+
+    graph_ids, blocks = [], []
+    width = None
+    for gid, vertex_counts in _json_graph_counts(raw, field):
+        rows = _vertex_rows(vertex_counts)
+        if rows is not None:
+            width = rows.shape[1]
+        graph_ids.append(gid)
+        blocks.append(rows)
+    if width is None:
+        raise ValueError(f'{json_file} has no vertex counts, the width of the store is unknown')
+    blocks = [b if b is not None else np.zeros((0, width), dtype=np.int64) for b in blocks]
+    del raw
+
+    offsets = np.zeros(len(blocks) + 1, dtype=np.int64)
+    np.cumsum([len(b) for b in blocks], out=offsets[1:])
+    counts = np.concatenate(blocks)
+    if counts.dtype == np.float64 and np.array_equal(counts, np.round(counts)) \
+            and np.abs(counts).max(initial=0) < 2**53:
+        counts = counts.astype(np.int64)
+
+    meta = {'source': os.path.abspath(json_file), 'coefficients': coefficients}
+    return write_store(path, lambda: iter([(graph_ids, offsets, counts)]), meta)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m pact.countstore',
+        description='Convert a json homomorphism count file into a columnar count store.')
+    parser.add_argument('json_file')
+    parser.add_argument('output', help='directory of the new count store')
+    parser.add_argument('--field', default='homcounts',
+                        help='per graph field holding the vertex counts (default: homcounts)')
+    args = parser.parse_args(argv)
+    convert_json(args.json_file, args.output, field=args.field)
+
+
+if __name__ == '__main__':
+    main()
@@ -95,6 +95,10 @@ class GraphWrapper:
     def is_directed(self):
         return nx.is_directed(self.graph)
 
+    @property
+    def has_bidirected_edge(self):
+        return self.is_directed and any(u in self.graph[v] for u, v in self.graph.edges())
+
     @property
     def V(self):
         return list(self.graph.nodes)
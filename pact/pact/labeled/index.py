@@ -0,0 +1,79 @@
+"""
+Label indexes of a host graph for the labeled counting path.
+
+Instead of materializing the full renamed edge relation and semi-joining it
+with the label relations afterwards, the labeled planner annotates every
+RENAME of the base relation with the labels required of its source and
+target. The executor then starts the scan from the edges that already satisfy
+these labels, which are built here once per host.
+
+The index is meant to be shared: build one `HostLabelIndex` per host and pass
+it to the executor for every pattern of a run, so the label vertex frames and
+restricted edge relations are computed only once.
+"""
+
+
+class HostLabelIndex:
+    def __init__(self, host, vlabel_dfs):
+        """
+        `host` is the raw edge DataFrame with attributes 's' and 't' and
+        `vlabel_dfs` maps every label to a DataFrame with attribute 'vertex'.
+        """
+        self.base = host.value_counts(['s', 't']).rename('count').reset_index()
+        self._label_vertices = {label: frozenset(df['vertex'])
+                                for label, df in vlabel_dfs.items()}
+        self._vertex_frames = dict()
+        self._out_index = dict()
+        self._in_index = dict()
+        self._edge_frames = dict()
+
+    def vertices(self, labels):
+        """The set of host vertices that carry all of `labels`."""
+        key = frozenset(labels)
+        if key not in self._vertex_frames:
+            # smallest label first to keep the intersections cheap
+            sets = sorted((self._label_vertices.get(label, frozenset()) for label in key), key=len)
+            self._vertex_frames[key] = frozenset.intersection(*sets)
+        return self._vertex_frames[key]
+
+    def _out_edges(self, label):
+        if label not in self._out_index:
+            vs = self._label_vertices.get(label, frozenset())
+            self._out_index[label] = self.base[self.base['s'].isin(vs)]
+        return self._out_index[label]
+
+    def _in_edges(self, label):
+        if label not in self._in_index:
+            vs = self._label_vertices.get(label, frozenset())
+            self._in_index[label] = self.base[self.base['t'].isin(vs)]
+        return self._in_index[label]
+
+    def edges(self, label_filter):
+        """
+        The base relation restricted to edges whose attribute `att` carries
+        all labels in `label_filter[att]` (`att` is 's' or 't').
+        """
+        src_labels = frozenset(label_filter.get('s', ()))
+        tgt_labels = frozenset(label_filter.get('t', ()))
+        key = (src_labels, tgt_labels)
+        if key in self._edge_frames:
+            return self._edge_frames[key]
+
+        if len(src_labels) == 0 and len(tgt_labels) == 0:
+            return self.base
+
+        # start from the smallest single label index and filter the rest
+        candidates = [(self._out_edges(label), 's', label) for label in src_labels] + \
+            [(self._in_edges(label), 't', label) for label in tgt_labels]
+        start, start_att, start_label = min(candidates, key=lambda c: len(c[0]))
+        edges = start
+
+        rest_src = src_labels - {start_label} if start_att == 's' else src_labels
+        rest_tgt = tgt_labels - {start_label} if start_att == 't' else tgt_labels
+        if len(rest_src) > 0:
+            edges = edges[edges['s'].isin(self.vertices(rest_src))]
+        if len(rest_tgt) > 0:
+            edges = edges[edges['t'].isin(self.vertices(rest_tgt))]
+
+        self._edge_frames[key] = edges
+        return edges
@@ -97,22 +97,18 @@ def rename_op(edgename, edge):
     return o
 
 
-def label_semijoin_op(edgename, vertex, label_info):
+def labeled_rename_op(edgename, edge, label_info):
     """
-    Filters edgename according to labels
+    Like rename_op, but the scan of the base relation is restricted to edges
+    whose endpoints carry the labels of the pattern vertices. This replaces
+    a semi-join with the label relations after every rename.
     """
-    ops = []
-    for label in label_info[vertex]:
-        label_base_rel = Operation.LABELREL_PREFIX + label
-        label_renamed_rel = f'label_{label}${vertex}'
-        ren = Operation(Operation.RENAME, label_renamed_rel,
-                        A=label_base_rel,
-                        rename_key={'vertex': vertex})
-        sj = Operation(Operation.SEMIJOIN, edgename,
-                       A=edgename, B=label_renamed_rel,
-                       key=[vertex])
-        ops += [ren, sj]
-    return ops
+    o = rename_op(edgename, edge)
+    label_filter = {att: sorted(label_info[v])
+                    for att, v in zip(('s', 't'), edge) if len(label_info[v]) > 0}
+    if len(label_filter) > 0:
+        o.label_filter = label_filter
+    return o
 
 
 def semijoin_op(parent, child, parentname, childname):
@@ -148,9 +144,7 @@ def _node_to_ops(node, index, label_info):
     nodename = node_name_from_index(index)
 
     for en, e in node.con_cover_map.items():
-        plan.append(rename_op(en, e))
-        for v in e:
-            plan.extend(label_semijoin_op(en, v, label_info))
+        plan.append(labeled_rename_op(en, e, label_info))
 
     # compute the node join
     # todo deal with name of resulting relation
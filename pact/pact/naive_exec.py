@@ -6,6 +6,8 @@ import sys
 import warnings
 import math
 from pact.operation import Operation
+from pact.labeled.index import HostLabelIndex
+from pact.adjacency import HostAdjacencyIndex, has_bidirected_edge
 import multiprocess as mp
 from gmpy2 import mpz
 
@@ -49,12 +51,49 @@ def _expect_mul_overflow(series1, series2):
         return True
 
 
+def _csr_join(A, key, rename_key, host_index):
+    """
+    Joins A with a renamed copy of the base relation on a single attribute by
+    expanding the adjacency lists of the host index. Returns None if the join
+    does not extend A by exactly one new attribute.
+    """
+    src, tgt = rename_key['s'], rename_key['t']
+    if key == src and tgt not in A.columns:
+        new_col, reverse = tgt, False
+    elif key == tgt and src not in A.columns:
+        new_col, reverse = src, True
+    else:
+        return None
+
+    rows, nbrs = host_index.extend(A[key].to_numpy(), reverse=reverse)
+    new = A.iloc[rows].reset_index(drop=True)
+    new[new_col] = nbrs
+    return new
+
+
 def naive_pandas_plan_exec(plan, base,
                            vlabel_dfs=None,
                            debug=False,
                            sliced_eval=None,
-                           graceful_bigint=True):
-    basedf = base.value_counts(['s', 't']).rename('count').reset_index()
+                           graceful_bigint=True,
+                           label_index=None,
+                           host_index=None):
+    """
+    If the plan contains label filtered renames (see pact.labeled.planner) the scans start
+    from `label_index`. Pass the same HostLabelIndex for all patterns on one host to share it,
+    otherwise one is built from `vlabel_dfs` for this call.
+    If `host_index` (a pact.adjacency.HostAdjacencyIndex of `base`) is given, joins that extend
+    a relation by one edge of the host are answered from its adjacency lists.
+    """
+    if label_index is None and vlabel_dfs is not None and any(op.label_filter for op in plan):
+        label_index = HostLabelIndex(base, vlabel_dfs)
+
+    if label_index is not None:
+        basedf = label_index.base
+    elif host_index is not None:
+        basedf = host_index.base
+    else:
+        basedf = base.value_counts(['s', 't']).rename('count').reset_index()
     state = {Operation.BASERELNAME: basedf}
 
     if vlabel_dfs is not None:
@@ -63,6 +102,8 @@ def naive_pandas_plan_exec(plan, base,
             state[internal_base] = labeldf
 
     slice_keys = set()
+    # relation name -> rename key, for plain renames of the base relation
+    base_scans = dict()
 
     if sliced_eval is not None:
         slice_keys = set(sliced_eval.keys())
@@ -73,15 +114,22 @@ def naive_pandas_plan_exec(plan, base,
         kind = op.kind
         if op.key is not None:
             key = list(op.key)
+        scan_B = base_scans.get(op.B)
+        base_scans.pop(op.new_name, None)
 
         if kind == Operation.RENAME:
-            A = state[op.A]
+            if op.label_filter:
+                A = label_index.edges(op.label_filter)
+            else:
+                A = state[op.A]
             newA = A.rename(columns=op.rename_key)
 
             A_cols = set(newA.columns)
             if slice_keys.intersection(A_cols) != set():
                 slice_query = _slice_query(newA, sliced_eval)
                 newA = newA[slice_query]
+            elif op.A == Operation.BASERELNAME and not op.label_filter:
+                base_scans[op.new_name] = op.rename_key
 
             state[op.new_name] = newA
 
@@ -122,10 +170,16 @@ def naive_pandas_plan_exec(plan, base,
         elif kind == Operation.JOIN or kind == Operation.SEMIJOIN:
             A, B = state[op.A], state[op.B]
             Bnocount = B.drop('count', axis=1) if 'count' in B.columns else B
-            if kind == Operation.JOIN and key == []:
-                new = A.merge(Bnocount, how='cross')
-            else:
-                new = A.join(Bnocount.set_index(key), on=key, how='inner')
+            new = None
+            if kind == Operation.JOIN and host_index is not None and \
+                    scan_B is not None and len(key) == 1:
+                new = _csr_join(A, key[0], scan_B, host_index)
+
+            if new is None:
+                if kind == Operation.JOIN and key == []:
+                    new = A.merge(Bnocount, how='cross')
+                else:
+                    new = A.join(Bnocount.set_index(key), on=key, how='inner')
             state[op.new_name] = new
 
         elif kind == Operation.PROJECT:
@@ -165,7 +219,8 @@ def _safe_sum_finalstate(state):
     return int(finalcount.sum())
 
 
-def sliced_pandas_homcount(pattern, host, vlabel_dfs, slicer, debug=False):
+def sliced_pandas_homcount(pattern, host, vlabel_dfs, slicer, debug=False,
+                           label_index=None, host_index=None):
     if not pattern.is_directed and pattern.star is not None:
         if slicer == dict():
             return _star_shortcut(host, pattern.star)
@@ -173,26 +228,46 @@ def sliced_pandas_homcount(pattern, host, vlabel_dfs, slicer, debug=False):
             warnings.warn('Slicer set for star pattern. Setting no slicer would allow for much\
  more efficient computation')
 
+    if getattr(pattern, 'pruned_bidirected', False):
+        # see pact.planner.prune_bidirected, only valid for hosts without bidirected edges
+        if host_index is not None:
+            bidirected = host_index.has_bidirected_edge
+        else:
+            bidirected = has_bidirected_edge(host)
+        if bidirected:
+            raise RuntimeError(f'Pattern {pattern.id} was pruned for having a bidirected edge, '
+                               'but the host has bidirected edges')
+        return 0
+
     if not hasattr(pattern, 'plan'):
         raise RuntimeError('No plan for', pattern.id)
 
+    if pattern.is_directed and host_index is None and HostAdjacencyIndex.supports(host):
+        host_index = HostAdjacencyIndex(host)
 
     if (not pattern.is_directed and hasattr(pattern, 'clique') and
         pattern.clique is not None and pattern.clique > 2):
         host = _undir_df_degree_thres(host, pattern.clique - 1)
+        # the shared indexes are for the full host
+        label_index = None
+        host_index = None
 
     x, empty = naive_pandas_plan_exec(pattern.plan,
                                       host,
                                       vlabel_dfs,
                                       debug=debug,
-                                      sliced_eval=slicer)
+                                      sliced_eval=slicer,
+                                      label_index=label_index,
+                                      host_index=host_index)
     homs = _safe_sum_finalstate(x) if not empty else 0
 
     return homs
 
 
-def naive_pandas_homcount(pattern, host, vlabel_dfs=None, debug=False):
-    return sliced_pandas_homcount(pattern, host, vlabel_dfs, slicer={}, debug=debug)
+def naive_pandas_homcount(pattern, host, vlabel_dfs=None, debug=False,
+                          label_index=None, host_index=None):
+    return sliced_pandas_homcount(pattern, host, vlabel_dfs, slicer={}, debug=debug,
+                                  label_index=label_index, host_index=host_index)
 
 
 # very simplistic for now, should allow for more variables and possible be automated in the future
@@ -200,12 +275,17 @@ def sliced_multithread_exec_helper(pattern, host,
                                    slice_var,
                                    interval_size,
                                    threads=2,
-                                   debug=False):
+                                   debug=False,
+                                   host_index=None):
+    # one index for all slices, instead of one per slice
+    if host_index is None and pattern.is_directed and HostAdjacencyIndex.supports(host):
+        host_index = HostAdjacencyIndex(host)
+
     def _helper(interval):
         lo, hi = interval
         slicer = {slice_var: (lo, hi)}
         return sliced_pandas_homcount(pattern, host, vlabel_dfs=None,
-                                      slicer=slicer, debug=debug)
+                                      slicer=slicer, debug=debug, host_index=host_index)
 
     top = host.max().max()
     steps = list(range(0, top, interval_size)) + [None]
@@ -13,7 +13,9 @@ class Operation:
     Each operation specifies a name for it's output relation and it is expected than an execution engine
     maintains these names in such a way that later Operations can refer to them.
 
-    RENAME: Rename relation A as in `renamer`
+    RENAME: Rename relation A as in `renamer`. A rename of the base relation may carry a
+    `label_filter` that maps 's' and/or 't' to a list of labels. The renamed relation then
+    only contains edges whose respective vertices carry all of these labels.
 
     JOIN: Join A and B on attributes in list `key`
 
@@ -29,14 +31,18 @@ class Operation:
     BASERELNAME = '_edge_base'
     LABELREL_PREFIX = '_vlabel_base_'
 
+    # class level default so that plans pickled before label filters existed still work
+    label_filter = None
+
     def __init__(self, kind, new_name,
-                 A=None, B=None, key=None, rename_key=None):
+                 A=None, B=None, key=None, rename_key=None, label_filter=None):
         self.kind = kind
         self.new_name = new_name
         self.A = A
         self.B = B
         self.key = key
         self.rename_key = rename_key
+        self.label_filter = label_filter
 
     def __repr__(self):
         if self.kind == Operation.JOIN:
@@ -49,6 +55,9 @@ class Operation:
             return f'{self.new_name} = Merge count from {self.B}({self.key}) into {self.A}'
         elif self.kind == Operation.RENAME:
             renames = ','.join([f'{o} → {n}' for o,n in self.rename_key.items()])
+            if self.label_filter:
+                labels = ','.join([f'{att}: {"&".join(ls)}' for att, ls in self.label_filter.items()])
+                return f'⍴: {self.A}[{labels}] -> {self.new_name}({renames})'
             return f'⍴: {self.A} -> {self.new_name}({renames})'
         elif self.kind == Operation.PROJECT:
             return f'{self.new_name} = project {self.A} to {self.key}'
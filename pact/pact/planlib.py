@@ -0,0 +1,303 @@
+"""
+Library of precompiled homomorphism bases.
+
+Every consumer of a standard basis used to unpickle the full dill
+`SpasmSpace` (networkx graphs, tree decompositions and all) just to get at
+the plans and coefficients of the basis graphs. The plan library stores only
+what counting needs in plain json, under a short basis name:
+
+    bases/library/index.json        name -> file, source and size of each basis
+    bases/library/<name>.json       per basis graph: id, coefficient, automorphism
+                                    count, edge list, width and the compiled plan,
+                                    plus the coefficients per target pattern for
+                                    bases shared by several patterns (treelets)
+
+Opening a library reads only the index. The file of a basis is read on first
+access by name, and the plan of a basis graph is only turned back into
+`Operation`s when it is first used, so counting jobs start without touching
+networkx, nauty or dill at all.
+
+    lib = default_library()
+    c8 = lib['cycle8']
+    for gid, coeff in c8.coefficients.items():
+        homs = naive_pandas_homcount(c8[gid], host)
+
+New bases are compiled from the usual dill basis files with
+
+    python -m pact.planlib add cycle8 bases/cycles/cycle8_basis.json
+"""
+import argparse
+import json
+import os
+from fractions import Fraction
+from pact.operation import Operation
+
+
+FORMAT_NAME = 'pact-planlib'
+FORMAT_VERSION = 1
+INDEX_FILE = 'index.json'
+
+DEFAULT_LIBRARY_DIR = os.environ.get(
+    'PACT_PLANLIB',
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'bases', 'library'))
+
+_KIND_NAMES = {
+    Operation.JOIN: 'JOIN',
+    Operation.SEMIJOIN: 'SEMIJOIN',
+    Operation.RENAME: 'RENAME',
+    Operation.COUNT_EXT: 'COUNT_EXT',
+    Operation.SUM_COUNT: 'SUM_COUNT',
+    Operation.PROJECT: 'PROJECT',
+}
+_KINDS = {name: kind for kind, name in _KIND_NAMES.items()}
+
+
+def encode_plan(plan):
+    """Turns a plan into a list of json friendly dicts, unset fields are left out."""
+    ops = []
+    for op in plan:
+        enc = {'kind': _KIND_NAMES[op.kind], 'name': op.new_name}
+        if op.A is not None:
+            enc['A'] = op.A
+        if op.B is not None:
+            enc['B'] = op.B
+        if op.key is not None:
+            enc['key'] = list(op.key)
+        if op.rename_key is not None:
+            enc['rename'] = [op.rename_key['s'], op.rename_key['t']]
+        if op.label_filter:
+            enc['labels'] = {att: list(labels) for att, labels in op.label_filter.items()}
+        ops.append(enc)
+    return ops
+
+
+def decode_plan(ops):
+    plan = []
+    for enc in ops:
+        rename = enc.get('rename')
+        plan.append(Operation(_KINDS[enc['kind']], enc['name'],
+                              A=enc.get('A'), B=enc.get('B'), key=enc.get('key'),
+                              rename_key={'s': rename[0], 't': rename[1]} if rename else None,
+                              label_filter=enc.get('labels')))
+    return plan
+
+
+class CompiledPattern:
+    """
+    A basis graph as stored in the library. Provides the attributes of
+    `GraphWrapper` that the executor uses (id, plan, is_directed, star,
+    clique, cycle) without the graph itself.
+    """
+
+    def __init__(self, entry):
+        self._entry = entry
+        self._plan = None
+        self.id = int(entry['id'])
+        coeff = entry.get('coefficient')
+        self.coefficient = Fraction(coeff) if coeff is not None else None
+        self.automorphisms = entry['automorphisms']
+        self.num_vertices = entry['vertices']
+        self.edges = [tuple(e) for e in entry['edges']]
+        self.is_directed = entry['directed']
+        self.ghw = entry['ghw']
+        self.star = entry.get('star')
+        self.clique = entry.get('clique')
+        self.cycle = entry.get('cycle')
+
+    @property
+    def plan(self):
+        if self._plan is None:
+            self._plan = decode_plan(self._entry['plan'])
+        return self._plan
+
+    @property
+    def num_edges(self):
+        return len(self.edges)
+
+    def __repr__(self):
+        return f'CompiledPattern({self.id}, |V|={self.num_vertices}, |E|={self.num_edges})'
+
+
+class CompiledBasis:
+    """
+    All basis graphs of one basis in their stored order, indexable by graph id.
+    `coefficients` maps the graph ids to their (exact) coefficients. Bases for
+    several patterns instead have `targets`, which maps each pattern id to its
+    own coefficient dict.
+    """
+
+    def __init__(self, name, raw):
+        self.name = name
+        self.source = raw.get('source')
+        self._patterns = {int(entry['id']): CompiledPattern(entry) for entry in raw['patterns']}
+        self.coefficients = {gid: F.coefficient for gid, F in self._patterns.items()
+                             if F.coefficient is not None}
+        self.targets = {int(pid): {int(gid): Fraction(c) for gid, c in coeffs.items()}
+                        for pid, coeffs in raw.get('targets', {}).items()}
+
+    def __getitem__(self, gid):
+        return self._patterns[gid]
+
+    def __contains__(self, gid):
+        return gid in self._patterns
+
+    def __len__(self):
+        return len(self._patterns)
+
+    def __iter__(self):
+        return iter(self._patterns.values())
+
+    def ids(self, min_ghw=None):
+        return [gid for gid, F in self._patterns.items()
+                if min_ghw is None or F.ghw >= min_ghw]
+
+
+class PlanLibrary:
+    """Registry of compiled bases in a library directory, keyed by basis name."""
+
+    def __init__(self, path=DEFAULT_LIBRARY_DIR):
+        self.path = path
+        index_path = os.path.join(path, INDEX_FILE)
+        if os.path.exists(index_path):
+            with open(index_path, 'r') as f:
+                self.index = json.load(f)
+        else:
+            self.index = {'format': FORMAT_NAME, 'version': FORMAT_VERSION, 'bases': {}}
+        self._loaded = dict()
+
+    def names(self):
+        return sorted(self.index['bases'].keys())
+
+    def __contains__(self, name):
+        return name in self.index['bases']
+
+    def __getitem__(self, name):
+        if name not in self._loaded:
+            if name not in self:
+                raise KeyError(f'No basis {name} in plan library {self.path}')
+            entry = self.index['bases'][name]
+            with open(os.path.join(self.path, entry['file']), 'r') as f:
+                self._loaded[name] = CompiledBasis(name, json.load(f))
+        return self._loaded[name]
+
+    def add(self, name, spasm_space, basis, source=None, targets=None):
+        """
+        Compiles the graphs in `basis` (graph id -> coefficient, or None) from
+        the spasm space into the library, replacing an existing basis of that
+        name. All basis graphs need a tree decomposition and a plan.
+        `targets` optionally maps pattern ids to their hombase coefficients.
+        """
+        # igraph & co are only needed for compiling, not for loading
+        from pact.hombase import num_automorphisms
+        from pact.graphwrapper import _is_cycle, _is_nx_star
+
+        patterns = []
+        for gid, coeff in basis.items():
+            F = spasm_space[gid]
+            if F.plan is None or F.td is None:
+                raise ValueError(f'Basis graph {gid} of {name} has no plan')
+            # spasm pickles of older GraphWrapper versions may lack some shape attributes
+            n = len(F.V)
+            star = F.star if hasattr(F, 'star') else _is_nx_star(F.graph)
+            clique = F.clique if hasattr(F, 'clique') else (n if n * (n - 1) / 2 == len(F.E) else None)
+            cycle = F.cycle if hasattr(F, 'cycle') else _is_cycle(F.graph)
+            patterns.append({
+                'id': str(gid),
+                'coefficient': str(coeff) if coeff is not None else None,
+                'automorphisms': int(num_automorphisms(F)),
+                'vertices': len(F.V),
+                'edges': [list(e) for e in F.E],
+                'directed': F.is_directed,
+                'ghw': F.td.ghw,
+                'star': star,
+                'clique': clique,
+                'cycle': cycle,
+                'plan': encode_plan(F.plan),
+            })
+
+        os.makedirs(self.path, exist_ok=True)
+        fname = f'{name}.json'
+        with open(os.path.join(self.path, fname), 'w') as f:
+            raw = {'name': name, 'source': source, 'patterns': patterns}
+            if targets is not None:
+                raw['targets'] = {str(pid): {str(gid): str(c) for gid, c in coeffs.items()}
+                                  for pid, coeffs in targets.items()}
+            json.dump(raw, f, separators=(',', ':'))
+
+        self.index['bases'][name] = {
+            'file': fname,
+            'source': source,
+            'size': len(patterns),
+            'directed': any(p['directed'] for p in patterns),
+            'max_vertices': max((p['vertices'] for p in patterns), default=0),
+        }
+        with open(os.path.join(self.path, INDEX_FILE), 'w') as f:
+            json.dump(self.index, f, indent=2, sort_keys=True)
+        self._loaded.pop(name, None)
+
+    def add_basis_file(self, name, basis_file):
+        """Compiles a dill basis file ({'SpasmSpace': ..., 'basis': ...}) into the library."""
+        import dill
+        with open(basis_file, 'rb') as f:
+            basis_info = dill.loads(f.read())
+        self.add(name, basis_info['SpasmSpace'], basis_info['basis'],
+                 source=os.path.relpath(basis_file, os.path.dirname(self.path)))
+
+    def add_spasm_files(self, name, spasm_file, patterns_file):
+        """
+        Compiles the output of `Standard Precomputations` (a spasm space and a
+        dict of patterns with hombases) into the library, e.g., as treelets6.
+        """
+        import dill
+        with open(spasm_file, 'rb') as f:
+            spasm_space = dill.loads(f.read())
+        with open(patterns_file, 'rb') as f:
+            patterns = dill.loads(f.read())
+
+        targets = {P.id: P.hombase for P in patterns.values()}
+        used = dict.fromkeys(gid for coeffs in targets.values() for gid in coeffs)
+        self.add(name, spasm_space, used, targets=targets,
+                 source=os.path.relpath(spasm_file, os.path.dirname(self.path)))
+
+
+_DEFAULT = None
+
+
+def default_library():
+    """The library shipped in bases/library (or $PACT_PLANLIB), opened once per process."""
+    global _DEFAULT
+    if _DEFAULT is None:
+        _DEFAULT = PlanLibrary()
+    return _DEFAULT
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m pact.planlib',
+                                     description='Manage the library of compiled bases.')
+    parser.add_argument('-l', '--library', default=DEFAULT_LIBRARY_DIR,
+                        help='library directory (default: %(default)s)')
+    sub = parser.add_subparsers(dest='command', required=True)
+    add = sub.add_parser('add', help='compile a dill basis file into the library')
+    add.add_argument('name', help='name of the basis, e.g., cycle8')
+    add.add_argument('basis_file')
+    add_spasm = sub.add_parser('add-spasm',
+                               help='compile a spasm space and its patterns into the library')
+    add_spasm.add_argument('name', help='name of the basis, e.g., treelets6')
+    add_spasm.add_argument('spasm_file')
+    add_spasm.add_argument('patterns_file')
+    sub.add_parser('list', help='list all bases in the library')
+    args = parser.parse_args(argv)
+
+    lib = PlanLibrary(args.library)
+    if args.command == 'add':
+        lib.add_basis_file(args.name, args.basis_file)
+    elif args.command == 'add-spasm':
+        lib.add_spasm_files(args.name, args.spasm_file, args.patterns_file)
+    else:
+        for name in lib.names():
+            entry = lib.index['bases'][name]
+            print(f"{name:20s} {entry['size']:5d} graphs  {entry['source']}")
+
+
+if __name__ == '__main__':
+    main()
@@ -346,3 +346,25 @@ def node_to_ops_earlysj(node, index=0):
         plan.extend(count_plan)
 
     return plan
+
+
+"""
+Pruning
+"""
+
+
+def prune_bidirected(graphs):
+    """
+    Under the skip_bidirected assumption of pact.hombase (directed hosts have no
+    bidirected edges) every pattern with a bidirected edge has 0 homomorphisms
+    into the host. Drops the plans of these graphs and marks them, so that the
+    executor answers them with 0 without running a plan.
+    Returns the number of pruned graphs.
+    """
+    pruned = 0
+    for G in graphs:
+        if G.has_bidirected_edge:
+            G.plan = None
+            G.pruned_bidirected = True
+            pruned += 1
+    return pruned
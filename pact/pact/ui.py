@@ -1,10 +1,28 @@
-from rich.progress import Progress, SpinnerColumn, TimeElapsedColumn
+from rich.progress import Progress, ProgressColumn, SpinnerColumn, TimeElapsedColumn
+from rich.text import Text
 
 
-def default_progressbar():
+class ThroughputColumn(ProgressColumn):
+    """Renders the current speed of a task as `unit`s per second."""
+
+    def __init__(self, unit='it'):
+        self.unit = unit
+        super().__init__()
+
+    def render(self, task):
+        speed = task.finished_speed or task.speed
+        if speed is None:
+            return Text(f'? {self.unit}/s', style='progress.data.speed')
+        return Text(f'{speed:.1f} {self.unit}/s', style='progress.data.speed')
+
+
+def default_progressbar(throughput_unit=None):
     # define our progress bar
-    return Progress(
+    columns = [
         SpinnerColumn(),
         *Progress.get_default_columns(),
         TimeElapsedColumn(),
-    )
+    ]
+    if throughput_unit is not None:
+        columns.append(ThroughputColumn(throughput_unit))
+    return Progress(*columns)
@@ -12,6 +12,34 @@ GRAPH_CLASS = "gc"
 GRAPH_REG = "gr"
 
 
+def fully_adjacent_rgcn(conv, x_feat, edge_index, edge_attr, batch):
+    """
+    RGCNConv (sum aggregation, no bases / blocks) over the fully-adjacent graph of every molecule, without
+    materialising its N^2 edges. Pairs that are not bonded have type 0 in the FA graph, so every node
+    receives the sum of all nodes of its graph (itself included) through the type 0 weight, and the
+    bonded pairs only need a correction with the difference to their own type.
+    :param edge_index: The bonds (with self-loops) of the batch, the only FA edges with a type other than 0
+    :param edge_attr: Their types
+    :param batch: The graph of every node
+    """
+    assert conv.num_bases is None and conv.num_blocks is None and conv.aggr == "add"
+    weight = conv.weight  # [Types, In, Out]
+    nb_nodes = x_feat.size(0)
+    out = scatter_sum(x_feat, batch, dim=0)[batch] @ weight[0]
+    for edge_type in range(1, conv.num_relations):
+        mask = edge_attr == edge_type
+        if mask.any():
+            aggr = scatter_sum(
+                x_feat[edge_index[0, mask]], edge_index[1, mask], dim=0, dim_size=nb_nodes
+            )
+            out = out + aggr @ (weight[edge_type] - weight[0])
+    if conv.root is not None:
+        out = out + x_feat @ conv.root
+    if conv.bias is not None:
+        out = out + conv.bias
+    return out
+
+
 class NetGCN(torch.nn.Module):
     def __init__(
         self,
@@ -121,10 +149,6 @@ class NetGCN(torch.nn.Module):
         x_feat = data.x.to(self.device)
         edge_index = data.edge_index.to(self.device)
         edge_attr = data.edge_attr.to(self.device)
-        
-        fa_edge_index = data.fa_edge_index.to(self.device)
-        fa_edge_attr = data.fa_edge_attr.to(self.device)
-        
         batch = data.batch.to(self.device)
 
         x_feat = self.initial_mlp(x_feat)  # Otherwise by an MLP
@@ -136,7 +160,9 @@ class NetGCN(torch.nn.Module):
             gcn_layer, linear_layer = value
             
             if idx == (len(self.gcn_modules) - 1):
-                x_feat = gcn_layer(x_feat, fa_edge_index, fa_edge_attr).to(self.device)
+                x_feat = fully_adjacent_rgcn(
+                    gcn_layer, x_feat, edge_index, edge_attr, batch
+                ).to(self.device)  # Last layer is fully adjacent
             else:
                 x_feat = gcn_layer(x_feat, edge_index, edge_attr).to(self.device)
             
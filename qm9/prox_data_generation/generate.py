@@ -1,6 +1,10 @@
+import argparse
+import os
 import pickle
+import sys
 from pathlib import Path
 import os.path as osp
+import multiprocessing as mp
 import torch
 
 from find_coloring import find_coloring
@@ -8,30 +12,38 @@ from graph_modifier import modify_add_edge
 
 import tqdm
 import numpy as np
-from scipy.sparse.csgraph import floyd_warshall
-from torch_geometric.data import Data
-from torch_geometric.utils import to_dense_adj, to_undirected
-import networkx as nx
+from torch_geometric.data import Data, InMemoryDataset
+
+sys.path.insert(0, osp.join(osp.dirname(osp.abspath(__file__)), "..", "src"))
+from utils.shortest_paths import ShortestPathTransform  # noqa: E402
 
 
 def gen_ff_graph(num_layers: int, layer_width: int):
+    """
+    Feedforward graph: every node of layer i is connected to every node of layer i + 1. Node
+    i * layer_width + j is the j-th node of layer i. The edges are undirected and sorted as by to_undirected.
+    """
     nb_nodes = num_layers * layer_width
-    ff_graph = nx.Graph()
-    ff_graph.add_nodes_from([x for x in range(num_layers * layer_width)])
-    for i in range(num_layers - 1):
-        ff_graph.add_edges_from(
-            [
-                (i * layer_width + j, (i + 1) * layer_width + k)
-                for j in range(layer_width)
-                for k in range(layer_width)
-            ]
-        )
-    edge_index = to_undirected(
-        torch.LongTensor(np.array(ff_graph.edges).T), num_nodes=nb_nodes
-    )
+    layer = np.arange(nb_nodes) // layer_width
+    src, dst = np.nonzero(np.abs(layer[:, np.newaxis] - layer[np.newaxis, :]) == 1)
+    edge_index = torch.from_numpy(np.stack([src, dst]))
     return edge_index, nb_nodes
 
 
+def ff_shortest_paths(num_layers: int, layer_width: int):
+    """
+    Shortest path table of the feedforward graph in closed form: nodes in different layers are as far
+    apart as their layers, distinct nodes of the same layer are 2 hops apart (through a neighbouring layer).
+    """
+    nb_nodes = num_layers * layer_width
+    layer = np.arange(nb_nodes) // layer_width
+    sp_table = np.abs(layer[:, np.newaxis] - layer[np.newaxis, :]).astype(np.float64)
+    same_layer = sp_table == 0
+    sp_table[same_layer] = 2 if num_layers > 1 else np.inf
+    np.fill_diagonal(sp_table, 0)
+    return sp_table
+
+
 def gen_yes_no_graph_pair(
     num_layers, width_layers, num_red, hop_threshold, count_threshold=3
 ):
@@ -54,8 +66,7 @@ def gen_yes_no_graph_pair(
         num_layers=num_layers, layer_width=width_layers
     )
     graph = Data(edge_index=edge_index, num_nodes=num_nodes)
-    adj_matrix = to_dense_adj(edge_index, max_num_nodes=num_nodes)[0]
-    sp_table = floyd_warshall(adj_matrix)
+    sp_table = ff_shortest_paths(num_layers=num_layers, layer_width=width_layers)
 
     yes_graph = find_coloring(
         graph,
@@ -81,39 +92,95 @@ def gen_yes_no_graph_pair(
     return yes_graph, no_graph
 
 
+def gen_prox_pair(job):
+    """
+    Generates one (yes, no) pair, resampling until both exist, and the pair after the transform. Every
+    pair has its own seed, so the dataset does not depend on how the pairs are spread over the workers.
+    """
+    clf_threshold, c_red, seed, transform = job
+    np.random.seed(seed)
+    layers = np.random.randint(15, 25)
+    width = np.random.randint(3, 10)
+    while True:
+        yes_g, no_g = gen_yes_no_graph_pair(
+            num_layers=layers,
+            width_layers=width,
+            hop_threshold=clf_threshold,
+            num_red=c_red,
+        )
+
+        if yes_g and no_g:
+            if transform is None:
+                return (yes_g, no_g), None
+            # The pre-transform of ProximityDataset, done here in parallel
+            return (yes_g, no_g), (transform(yes_g.clone()), transform(no_g.clone()))
+
+
+def generate_prox(clf_threshold, nb_pairs=1500, seed=0, num_workers=None, max_distance=10):
+    """
+    Writes the raw graph list of the ``<clf_threshold>-Prox`` dataset, and the processed (shortest path
+    transformed and collated) ProximityDataset file, so that it does not need to be processed on first use.
+    """
+    transform = ShortestPathTransform(max_distance=max_distance) if max_distance else None
+    jobs = [
+        (clf_threshold, c_red, seed * 1000003 + clf_threshold * 100003 + c_red * 10007 + i, transform)
+        for c_red in [3, 2, 1]  # 3 Up to 3 red nodes
+        for i in range(nb_pairs)  # The number of blue nodes won't be a parameter anymore
+    ]
+    with mp.Pool(num_workers or os.cpu_count()) as pool:
+        pairs = list(
+            tqdm.tqdm(pool.imap(gen_prox_pair, jobs, chunksize=16), total=len(jobs))
+        )
+    graphs_list = [graph for pair, _ in pairs for graph in pair]
+
+    dataset_path = osp.abspath(
+        osp.join(
+            osp.dirname(__file__), "..", "data", "Prox", str(clf_threshold) + "-Prox",
+        )
+    )
+    # Store raw list
+    raw_dataset_path = osp.join(dataset_path, "raw")
+    Path(raw_dataset_path).mkdir(parents=True, exist_ok=True)
+    with open(osp.join(raw_dataset_path, "data_list.pickle"), "wb") as f:
+        pickle.dump(graphs_list, f)
+
+    if transform is not None:
+        processed_path = osp.join(dataset_path, "processed")
+        Path(processed_path).mkdir(parents=True, exist_ok=True)
+        transformed = [graph for _, pair in pairs for graph in pair]
+        torch.save(InMemoryDataset.collate(transformed), osp.join(processed_path, "data_sp.pt"))
+        # As written by PyG after processing, to recognise the pre-transform
+        torch.save(repr(transform), osp.join(processed_path, "pre_transform.pt"))
+        torch.save("None", osp.join(processed_path, "pre_filter.pt"))
+
+
 if __name__ == "__main__":
-    for clf_threshold in [1, 3, 5, 8, 10]:
-        graphs_list = []  # List of graphs
-        for c_red in [3, 2, 1]:  # 3 Up to 3 red nodes
-            for i in tqdm.tqdm(
-                range(1500)
-            ):  # The number of blue nodes won't be a parameter anymore
-                layers = np.random.randint(15, 25)
-                width = np.random.randint(3, 10)
-                while True:
-                    yes_g, no_g = gen_yes_no_graph_pair(
-                        num_layers=layers,
-                        width_layers=width,
-                        hop_threshold=clf_threshold,
-                        num_red=c_red,
-                    )
-
-                    if yes_g and no_g:
-                        graphs_list.append(yes_g)
-                        graphs_list.append(no_g)
-                        break
-
-        raw_dataset_path = osp.abspath(
-            osp.join(
-                osp.dirname(__file__),
-                "..",
-                "data",
-                "Prox",
-                str(clf_threshold) + "-Prox",
-                "raw",
-            )
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--thresholds", help="Hop thresholds of the datasets.", nargs="+", type=int,
+        default=[1, 3, 5, 8, 10],
+    )
+    parser.add_argument(
+        "--nb_pairs", help="Pairs per number of red nodes.", default=1500, type=int
+    )
+    parser.add_argument("--seed", help="Random seed.", default=0, type=int)
+    parser.add_argument(
+        "--num_workers", help="Worker processes (default: all cores).", default=None, type=int
+    )
+    parser.add_argument(
+        "--max_distance",
+        help="Max distance of the shortest path pre-transform (as in get_dataset), 0 to only write "
+        "the raw graphs.",
+        default=10,
+        type=int,
+    )
+    args = parser.parse_args()
+
+    for clf_threshold in args.thresholds:
+        generate_prox(
+            clf_threshold,
+            nb_pairs=args.nb_pairs,
+            seed=args.seed,
+            num_workers=args.num_workers,
+            max_distance=args.max_distance,
         )
-        # Store raw list
-        Path(raw_dataset_path).mkdir(parents=True, exist_ok=True)
-        with open(osp.join(raw_dataset_path, "data_list.pickle"), "wb") as f:
-            pickle.dump(graphs_list, f)
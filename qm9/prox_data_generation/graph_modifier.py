@@ -88,52 +88,20 @@ def modify_add_edge(yes_graph, hop_threshold, sp_table):
 
     :return: The desired "no" instance for the dataset.
     """
-    closest_red = sp_table[
-        :, yes_graph.x[:, 0] == 1
-    ]  # This is of shape [num_nodes, num_red]
-    closest_blue = sp_table[
-        :, yes_graph.x[:, 0] == 2
-    ]  # This is of shape [num_nodes, num_blue]
+    # The new edge (src, dst) creates a red-blue path of length min_b sp(src, b) + 1 + min_r sp(dst, r),
+    # so only the distance of every node to its closest red and closest blue node is needed.
+    closest_red = np.min(sp_table[:, yes_graph.x[:, 0] == 1], axis=1)  # [num_nodes]
+    closest_blue = np.min(sp_table[:, yes_graph.x[:, 0] == 2], axis=1)  # [num_nodes]
+    num_nodes = sp_table.shape[0]
 
-    num_red = closest_red.shape[1]
-    num_blue = closest_blue.shape[1]
-    num_nodes = closest_blue.shape[0]
-
-    red_tiled = np.tile(
-        closest_red, (num_nodes, num_blue)
-    )  # [num_nodes^2, num_red * num_blue]
-    # N1: R1 R2 R1 R2 R1 R2 ... N20: R1 R2 R1 R2, N1: R1 R2 R1 R2
-    blue_repeated = np.repeat(closest_blue, num_nodes, axis=0)
-    blue_repeated = np.repeat(
-        blue_repeated, num_red, axis=1
-    )  # [num_nodes^2, num_red * num_blue]
-    # N1: B1 B1 B2 B2, N1: B1 B1 B2 B2, N2: B1 B1 B2 B2
-    # Thus, by summing these we get the SP sum of the two nodes we are trying to connect. However,
-    # this includes self-loops, which we must remove. We must also remove existing edges.
-    sp_sums = red_tiled + blue_repeated
-    self_loop_mask = [i * num_nodes + i for i in range(num_nodes)]
-    existing_edge_mask = [
-        yes_graph.edge_index[0, i].item() * num_nodes
-        + yes_graph.edge_index[1, i].item()
-        for i in range(yes_graph.edge_index.shape[1])
-    ]
-    overall_mask = self_loop_mask + existing_edge_mask
-    overall_mask_as_bool = np.ones(num_nodes * num_nodes, dtype=bool)  # A 0/1 mask
-    overall_mask_as_bool[
-        overall_mask
-    ] = False  # This mask will continue to be filtered as we go
-
-    sp_sums_new_edges = sp_sums[overall_mask_as_bool, :]
-    # We now have to check the possible edges against the clf_threshold
-    min_sp_sums_new_edges = np.min(
-        sp_sums_new_edges, axis=1
-    )  # We now filter the edges where sum is >= thresh
-    valid_sp_sums_mask = (
-        min_sp_sums_new_edges < hop_threshold
+    # Candidate edges, as flat indices src * num_nodes + dst. Self-loops and existing edges are excluded.
+    overall_mask_as_bool = (
+        closest_blue[:, np.newaxis] + closest_red[np.newaxis, :] < hop_threshold
     )  # i.e., thresh - 1 or less. Any would do.
-    overall_mask_as_bool[
-        overall_mask_as_bool
-    ] = valid_sp_sums_mask  # Update the already true values
+    np.fill_diagonal(overall_mask_as_bool, False)
+    edge_index = yes_graph.edge_index.numpy()
+    overall_mask_as_bool[edge_index[0], edge_index[1]] = False
+    overall_mask_as_bool = overall_mask_as_bool.reshape(-1)
     # Now check if we have enough valid edges
     nb_valid_edges = np.sum(1 * overall_mask_as_bool)
     if nb_valid_edges >= 1:
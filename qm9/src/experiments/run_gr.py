@@ -1,3 +1,4 @@
+import copy
 import torch
 from torch_geometric.loader import DataLoader
 import numpy as np
@@ -37,49 +38,59 @@ CHEMICAL_ACC_NORMALISING_FACTORS = [
 # Dropout is not used. MSE training, MAE for valid and test, with the above de-normalizing factors.
 
 
-def train(model, loader, optimizer, loss_fun, device="cpu", y_idx=0):
-    model.train()
-    loss_all = 0
+def train(models, loader, optimizers, loss_fun, device="cpu", y_idxs=(0,)):
+    """
+    One epoch for a group of independent models, model i being trained on target y_idxs[i]. Every batch
+    is loaded and moved to the device once for the whole group.
+    """
+    for model in models:
+        model.train()
+    loss_all = np.zeros(len(models))
 
     for data in loader:
         data = data.to(device)
-        optimizer.zero_grad()
-        loss = loss_fun(model(data), data.y[:, y_idx : y_idx + 1]).to(device)  #
-        loss.backward()
-        loss_all += loss.item()
-        
-        torch.nn.utils.clip_grad_norm_(model.parameters(), max_norm=1.0)
-        optimizer.step()
+        for i, (model, optimizer, y_idx) in enumerate(zip(models, optimizers, y_idxs)):
+            optimizer.zero_grad()
+            loss = loss_fun(model(data), data.y[:, y_idx : y_idx + 1]).to(device)  #
+            loss.backward()
+            loss_all[i] += loss.item()
 
-    return loss_all / len(loader.dataset)
-
-
-def val(model, loader, loss_fun, device="cpu", y_idx=0):
-    model.eval()
-    loss_all = 0
-
-    for data in loader:
-        data = data.to(device)
-        loss_all += loss_fun(model(data), data.y[:, y_idx : y_idx + 1]).item()
+            torch.nn.utils.clip_grad_norm_(model.parameters(), max_norm=1.0)
+            optimizer.step()
 
     return loss_all / len(loader.dataset)
 
 
-def test(model, loader, device="cpu", y_idx=0):
-    model.eval()
-    total_err = 0
+def evaluate(models, loader, loss_fun, device="cpu", y_idxs=(0,)):
+    """
+    Loss (as in training) and de-normalised MAE of every model in one pass over the loader.
+    """
+    for model in models:
+        model.eval()
+    loss_all = np.zeros(len(models))
+    total_err = np.zeros(len(models))
 
-    for data in loader:
-        data = data.to(device)
-        pred = torch.sum(torch.abs(model(data) - data.y[:, y_idx : y_idx + 1])).item()
-        total_err += pred
+    with torch.no_grad():
+        for data in loader:
+            data = data.to(device)
+            for i, (model, y_idx) in enumerate(zip(models, y_idxs)):
+                out = model(data)
+                target = data.y[:, y_idx : y_idx + 1]
+                loss_all[i] += loss_fun(out, target).item()
+                total_err[i] += torch.sum(torch.abs(out - target)).item()
 
-    return total_err / (
-        len(loader.dataset) * CHEMICAL_ACC_NORMALISING_FACTORS[y_idx]
-    )  # Introduce norm factors
+    return (
+        loss_all / len(loader.dataset),
+        total_err
+        / (
+            len(loader.dataset) * np.array(CHEMICAL_ACC_NORMALISING_FACTORS)[list(y_idxs)]
+        ),  # Introduce norm factors
+    )
 
 
-# Treat every target separately. So you're effectively training 13 times.
+# Treat every target separately. So you're effectively training 13 times (times nb_reruns).
+# parallel_runs of these (target, rerun) runs are trained side by side on the same loaders, every run
+# with its own copy of the model and its own optimizer.
 
 
 def run_model_gr(
@@ -94,84 +105,122 @@ def run_model_gr(
     device="cpu",
     nb_reruns=5,
     specific_task=-1,
+    parallel_runs=1,
+    train_eval_size=None,
 ):
+    if parallel_runs < 1:
+        raise ValueError("parallel_runs must be at least 1, got " + str(parallel_runs))
     loss_fun = torch.nn.MSELoss(
         reduction="sum"
     )  # Mean-Squared Loss is used for regression
 
-    print("---------------- Training on provided split (QM9) ----------------")
-    for y_idx, targ in enumerate(TASKS):  # Solve each one at a time...
-        if 0 <= specific_task != y_idx:
-            continue
-        print("----------------- Predicting " + str(targ) + " -----------------")
-        all_test_mae = np.zeros(nb_reruns,)
-        all_val_mae = np.zeros(nb_reruns,)
+    val_loader = DataLoader(dataset_val, batch_size=batch_size, shuffle=False)
+    test_loader = DataLoader(dataset_tst, batch_size=batch_size, shuffle=False)
+    train_loader = DataLoader(
+        dataset_tr, batch_size=batch_size, shuffle=True
+    )  # Shuffling is good here
+    if neptune_client is not None and train_eval_size is not None:
+        # Train metrics for logging are taken from a fixed random subset of the training set
+        subset = torch.randperm(len(dataset_tr))[:train_eval_size].tolist()
+        train_eval_loader = DataLoader(
+            [dataset_tr[i] for i in subset], batch_size=batch_size, shuffle=False
+        )
+    else:
+        train_eval_loader = DataLoader(dataset_tr, batch_size=batch_size, shuffle=False)
 
-        for rerun in range(nb_reruns):  # 5 Reruns for GR
-            model.reset_parameters()
+    print("---------------- Training on provided split (QM9) ----------------")
+    runs = [
+        (y_idx, rerun)
+        for y_idx in range(len(TASKS))
+        if not 0 <= specific_task != y_idx
+        for rerun in range(nb_reruns)  # 5 Reruns for GR
+    ]
+    all_test_mae = np.zeros((len(TASKS), nb_reruns))
+    all_val_mae = np.zeros((len(TASKS), nb_reruns))
+
+    for start in range(0, len(runs), parallel_runs):
+        group = runs[start : start + parallel_runs]
+        y_idxs = [y_idx for y_idx, _ in group]
+        rerun_strs = ["QM9/" + TASKS[y_idx] + "/rerun_" + str(rerun) for y_idx, rerun in group]
+        print(
+            "---------------- "
+            + ", ".join(TASKS[y_idx] + ": Re-run " + str(rerun) for y_idx, rerun in group)
+            + " ----------------"
+        )
+
+        models = [model] + [copy.deepcopy(model) for _ in group[1:]]
+        optimizers = []
+        for group_model in models:
+            group_model.reset_parameters()
             # optimizer = torch.optim.Adam(model.parameters(), lr=lr)
-            optimizer = torch.optim.RMSprop(model.parameters(), lr=lr, momentum=0.85, alpha=0.98)
+            optimizers.append(
+                torch.optim.RMSprop(group_model.parameters(), lr=lr, momentum=0.85, alpha=0.98)
+            )
             # scheduler = torch.optim.lr_scheduler.StepLR(optimizer, step_size=50, gamma=0.5)  # Made static
 
-            val_loader = DataLoader(dataset_val, batch_size=batch_size, shuffle=False)
-            test_loader = DataLoader(dataset_tst, batch_size=batch_size, shuffle=False)
-            train_loader = DataLoader(
-                dataset_tr, batch_size=batch_size, shuffle=True
-            )  # Shuffling is good here
-
-            rerun_str = "QM9/" + str(targ) + "/rerun_" + str(rerun)
-            print(
-                "---------------- "
-                + str(targ)
-                + ": Re-run {} ----------------".format(rerun)
-            )
+        best_val_mse = np.full(len(group), 100000.0)
+        test_mae = np.full(len(group), 100.0)
+        best_val_mae = np.full(len(group), 100000.0)
+        best_val_epoch = np.zeros(len(group), dtype=int)
 
-            best_val_mse = 100000
-            test_mae = 100
-            best_val_mae = 100000
-            best_val_epoch = 0
+        for epoch in range(1, epochs + 1):
+            # lr = scheduler.optimizer.param_groups[0]['lr']  # Same as GC
+            train_mse = train(
+                models, train_loader, optimizers, loss_fun, device=device, y_idxs=y_idxs
+            )
+            val_mse, val_mae = evaluate(
+                models, val_loader, loss_fun, device=device, y_idxs=y_idxs
+            )
+            # scheduler.step(val_mse_sum)
+            improved = best_val_mse >= val_mse  # Improvement in validation loss
+            if improved.any():
+                improved_idx = np.flatnonzero(improved)
+                _, test_mae[improved] = evaluate(
+                    [models[i] for i in improved_idx],
+                    test_loader,
+                    loss_fun,
+                    device=device,
+                    y_idxs=[y_idxs[i] for i in improved_idx],
+                )
+                best_val_mae[improved] = val_mae[improved]
+                best_val_mse[improved] = val_mse[improved]
+                best_val_epoch[improved] = epoch
 
-            for epoch in range(1, epochs + 1):
-                # lr = scheduler.optimizer.param_groups[0]['lr']  # Same as GC
-                train_mse = train(
-                    model, train_loader, optimizer, loss_fun, device=device, y_idx=y_idx
+            if neptune_client is not None:
+                _, train_mae = evaluate(
+                    models, train_eval_loader, loss_fun, device=device, y_idxs=y_idxs
                 )
-                val_mse = val(model, val_loader, loss_fun, device=device, y_idx=y_idx)
-                # scheduler.step(val_mse_sum)
-                if best_val_mse >= val_mse:  # Improvement in validation loss
-                    test_mae = test(model, test_loader, device=device, y_idx=y_idx)
-                    best_val_mae = test(model, val_loader, device=device, y_idx=y_idx)
-                    best_val_mse = val_mse
-                    best_val_epoch = epoch
-
-                if neptune_client is not None:
+                for i, rerun_str in enumerate(rerun_strs):
                     neptune_client[rerun_str + "/params/lr"].log(lr)
-                    neptune_client[rerun_str + "/train/loss"].log(train_mse)
-                    train_mae = test(model, train_loader, device=device, y_idx=y_idx)
-                    neptune_client[rerun_str + "/train/MAE"].log(train_mae)
-                    neptune_client[rerun_str + "/validation/loss"].log(val_mse)
-
-                    val_mae = test(model, val_loader, device=device, y_idx=y_idx)
-                    neptune_client[rerun_str + "/validation/MAE"].log(val_mae)
-                    neptune_client[rerun_str + "/test/MAE"].log(test_mae)
+                    neptune_client[rerun_str + "/train/loss"].log(train_mse[i])
+                    neptune_client[rerun_str + "/train/MAE"].log(train_mae[i])
+                    neptune_client[rerun_str + "/validation/loss"].log(val_mse[i])
+                    neptune_client[rerun_str + "/validation/MAE"].log(val_mae[i])
+                    neptune_client[rerun_str + "/test/MAE"].log(test_mae[i])
 
-                    model.log_hop_weights(neptune_client, rerun_str)
+                    models[i].log_hop_weights(neptune_client, rerun_str)
 
+            for i, (y_idx, rerun) in enumerate(group):
                 print(
-                    "Epoch: {:03d}, LR: {:7f}, Train Loss: {:.7f}, "
+                    ("{}/{}: ".format(TASKS[y_idx], rerun) if len(group) > 1 else "")
+                    + "Epoch: {:03d}, LR: {:7f}, Train Loss: {:.7f}, "
                     "Val Loss: {:.7f}, Test MAE: {:.7f}".format(
-                        epoch, lr, train_mse, val_mse, test_mae
+                        epoch, lr, train_mse[i], val_mse[i], test_mae[i]
                     )
                 )
 
-            all_test_mae[rerun] = test_mae
-            all_val_mae[rerun] = best_val_mae
+        for i, (y_idx, rerun) in enumerate(group):
+            all_test_mae[y_idx, rerun] = test_mae[i]
+            all_val_mae[y_idx, rerun] = best_val_mae[i]
 
-        avg_test_mae = all_test_mae.mean()
-        avg_val_mae = all_val_mae.mean()
+    for y_idx, targ in enumerate(TASKS):
+        if 0 <= specific_task != y_idx:
+            continue
+        avg_test_mae = all_test_mae[y_idx].mean()
+        avg_val_mae = all_val_mae[y_idx].mean()
 
-        std_test_mae = np.std(all_test_mae)
-        std_val_mae = np.std(all_val_mae)
+        std_test_mae = np.std(all_test_mae[y_idx])
+        std_val_mae = np.std(all_val_mae[y_idx])
         # No need for averaging. This is 1 split anyway.
 
         if neptune_client is not None:
@@ -183,6 +232,6 @@ def run_model_gr(
             # torch.save(model, "../model.pt")
             neptune_client["QM9/" + str(targ) + "/model"].upload("model.pt")
 
-        print("---------------- Final Result ----------------")
+        print("---------------- Final Result: " + str(targ) + " ----------------")
         print("Test -- Mean: " + str(avg_test_mae) + ", Std: " + str(std_test_mae))
         print("Validation -- Mean: " + str(avg_val_mae) + ", Std: " + str(std_val_mae))
@@ -1,4 +1,3 @@
-import time
 import configparser
 import torch
 import argparse
@@ -7,7 +6,7 @@ from utils import get_dataset, get_model
 from experiments.run_gc import run_model_gc
 from experiments.run_gc_ogb import run_model_gc_ogb
 from experiments.run_gr import run_model_gr
-import neptune
+from utils.tracking import get_tracker
 
 
 def str2bool(v):
@@ -19,22 +18,17 @@ def str2bool(v):
         raise argparse.ArgumentTypeError("Boolean value expected.")
 
 
-# Neptune configuration
+def positive_int(v):
+    value = int(v)
+    if value < 1:
+        raise argparse.ArgumentTypeError("Positive integer expected.")
+    return value
+
+
+# Tracking configuration (local files, neptune or none), see config.ini
 config = configparser.ConfigParser()
 config.read("config.ini")
-
-# if config["DEFAULT"]["neptune_token"] and config["DEFAULT"]["neptune_token"] != "...":
-#     neptune_client = neptune.init_run(
-#         project=config["DEFAULT"]["neptune_project"],
-#         api_token=config["DEFAULT"]["neptune_token"],
-#     )
-# else:
-#     neptune_client = None
-
-neptune_client = neptune.init_run(
-    project="",
-    api_token="",
-)
+neptune_client = get_tracker(config)
 
 # CLI configuration
 parser = argparse.ArgumentParser()
@@ -96,6 +90,20 @@ parser.add_argument(
 parser.add_argument(
     "--nb_reruns", help="(For QM9) Repeats per task (default 5)", type=int, default=5
 )
+parser.add_argument(
+    "--parallel_runs",
+    help="(For QM9) Number of (task, rerun) models trained side by side on the same "
+    "data loaders (default 1)",
+    type=positive_int,
+    default=1,
+)
+parser.add_argument(
+    "--train_eval_size",
+    help="(For QM9) Number of sampled training graphs the logged train MAE is computed on "
+    "(default: the whole training set)",
+    type=int,
+    default=None,
+)
 parser.add_argument(
     "--res_freq",
     help="The layer interval for residual connections (default: -1, i.e., no residual)",
@@ -111,7 +119,7 @@ parser.add_argument(
 
 args = parser.parse_args()
 
-# Add arguments to neptune
+# Add arguments to the tracker
 if neptune_client:
     neptune_client["parameters"] = vars(args)
 
@@ -209,9 +217,9 @@ elif args.mode == "gr":  # Graph Regression, this is QM9
         neptune_client=neptune_client,
         specific_task=specific_task,
         nb_reruns=nb_reruns,
+        parallel_runs=args.parallel_runs,
+        train_eval_size=args.train_eval_size,
     )
 
 if neptune_client:
     neptune_client.stop()
-    # Sleep for final neptune sync
-    time.sleep(10)
@@ -121,10 +121,6 @@ class NetGCN(torch.nn.Module):
         x_feat = data.x.to(self.device)
         edge_index = data.edge_index.to(self.device)
         edge_attr = data.edge_attr.to(self.device)
-        
-        fa_edge_index = data.fa_edge_index.to(self.device)
-        fa_edge_attr = data.fa_edge_attr.to(self.device)
-        
         batch = data.batch.to(self.device)
 
         x_feat = self.initial_mlp(x_feat)  # Otherwise by an MLP
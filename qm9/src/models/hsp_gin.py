@@ -4,7 +4,7 @@ from torch.nn import ModuleList, Linear, Embedding
 from torch_scatter import scatter_max, scatter_mean, scatter_sum
 from ogb.graphproppred.mol_encoder import AtomEncoder, BondEncoder
 from models.layers.hsp_gin_layer import instantiate_mlp
-from models.layers import GIN_HSP_Layer
+from models.layers import GIN_HSP_Layer, HopAdjacency
 
 
 # Modes: GC: Graph Classification.
@@ -260,6 +260,16 @@ class NetHSP_GIN(torch.nn.Module):
         elif self.mode == GRAPH_REG:
             pass  # Do nothing
 
+        # The hop partition of the edges is the same for all layers, build it once
+        hops = HopAdjacency(
+            edge_index,
+            edge_weights,
+            x_feat.size(0),
+            self.max_distance,
+            edge_attr=edge_attr,
+            nb_edge_types=self.nb_edge_types,
+        )
+
         if self.residual_freq > 0:
             last_state_list = [x_feat]  # If skip connections are being used
         for idx, value in enumerate(zip(self.hsp_modules, self.linear_modules)):
@@ -294,6 +304,7 @@ class NetHSP_GIN(torch.nn.Module):
                 batch=batch,
                 edge_attr=edge_attr,
                 direct_edge_embs=edge_embeddings,
+                hops=hops,
             ).to(self.device)
             if self.residual_freq > 0:  # Time to introduce a residual
                 if self.residual_freq <= idx + 1:
@@ -1 +1 @@
-from models.layers.hsp_gin_layer import GIN_HSP_Layer
+from models.layers.hsp_gin_layer import GIN_HSP_Layer, HopAdjacency
@@ -2,7 +2,7 @@ import torch
 from torch.nn import MultiheadAttention
 from torch.nn import Linear, ReLU, BatchNorm1d
 from torch.nn import ModuleList, Sequential, Embedding
-from torch_geometric.utils import to_dense_adj
+from torch_geometric.utils import softmax
 import torch.nn.functional as F
 from torch_scatter import scatter_mean
 
@@ -60,6 +60,92 @@ def instantiate_mlp(
     return Sequential(*mlp_mods).to(device)
 
 
+class HopAdjacency:
+    """
+    The shortest path edges of a (batched) graph partitioned by hop. This is built once per forward
+    pass and shared by all HSP layers, instead of every layer masking the edges and building a
+    sparse matrix per hop again.
+
+    The edges with distance 1..max_distance are sorted by distance (stable), the edges of hop d
+    are edge_index[:, offsets[d - 1]:offsets[d]]. The hops are stacked into one coalesced sparse
+    (K * N, N) matrix whose block d - 1 is the adjacency of hop d, so that all hops are aggregated
+    by a single SpMM.
+    """
+
+    def __init__(
+        self,
+        edge_index,
+        edge_weights,
+        nb_nodes,
+        max_distance,
+        edge_attr=None,
+        nb_edge_types=1,
+    ):
+        self.nb_nodes = nb_nodes
+        self.max_distance = max_distance
+        self.device = edge_index.device
+
+        in_range = torch.logical_and(edge_weights >= 1, edge_weights <= max_distance)
+        self.direct_edges = edge_index[:, edge_weights == 1]  # in their original order
+        positions = in_range.nonzero().view(-1)
+        weights, order = torch.sort(edge_weights[positions], stable=True)
+        self.edge_ids = positions[order]  # position of every sorted edge in edge_index
+        self.edge_index = edge_index[:, self.edge_ids]
+        self.weights = weights
+        counts = torch.bincount(weights, minlength=max_distance + 1)[1:]
+        self.offsets = [0] + torch.cumsum(counts, dim=0).tolist()
+
+        self.edge_attr = edge_attr[self.edge_ids] if edge_attr is not None else None
+        self.nb_edge_types = nb_edge_types
+        self._stacked = {}
+        self._typed = None
+
+    def edges(self, d):
+        """The edges of hop d as a [2, #Edges_d] LongTensor."""
+        return self.edge_index[:, self.offsets[d - 1] : self.offsets[d]]
+
+    def _adjacency(self, rows, cols, shape):
+        values = torch.ones(rows.numel(), dtype=torch.float, device=self.device)
+        return torch.sparse_coo_tensor(
+            torch.stack([rows, cols]), values, shape
+        ).coalesce()
+
+    def stacked(self, min_hop=1):
+        """The [K * N, N] adjacency of all hops, with empty blocks for the hops below min_hop."""
+        if min_hop not in self._stacked:
+            start = self.offsets[min_hop - 1]
+            edges = self.edge_index[:, start:]
+            rows = (self.weights[start:] - 1) * self.nb_nodes + edges[0]
+            self._stacked[min_hop] = self._adjacency(
+                rows, edges[1], (self.max_distance * self.nb_nodes, self.nb_nodes)
+            )
+        return self._stacked[min_hop]
+
+    def aggregate(self, node_embeddings, min_hop=1):
+        """A [K, N, I] tensor, entry d - 1 sums the embeddings of the hop d neighbours (d >= min_hop)."""
+        out = torch.sparse.mm(self.stacked(min_hop), node_embeddings)
+        return out.view(self.max_distance, self.nb_nodes, -1)
+
+    def typed_direct(self):
+        """
+        The direct edges as a sparse [N, T * N] matrix whose block t holds the edges of type t, and
+        the list of types that occur.
+        """
+        if self._typed is None:
+            edges = self.edges(1)
+            types = self.edge_attr[: self.offsets[1]]
+            valid = torch.logical_and(types >= 0, types < self.nb_edge_types)
+            edges, types = edges[:, valid], types[valid]
+            present = torch.bincount(types, minlength=self.nb_edge_types).nonzero().view(-1).tolist()
+            matrix = self._adjacency(
+                edges[0],
+                types * self.nb_nodes + edges[1],
+                (self.nb_nodes, self.nb_edge_types * self.nb_nodes),
+            )
+            self._typed = (matrix, present)
+        return self._typed
+
+
 class GIN_HSP_Layer(torch.nn.Module):
     def __init__(
         self,
@@ -191,6 +277,7 @@ class GIN_HSP_Layer(torch.nn.Module):
         batch=None,
         edge_attr=None,
         direct_edge_embs=None,
+        hops=None,
     ):
         """
         :param node_embeddings: A FloatTensor of shape [N, In_dim]
@@ -200,6 +287,7 @@ class GIN_HSP_Layer(torch.nn.Module):
         :param edge_attr: (For multi-relational graphs) The edge types for
         :param direct_edge_embs: (For OGBG datasets), edge attributes that are summed with node attributes
         (then passed through ReLU).
+        :param hops: The HopAdjacency of the edges, shared by all layers. Built here if not given.
         :return: A forward propagation of the input through the HSP layer
         """
         if self.dataset and self.dataset in [
@@ -220,161 +308,80 @@ class GIN_HSP_Layer(torch.nn.Module):
             ) + self.direction_embedding(direct_edge_attr[:, 1])
 
         nb_nodes = node_embeddings.size(0)  # Number of nodes
-        unsq_node_embeddings = node_embeddings.unsqueeze(
-            0
-        )  # Unsqueezed embeddings, shape [1, N, In_Dim]
+        if hops is None:
+            hops = HopAdjacency(
+                edge_index,
+                edge_weights,
+                nb_nodes,
+                self.max_distance,
+                edge_attr=edge_attr if self.inside_aggr == "rsum" else None,
+                nb_edge_types=self.nb_edge_types,
+            )
         if self.inside_aggr == "sum":
-            by_hop_aggregates = torch.zeros(
-                size=(self.max_distance, nb_nodes, self.in_channels), dtype=torch.float
-            ).to(
-                self.device
-            )  # A [K, N, I] tensor
-            for d in range(1, self.max_distance + 1):
-                edges = edge_index.T[edge_weights == d].T  # Fetch the edges
-                if edges.numel() != 0:
-                    values = torch.ones(edges.shape[1], dtype=torch.float).to(
-                        self.device
-                    )
-                    sparse_adjacency_d = torch.sparse_coo_tensor(
-                        edges, values, (nb_nodes, nb_nodes)
-                    )  # [N,N] SpTensor
-                    by_hop_aggregates[d - 1, :, :] = torch.sparse.mm(
-                        sparse_adjacency_d, node_embeddings
-                    )
+            by_hop_aggregates = hops.aggregate(node_embeddings)  # A [K, N, I] tensor
         elif (
             self.inside_aggr == "edgesum"
         ):  # Summing while accounting for edge attributes (OGBG datasets)
             if direct_edge_embs is not None:
-                by_hop_aggregates = torch.zeros(
-                    size=(self.max_distance, nb_nodes, self.in_channels),
-                    dtype=torch.float,
-                ).to(
-                    self.device
-                )  # A [K, N, I] tensor
-                edges_direct = edge_index.T[
-                    edge_weights == 1
-                ].T  # Fetch the direct edges
+                edges_direct = hops.direct_edges  # The direct edges, in the order of direct_edge_embs
 
                 # K=1: Like OGB, sum node and edge attr, then apply a ReLU
-                if edges_direct.numel() != 0:
-                    # Link nodes to edges
-                    nb_edges = edges_direct.shape[1]
-                    edge_links = torch.cat(
-                        (
-                            edges_direct[0:1, :],
-                            torch.arange(nb_edges).unsqueeze(0).to(self.device),
-                        ),
-                        dim=0,
-                    )
-                    values = torch.ones(edges_direct.shape[1], dtype=torch.float).to(
-                        self.device
-                    )
-                    sparse_edge_adjacency = torch.sparse_coo_tensor(
-                        edge_links, values, (nb_nodes, nb_edges)
-                    )
-                    destination_node_embeddings = node_embeddings[
-                        edges_direct[1, :]
-                    ]  # [nb_edges, d]
-
-                    messages = destination_node_embeddings + direct_edge_embs
-                    if self.edgesum_relu:
-                        messages = torch.relu(messages)
-
-                    by_hop_aggregates[0, :, :] = torch.sparse.mm(
-                        sparse_edge_adjacency, messages
-                    )
+                messages = node_embeddings[edges_direct[1, :]] + direct_edge_embs
+                if self.edgesum_relu:
+                    messages = torch.relu(messages)
+                direct_aggregate = torch.zeros_like(node_embeddings).index_add(
+                    0, edges_direct[0, :], messages
+                )
 
                 # Now K=2 and above as standard
-                for d in range(2, self.max_distance + 1):
-                    edges = edge_index.T[edge_weights == d].T  # Fetch the edges
-                    if edges.numel() != 0:
-                        values = torch.ones(edges.shape[1], dtype=torch.float).to(
-                            self.device
-                        )
-                        sparse_adjacency_d = torch.sparse_coo_tensor(
-                            edges, values, (nb_nodes, nb_nodes)
-                        )  # [N,N] SpTensor
-                        by_hop_aggregates[d - 1, :, :] = torch.sparse.mm(
-                            sparse_adjacency_d, node_embeddings
-                        )
+                by_hop_aggregates = torch.cat(
+                    [
+                        direct_aggregate.unsqueeze(0),
+                        hops.aggregate(node_embeddings, min_hop=2)[1:],
+                    ]
+                )  # A [K, N, I] tensor
             else:
                 raise AttributeError("Edge Embeddings not provided")
 
         elif self.inside_aggr == "rsum":
-            assert edge_attr is not None
-            by_hop_aggregates = torch.zeros(
-                size=(self.max_distance, nb_nodes, self.in_channels), dtype=torch.float
-            ).to(
-                self.device
-            )  # A [K, N, I] tensor
-            # First step: k=1...
-            for t in range(self.nb_edge_types):
-                edges_direct_t = edge_index.T[
-                    torch.logical_and(edge_weights == 1, edge_attr == t)
-                ].T
-                if edges_direct_t.numel() != 0:
-                    values = torch.ones(edges_direct_t.shape[1], dtype=torch.float).to(
-                        self.device
-                    )
-                    transformed_node_emb = self.rel_mlps[t](node_embeddings)
-                    sparse_adjacency_t = torch.sparse_coo_tensor(
-                        edges_direct_t, values, (nb_nodes, nb_nodes)
-                    )
-                    by_hop_aggregates[0, :, :] += torch.sparse.mm(
-                        sparse_adjacency_t, transformed_node_emb
-                    )  # Add
+            assert hops.edge_attr is not None
+            # First step: k=1, the transformed embeddings of all types side by side
+            typed_adjacency, present_types = hops.typed_direct()
+            transformed_node_emb = [
+                self.rel_mlps[t](node_embeddings)
+                if t in present_types
+                else torch.zeros_like(node_embeddings)
+                for t in range(self.nb_edge_types)
+            ]
+            direct_aggregate = torch.sparse.mm(
+                typed_adjacency, torch.cat(transformed_node_emb, dim=0)
+            )
             # Second step: k>=2, just like before
             indirect_transform_node_emb = self.higher_hop_mlp(
                 node_embeddings
             )  # These are the transf representations
-            for d in range(2, self.max_distance + 1):
-                edges = edge_index.T[edge_weights == d].T  # Fetch the edges
-                if edges.numel() != 0:
-                    values = torch.ones(edges.shape[1], dtype=torch.float).to(
-                        self.device
-                    )
-                    sparse_adjacency_d = torch.sparse_coo_tensor(
-                        edges, values, (nb_nodes, nb_nodes)
-                    )  # [N,N] SpTensor
-                    by_hop_aggregates[d - 1, :, :] = torch.sparse.mm(
-                        sparse_adjacency_d, indirect_transform_node_emb
-                    )
-        else:
-            hops__K_N_N = torch.zeros(
-                size=(self.max_distance, nb_nodes, nb_nodes), dtype=torch.float
-            ).to(self.device)
-            for d in range(1, self.max_distance + 1):
-                edges = edge_index.T[edge_weights == d].T
-                if edges.numel() != 0:
-                    hops__K_N_N[d - 1] = to_dense_adj(edges, max_num_nodes=nb_nodes)[0]
-
-        if self.inside_aggr == "attn_nh":
+            by_hop_aggregates = torch.cat(
+                [
+                    direct_aggregate.unsqueeze(0),
+                    hops.aggregate(indirect_transform_node_emb, min_hop=2)[1:],
+                ]
+            )  # A [K, N, I] tensor
+        else:  # Attention over the hop-d neighbours, computed per edge
             by_hop_aggregates = torch.zeros(
                 size=(self.max_distance, nb_nodes, self.in_channels), dtype=torch.float
             ).to(self.device)
+            if self.inside_aggr == "attn_nh":
+                query = node_embeddings
+            elif self.inside_aggr == "global_attn_nh":
+                pooled = scatter_mean(node_embeddings, batch, dim=0).to(self.device)
+                query = pooled[batch]
             for d, attn_layer in enumerate(self.hop_level_attn):
-                # Torch standard attention returns nan, when there are no neighbours.
-                # As we use attention as a generalisation of sum, the value of the embedding should be 0 in this case.
-                nan_inverse_node_mask = hops__K_N_N[d].sum(axis=1) != 0
-                if nan_inverse_node_mask.sum() == 0:
-                    continue  # Skip if the attn mask is empty
-
-                nodes_for_attn = unsq_node_embeddings[:, nan_inverse_node_mask, :]
-                attn_mask = (
-                    hops__K_N_N[d, nan_inverse_node_mask, :][:, nan_inverse_node_mask]
-                    < 1
-                )
-                if self.inside_aggr == "attn_nh":
-                    query = nodes_for_attn
-                elif self.inside_aggr == "global_attn_nh":
-                    pooled = scatter_mean(node_embeddings, batch, dim=0).to(self.device)
-                    mean_emb__N_I = pooled[batch]
-                    query = mean_emb__N_I[nan_inverse_node_mask].unsqueeze(0)
-
-                after_attn__1_N_I, _ = attn_layer(
-                    query, nodes_for_attn, nodes_for_attn, attn_mask=attn_mask
+                edges = hops.edges(d + 1)
+                if edges.numel() == 0:
+                    continue  # Nodes without neighbours keep a 0 embedding, as in sum
+                by_hop_aggregates[d] = self.edge_attention(
+                    attn_layer, query, node_embeddings, edges
                 )
-                by_hop_aggregates[d, nan_inverse_node_mask, :] = after_attn__1_N_I[0]
 
         if self.outside_aggr in ["eps_weight", "weight"]:
             overall_hop_aggr = (
@@ -398,6 +405,39 @@ class GIN_HSP_Layer(torch.nn.Module):
 
         return out_embeddings
 
+    def edge_attention(self, attn_layer, query, node_embeddings, edges):
+        """
+        Multi-head attention of every node over its neighbours in `edges`, with the projections of
+        the MultiheadAttention module `attn_layer`. Equivalent to running the module on the whole
+        batch with a dense [N, N] mask, but the scores are only computed for the given edges and
+        normalised with a segment softmax over the source node. Nodes without edges get a 0 embedding.
+        :param query: A FloatTensor of shape [N, In_dim], the query of every node
+        :param node_embeddings: A FloatTensor of shape [N, In_dim], keys and values
+        :param edges: A LongTensor of shape [2, #Edges], node edges[0, e] attends to edges[1, e]
+        :return: A FloatTensor of shape [N, In_dim]
+        """
+        nb_nodes = node_embeddings.size(0)
+        nb_heads = attn_layer.num_heads
+        head_dim = self.in_channels // nb_heads
+        w_q, w_k, w_v = attn_layer.in_proj_weight.chunk(3)
+        b_q, b_k, b_v = attn_layer.in_proj_bias.chunk(3)
+        src, dst = edges[0], edges[1]
+
+        q = F.linear(query, w_q, b_q).view(nb_nodes, nb_heads, head_dim)
+        k = F.linear(node_embeddings, w_k, b_k).view(nb_nodes, nb_heads, head_dim)
+        v = F.linear(node_embeddings, w_v, b_v).view(nb_nodes, nb_heads, head_dim)
+
+        scores = (q[src] * k[dst]).sum(dim=-1) / head_dim**0.5  # [#Edges, H]
+        alpha = softmax(scores, src, num_nodes=nb_nodes)
+        alpha = F.dropout(alpha, p=attn_layer.dropout, training=self.training)
+        messages = (alpha.unsqueeze(-1) * v[dst]).view(-1, self.in_channels)
+        attended = torch.zeros_like(node_embeddings).index_add(0, src, messages)
+
+        out = attn_layer.out_proj(attended)
+        has_neighbours = torch.zeros(nb_nodes, dtype=torch.bool, device=out.device)
+        has_neighbours[src] = True
+        return out * has_neighbours.unsqueeze(-1)
+
     def reset_parameters(self):
         for (name, module) in self._modules.items():
             if hasattr(module, "reset_parameters"):
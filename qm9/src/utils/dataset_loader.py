@@ -5,14 +5,13 @@ from utils.datasets import ProximityDataset
 from torch_geometric.datasets import TUDataset
 from utils.shortest_paths import ShortestPathTransform
 import numpy as np
-from torch_geometric.data import Data
+from torch_geometric.data import Data, InMemoryDataset
 from ogb.graphproppred import PygGraphPropPredDataset
 import ogb
 import torch
 import gzip
-import pickle
-from torch_geometric.utils import add_self_loops, to_undirected, from_networkx
-import networkx as nx
+import hashlib
+import multiprocessing as mp
 
 
 CHEMICAL = ["NCI1", "ENZYMES", "PROTEINS", "DD"]
@@ -42,94 +41,164 @@ ogb_metric = {
     "ogbg-molclintox": "rocauc",
     "ogbg-molsider": "rocauc",
 }
+# bump when the stored QM9 graphs change, invalidates all QM9_proc caches
+QM9_CACHE_VERSION = 3
+QM9_HOM_DIM = 31  # 5 vertex + 6 cycle homcounts per atom
 
 
-def read_qm9(direc, file, transform_f, processed_root):
-    path = osp.join(direc, file + ".jsonl.gz")  # Added pre-storing
-    hom_path = osp.join(direc, file+"_homcounts.json") # Homcount file
-    with open(hom_path, 'r') as hom_f:
+def load_qm9_homcounts(direc, file):
+    """
+    Returns a function i -> homcounts of the i-th molecule of the split. Prefers the
+    memory-mapped pact count store `{file}_homcounts/` over the `{file}_homcounts.json` file.
+    """
+    store_path = osp.join(direc, file + "_homcounts")
+    if osp.isdir(store_path):
+        counts = np.load(osp.join(store_path, "counts.npy"), mmap_mode="r")
+        offsets = np.load(osp.join(store_path, "offsets.npy"))
+        graph_ids = np.load(osp.join(store_path, "graph_ids.npy"))
+        # the i-th graph of the store has to be the i-th molecule
+        assert np.array_equal(graph_ids, np.arange(len(graph_ids))), store_path + " must cover graphs 0..n-1"
+        return lambda i: counts[offsets[i]:offsets[i + 1]]
+
+    hom_path = osp.join(direc, file + "_homcounts.json")  # Homcount file
+    with open(hom_path, "r") as hom_f:
         hom_data = json.load(hom_f)
+    return lambda i: hom_data[str(i)]
+
+
+def read_qm9(direc, file, num_workers=None):
+    """Builds the graphs of a QM9 split with homcounts in a pool of worker processes."""
+    path = osp.join(direc, file + ".jsonl.gz")
+    hom_data = load_qm9_homcounts(direc, file)
+    with gzip.open(path, "r") as f:
+        lines = f.read().decode("utf-8").splitlines()
     
-    presaved_path = osp.join(processed_root, file + ".pre")
-    if not osp.exists(presaved_path):  # The file doesn't exist
-        with gzip.open(path, "r") as f:
-            data = f.read().decode("utf-8")
-            graphs = [json.loads(jline) for jline in data.splitlines()]
-            # pyg_graphs = [
-            #     # transform_f(
-            #     map_qm9_to_pyg(graph)
-            #     # map_qm9_to_pyg(graph, make_undirected=True, remove_dup=False)
-            #     # )
-            #     for graph in graphs
-            # ]
-            # new graphs with homcounts as node features
-            pyg_graphs = []
-
-            for i in range(len(graphs)):
-                pyg = map_qm9_to_pyg(graphs[i], hom_data[str(i)])
-                pyg_graphs.append(pyg)
-            
-            if not osp.exists(processed_root):
-                os.mkdir(processed_root)
-            with open(presaved_path, "wb") as g:  # Save for future reference
-                pickle.dump(pyg_graphs, g)
-                g.close()
-            f.close()
-            print(pyg_graphs[0].fa_edge_attr)
-            return pyg_graphs
-    else:  # Load the pre-existing file
-        with open(presaved_path, "rb") as g:
-            pyg_graphs = pickle.load(g)
-            g.close()
-        return pyg_graphs
-    
-    
-def map_qm9_to_pyg(json_file, homcounts):
+    # new graphs with homcounts as node features
+    jobs = ((line, np.asarray(hom_data(i), dtype=np.float32)) for i, line in enumerate(lines))
+    with mp.Pool(num_workers or os.cpu_count()) as pool:
+        return [arrays_to_data(arrays) for arrays in pool.imap(_map_qm9_line, jobs, chunksize=256)]
+
+
+def _file_hash(path):
+    sha = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def qm9_cache_key(direc, file):
+    """Hash of the raw split, its homcounts (json file or count store) and the cache format."""
+    store_path = osp.join(direc, file + "_homcounts")
+    if osp.isdir(store_path):
+        hom_files = [osp.join(store_path, "counts.npy"), osp.join(store_path, "offsets.npy")]
+    else:
+        hom_files = [osp.join(direc, file + "_homcounts.json")]
+    sha = hashlib.sha1(str(QM9_CACHE_VERSION).encode())
+    for path in [osp.join(direc, file + ".jsonl.gz")] + hom_files:
+        sha.update(_file_hash(path).encode())
+    return sha.hexdigest()[:16]
+
+
+class QM9Split(InMemoryDataset):
+    """
+    A QM9 split (train, valid or test) stored collated like ProximityDataset, but with one .npy file
+    per attribute (and its slices) that is memory-mapped when loaded. The processed files live in
+    `{processed_root}/{file}_{key}`, where the key hashes the raw split and its homcounts, so
+    changing either builds a new cache. The homcounts are only read when the cache is built.
+    """
+
+    def __init__(self, direc, file, processed_root, num_workers=None):
+        self.direc = direc
+        self.file = file
+        self.num_workers = num_workers
+        super().__init__(osp.join(processed_root, file + "_" + qm9_cache_key(direc, file)))
+        self.data, self.slices = self.load_collated(self.processed_dir)
+
+    @property
+    def raw_file_names(self):
+        return []
+
+    @property
+    def processed_file_names(self):
+        return ["keys.json"]  # written last, once all attributes are stored
+
+    def download(self):
+        pass
+
+    def process(self):
+        data, slices = self.collate(read_qm9(self.direc, self.file, num_workers=self.num_workers))
+        keys = []
+        for key, value in data:
+            np.save(osp.join(self.processed_dir, key + ".npy"), value.numpy())
+            np.save(osp.join(self.processed_dir, key + ".slices.npy"), slices[key].numpy())
+            keys.append(key)
+        with open(self.processed_paths[0], "w") as f:
+            json.dump(keys, f)
+
+    @staticmethod
+    def load_collated(path):
+        with open(osp.join(path, "keys.json"), "r") as f:
+            keys = json.load(f)
+        # copy-on-write maps, so that the tensors are writable without reading the files up front
+        data = Data(**{key: torch.from_numpy(np.load(osp.join(path, key + ".npy"), mmap_mode="c"))
+                       for key in keys})
+        slices = {key: torch.from_numpy(np.load(osp.join(path, key + ".slices.npy"))) for key in keys}
+        return data, slices
+
+
+def _map_qm9_line(job):
+    # runs in the pool workers, which send back numpy arrays instead of tensors (no shared memory handles)
+    line, homcounts = job
+    return qm9_graph_arrays(json.loads(line), homcounts)
+
+
+def qm9_graph_arrays(json_file, homcounts):
+    """
+    The arrays of map_qm9_to_pyg for one molecule as a dict of numpy arrays. The graph is made
+    undirected like `to_undirected` (sorted by source and target, types of duplicate edges are added)
+    and gets self-loops of type 0. The homcounts are padded with zero rows up to the number of atoms,
+    trailing isolated vertices have no stored counts.
+    """
     # We're making the graph undirected just like the original repo.
-    # Note: make_undirected makes duplicate edges, so we need to preserve edge types.
     # Note: The original repo also add self-loops. We don't need that given how we see hops.
-    edge_index = np.array([[g[0], g[2]] for g in json_file["graph"]]).T  # Edge Index
-    edge_attributes = np.array([g[1] for g in json_file["graph"]])  # Edge type (-1 to put in [0, 3] range)
-
-    edge_index, edge_attributes = to_undirected(torch.LongTensor(edge_index), torch.LongTensor(edge_attributes))
-    edge_index, edge_attributes = add_self_loops(torch.LongTensor(edge_index), torch.LongTensor(edge_attributes), fill_value=0.)
-
-    # now do the FA stuff
-    # build edge2type dict for original graph
-    edge2type_dict = {}
-    for i in range(edge_index.size()[1]):
-        edge = (
-            int(edge_index[0][i]),
-            int(edge_index[1][i])
-        )
-        edge2type_dict[edge] = int(edge_attributes[i])
-    
-    num_nodes = np.array(json_file["node_features"]).shape[0]
-    complete_nx = nx.complete_graph(num_nodes)
-    complete_pg = from_networkx(complete_nx)
-    fa_edge_index = add_self_loops(complete_pg.edge_index)[0]
-    
-    # get edge types for FA graph
-    fa_edge_attr = []
-    for i in range(fa_edge_index.size()[1]):
-        edge = (
-            int(fa_edge_index[0][i]),
-            int(fa_edge_index[1][i])
-        )
-        try:
-            fa_edge_attr.append(edge2type_dict[edge])
-        except:
-            fa_edge_attr.append(0) # dummy edge type for FA connections
-            
-    fa_edge_index = torch.LongTensor(fa_edge_index)
-    fa_edge_attr = torch.LongTensor(fa_edge_attr)
-    
-    # set data 
-    x = torch.FloatTensor(np.array(json_file["node_features"]))
-    graph_hom = torch.FloatTensor(np.array(homcounts))
-    
-    y = torch.FloatTensor(np.array(json_file["targets"]).T)
-    return Data(x=x, edge_index=edge_index, edge_attr=edge_attributes, graph_hom=graph_hom, fa_edge_index=fa_edge_index, fa_edge_attr=fa_edge_attr, y=y)
+    bonds = np.array(json_file["graph"], dtype=np.int64).reshape(-1, 3)
+    src = np.concatenate([bonds[:, 0], bonds[:, 2]])
+    dst = np.concatenate([bonds[:, 2], bonds[:, 0]])
+    types = np.concatenate([bonds[:, 1], bonds[:, 1]])
+
+    # coalesce, num_nodes is inferred from the edges as in PyG
+    n_edge_nodes = int(max(src.max(), dst.max())) + 1 if len(src) > 0 else 0
+    keys, inverse = np.unique(src * n_edge_nodes + dst, return_inverse=True)
+    edge_attr = np.zeros(len(keys), dtype=np.int64)
+    np.add.at(edge_attr, inverse, types)
+    loops = np.arange(n_edge_nodes, dtype=np.int64)
+    edge_index = np.concatenate([np.stack([keys // max(n_edge_nodes, 1), keys % max(n_edge_nodes, 1)]),
+                                 np.stack([loops, loops])], axis=1)
+    edge_attr = np.concatenate([edge_attr, np.zeros(n_edge_nodes, dtype=np.int64)])
+
+    # The fully-adjacent graph of the FA models is not stored, the FA layer only needs the bonds
+    x = np.array(json_file["node_features"], dtype=np.float32)
+    hom = np.asarray(homcounts, dtype=np.float32).reshape(-1, QM9_HOM_DIM)
+    assert len(hom) <= len(x), "more homcount rows than atoms"
+    graph_hom = np.zeros((len(x), QM9_HOM_DIM), dtype=np.float32)
+    graph_hom[:len(hom)] = hom
+
+    return dict(
+        x=x,
+        edge_index=edge_index,
+        edge_attr=edge_attr,
+        graph_hom=graph_hom,
+        y=np.array(json_file["targets"], dtype=np.float32).T,
+    )
+
+
+def arrays_to_data(arrays):
+    return Data(**{key: torch.from_numpy(value) for key, value in arrays.items()})
+
+
+def map_qm9_to_pyg(json_file, homcounts):
+    return arrays_to_data(qm9_graph_arrays(json_file, homcounts))
 
 
 # def map_qm9_to_pyg(json_file, make_undirected=True, remove_dup=False):
@@ -186,7 +255,7 @@ def get_dataset(args, root_dir):
             dataset_path,
             name=args.dataset,
             use_node_attr=True,
-            pre_transform=transform_class.transform,
+            pre_transform=transform_class,
         )
         with open(
             osp.join(
@@ -200,29 +269,23 @@ def get_dataset(args, root_dir):
         dataset = PygGraphPropPredDataset(
             name=args.dataset,
             root=dataset_path,
-            pre_transform=transform_class.transform,
+            pre_transform=transform_class,
         )
         evaluator = ogb.graphproppred.Evaluator(args.dataset)
         metric = ogb_metric[args.dataset]
         return dataset, evaluator, metric
     elif args.dataset == "QM9":  # Graph Regression. This is re-computing it every time
         qm9_proc_root = osp.join(dataset_path, "QM9_proc")
-        tr_graphs = read_qm9(
-            dataset_path, "train", transform_class.transform, qm9_proc_root
-        )
-        val_graphs = read_qm9(
-            dataset_path, "valid", transform_class.transform, qm9_proc_root
-        )
-        tst_graphs = read_qm9(
-            dataset_path, "test", transform_class.transform, qm9_proc_root
-        )
+        tr_graphs = QM9Split(dataset_path, "train", qm9_proc_root)
+        val_graphs = QM9Split(dataset_path, "valid", qm9_proc_root)
+        tst_graphs = QM9Split(dataset_path, "test", qm9_proc_root)
         num_feat = 15  # + 30 dim of all-5 vertex homcounts + 1 6 cycle
         num_pred = 13  # Class here really is used in the sense of
         return tr_graphs, val_graphs, tst_graphs, num_feat, num_pred
     elif args.dataset.endswith("Prox"):
         dataset_path = osp.join(root_dir, "data", "Prox", args.dataset)
         dataset = ProximityDataset(
-            root=dataset_path, pre_transform=transform_class.transform
+            root=dataset_path, pre_transform=transform_class
         )
         with open(
             osp.join(root_dir, "data_splits", "Prox", args.dataset + "_splits.json"),
@@ -1,3 +1,7 @@
+import os
+import multiprocessing as mp
+import numpy as np
+import scipy.sparse as sp
 import torch
 from scipy.sparse.csgraph import floyd_warshall
 from torch_geometric.utils import to_dense_adj, to_undirected
@@ -109,17 +113,136 @@ def transform_graph_sp(graph, max_distance=None):
     return graph
 
 
+def undirected_edges(num_nodes, edge_index, edge_attr=None):
+    """
+    Numpy version of to_undirected(edge_index, edge_attr, reduce="max") followed by remove_self_loops:
+    the edges in both directions, sorted by (src, dst), without duplicates and self-loops.
+    """
+    row = np.concatenate([edge_index[0], edge_index[1]])
+    col = np.concatenate([edge_index[1], edge_index[0]])
+    keep = row != col
+    keys = (row * num_nodes + col)[keep]
+    by_key = np.argsort(keys, kind="stable")
+    keys = keys[by_key]
+    first = np.ones(len(keys), dtype=bool)  # First occurrence of every edge
+    first[1:] = keys[1:] != keys[:-1]
+    edges = np.stack([keys[first] // num_nodes, keys[first] % num_nodes])
+    if edge_attr is None:
+        return edges, None
+
+    attr = np.concatenate([edge_attr, edge_attr])[keep][by_key]
+    if len(attr) == 0:
+        return edges, attr
+    return edges, np.maximum.reduceat(attr, np.flatnonzero(first), axis=0)
+
+
+def _bfs_dense(num_nodes, edges, max_distance):
+    adjacency = np.zeros((num_nodes, num_nodes), dtype=np.float32)
+    adjacency[edges[0], edges[1]] = 1
+    dist = np.full((num_nodes, num_nodes), -1, dtype=np.int64)
+    np.fill_diagonal(dist, 0)
+    frontier = np.eye(num_nodes, dtype=np.float32)
+    d = 0
+    while max_distance is None or d < max_distance:
+        d += 1
+        reached = np.logical_and(frontier @ adjacency > 0, dist < 0)
+        if not reached.any():
+            break
+        dist[reached] = d
+        frontier = reached.astype(np.float32)
+    dst, src = np.nonzero(dist.T >= 0)
+    return src, dst, dist[src, dst]
+
+
+def _bfs_sparse(num_nodes, edges, max_distance):
+    adjacency = sp.csr_matrix(
+        (np.ones(edges.shape[1], dtype=np.int32), (edges[0], edges[1])),
+        shape=(num_nodes, num_nodes),
+    )
+    reached = sp.identity(num_nodes, dtype=np.int32, format="csr")
+    frontier = reached
+    srcs, dsts = [np.arange(num_nodes)], [np.arange(num_nodes)]
+    dists = [np.zeros(num_nodes, dtype=np.int64)]
+    d = 0
+    while frontier.nnz > 0 and (max_distance is None or d < max_distance):
+        d += 1
+        frontier = (frontier @ adjacency).astype(bool).astype(np.int32)
+        frontier = frontier - frontier.multiply(reached)  # Drop the pairs reached at a smaller distance
+        frontier.eliminate_zeros()
+        reached = reached + frontier
+        src, dst = frontier.nonzero()
+        srcs.append(src)
+        dsts.append(dst)
+        dists.append(np.full(len(src), d, dtype=np.int64))
+
+    src, dst, dist = np.concatenate(srcs), np.concatenate(dsts), np.concatenate(dists)
+    order = np.lexsort((src, dst))
+    return src[order], dst[order], dist[order]
+
+
+def shortest_path_pairs(num_nodes, edges, max_distance=None, threshold=1000):
+    """
+    Truncated BFS from all nodes at once: the frontier of distance d is the product of the frontier of
+    distance d - 1 with the adjacency, minus the pairs reached before. Small graphs use dense matrices,
+    graphs with more than `threshold` nodes a CSR adjacency, so that only the pairs within max_distance
+    are materialised.
+    :param edges: Undirected edges without self-loops, as returned by undirected_edges
+    :return: Numpy arrays (src, dst, dist) of all pairs (including (v, v, 0)) with dist <= max_distance,
+    ordered by (dst, src) as in the dense N * N edge index of transform_graph_sp_small.
+    """
+    if num_nodes > threshold:
+        return _bfs_sparse(num_nodes, edges, max_distance)
+    return _bfs_dense(num_nodes, edges, max_distance)
+
+
+def transform_graph_sp_bfs(graph, max_distance=None, threshold=1000):
+    """
+    Same output as transform_graph_sp_small, computed with shortest_path_pairs instead of a dense
+    Floyd-Warshall. Pairs of nodes in different connected components are left out (they carried an
+    undefined weight before). Self-loops of the input graph are ignored.
+    """
+    has_attr = hasattr(graph, "edge_attr") and graph.edge_attr is not None
+    edges, attr = undirected_edges(
+        graph.num_nodes,
+        graph.edge_index.numpy(),
+        graph.edge_attr.numpy() if has_attr else None,
+    )
+    src, dst, dist = shortest_path_pairs(graph.num_nodes, edges, max_distance, threshold)
+
+    if has_attr:
+        mask_dist_1 = dist == 1
+        src[mask_dist_1], dst[mask_dist_1] = edges
+        edge_attr = np.zeros((len(dist),) + attr.shape[1:], dtype=attr.dtype)
+        edge_attr[mask_dist_1] = attr
+        graph.edge_attr = torch.from_numpy(edge_attr)
+    graph.edge_index = torch.from_numpy(np.stack([src, dst]))
+    graph.edge_weights = torch.from_numpy(dist)
+
+    return graph
+
+
 class ShortestPathTransform:
-    def __init__(self, max_distance=None, threshold=8196):
+    def __init__(self, max_distance=None, threshold=1000, num_workers=None):
         self.max_distance = max_distance
         self.threshold = threshold
+        self.num_workers = num_workers
 
     def transform(self, graph):
         if graph.x is None:
             # For ogbg-ppa
             graph.x = torch.zeros(graph.num_nodes, dtype=torch.long)
 
-        if graph.num_nodes > self.threshold or graph.num_edges == 0:
-            return transform_graph_sp(graph, self.max_distance)
-        else:
-            return transform_graph_sp_small(graph, self.max_distance)
+        return transform_graph_sp_bfs(graph, self.max_distance, self.threshold)
+
+    __call__ = transform
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}(max_distance={self.max_distance})"
+
+    def transform_all(self, graphs):
+        """Transforms a list of graphs in a process pool."""
+        num_workers = self.num_workers or os.cpu_count()
+        if num_workers <= 1:
+            return [self.transform(graph) for graph in graphs]
+        with mp.Pool(num_workers) as pool:
+            return pool.map(self.transform, graphs, chunksize=64)
@@ -0,0 +1,123 @@
+import json
+import os
+import os.path as osp
+import queue
+import shutil
+import threading
+import time
+
+
+TRACKERS = ["local", "neptune", "none"]
+
+
+def _plain(value):
+    # Torch / numpy scalars to Python numbers, so that they can be written as json
+    if hasattr(value, "item") and getattr(value, "ndim", 0) == 0:
+        return value.item()
+    if isinstance(value, (int, float, str, bool)) or value is None:
+        return value
+    if isinstance(value, (list, tuple)):
+        return [_plain(v) for v in value]
+    if isinstance(value, dict):
+        return {str(k): _plain(v) for k, v in value.items()}
+    return str(value)
+
+
+class _Field:
+    # The object returned by tracker[key], mirrors the neptune field API used by the experiments
+    def __init__(self, tracker, key):
+        self.tracker = tracker
+        self.key = key
+
+    def log(self, value):
+        self.tracker.log(self.key, value)
+
+    def upload(self, path):
+        self.tracker.upload(self.key, path)
+
+
+class LocalTracker:
+    """
+    Experiment tracker writing to a local run directory, with the same item access as a neptune run
+    (tracker[key].log(value), tracker[key].upload(path), tracker[key] = value, tracker.stop()).
+    Logged values are buffered and appended to metrics.jsonl by a background thread every flush_every
+    values, uploaded files are copied to files/<key> by the same thread. Nothing is sent over the network.
+    """
+
+    def __init__(self, log_dir, name=None, flush_every=200):
+        name = name or time.strftime("%Y%m%d-%H%M%S") + "-" + str(os.getpid())
+        self.run_dir = osp.join(log_dir, name)
+        os.makedirs(self.run_dir, exist_ok=True)
+        self.flush_every = flush_every
+        self.steps = {}  # Per key step counter, like neptune series
+        self.buffer = []
+        self.queue = queue.Queue()
+        self.writer = threading.Thread(target=self._write_loop, daemon=True)
+        self.writer.start()
+
+    def __getitem__(self, key):
+        return _Field(self, key)
+
+    def __setitem__(self, key, value):
+        self.queue.put(("json", key, _plain(value)))
+
+    def log(self, key, value):
+        step = self.steps.get(key, 0)
+        self.steps[key] = step + 1
+        self.buffer.append({"key": key, "step": step, "value": _plain(value), "time": time.time()})
+        if len(self.buffer) >= self.flush_every:
+            self.flush()
+
+    def upload(self, key, path):
+        if not osp.exists(path):
+            print("Tracker: " + path + " does not exist, not uploaded to " + key)
+            return
+        self.queue.put(("file", key, path))
+
+    def flush(self):
+        if self.buffer:
+            self.queue.put(("metrics", None, self.buffer))
+            self.buffer = []
+
+    def stop(self):
+        self.flush()
+        self.queue.put(None)
+        self.writer.join()
+
+    def _write_loop(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            kind, key, payload = item
+            if kind == "metrics":
+                with open(osp.join(self.run_dir, "metrics.jsonl"), "a") as f:
+                    f.writelines(json.dumps(record) + "\n" for record in payload)
+            elif kind == "json":
+                with open(osp.join(self.run_dir, key.replace("/", "_") + ".json"), "w") as f:
+                    json.dump(payload, f, indent=2)
+            elif kind == "file":
+                target = osp.join(self.run_dir, "files", key + osp.splitext(payload)[1])
+                os.makedirs(osp.dirname(target), exist_ok=True)
+                shutil.copyfile(payload, target)
+
+
+def get_tracker(config, section="DEFAULT"):
+    """
+    The tracker selected in config.ini: local (default), neptune, or none, in which case None is returned
+    and nothing is logged.
+    """
+    settings = config[section]
+    tracker = settings.get("tracker", "local")
+    if tracker == "local":
+        return LocalTracker(settings.get("log_dir", "runs"))
+    if tracker == "neptune":
+        import neptune  # Only needed for this backend
+
+        return neptune.init_run(
+            project=settings["neptune_project"],
+            api_token=settings["neptune_token"],
+        )
+    if tracker == "none":
+        return None
+    raise ValueError("Invalid tracker " + tracker + ", use one of " + str(TRACKERS))